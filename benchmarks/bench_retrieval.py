@@ -0,0 +1,101 @@
+"""
+历史检索规模基准测试 - 向历史库逐级写入 1千 到 100万 条合成命令历史，测量各检索模式的延迟随规模的变化
+
+嵌入由 offline.py 中的假嵌入模型计算（可模拟远程API延迟），不需要网络。
+各规模共用同一个历史库，每级只追加与上一级的差额；每级报告写入耗时、磁盘占用、进程峰值RSS，
+以及词法、向量、混合三种模式的查询吞吐量和延迟百分位数（按嵌入、向量查询、BM25查询分阶段）。
+
+用法:
+    python benchmarks/bench_retrieval.py [--sizes 1000,10000,100000,1000000] [--queries N] [--dimensions D]
+        [--embedding-latency-ms MS] [--json FILE]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from offline import FakeEmbeddings, max_rss_mb, percentile, seed_history, synthetic_history  # noqa: E402
+from shell_agent.rag_search import RETRIEVAL_MODES, RAGSearch  # noqa: E402
+from shell_agent.tracing import Trace  # noqa: E402
+
+# 查询使用与历史记录不同的随机种子，模拟相似但不完全相同的新请求
+QUERY_SEED = 1
+
+
+def directory_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1024 / 1024
+
+
+def measure_queries(rag_search, queries, mode, k):
+    """执行全部查询，返回 (每秒查询数, {阶段: 耗时列表(ms)})"""
+    stages = {"query": []}
+    start = time.perf_counter()
+    for query in queries:
+        trace = Trace("retrieval", mode=mode)
+        with trace.activate():
+            rag_search.get_similar_commands(query, k=k, mode=mode)
+        summary = trace.summary()
+        stages["query"].append(summary["total_ms"])
+        for kind, duration in summary["by_kind_ms"].items():
+            stages.setdefault(kind, []).append(duration)
+    return len(queries) / (time.perf_counter() - start), stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史检索规模基准测试")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="逗号分隔的历史规模，如 1000,10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200, help="每种模式每级规模的查询数")
+    parser.add_argument("--k", type=int, default=3, help="每次查询返回的结果数")
+    parser.add_argument("--dimensions", type=int, default=64, help="假嵌入模型的向量维度")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0, help="每次嵌入调用的模拟延迟")
+    parser.add_argument("--batch-size", type=int, default=5000, help="写入历史时每批的记录数")
+    parser.add_argument("--json", metavar="FILE", help="把统计结果写入JSON文件")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    queries = [record["user_input"] for record in synthetic_history(args.queries, seed=QUERY_SEED)]
+    db_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    report = []
+    try:
+        rag_search = RAGSearch(persist_directory=db_dir, embedding_backend="fake", write_behind=False,
+                               embedding_cache_size=0,
+                               embeddings=FakeEmbeddings(args.dimensions, latency_ms=args.embedding_latency_ms))
+        seeded = 0
+        print(f"{'规模':>9} {'模式':<8} {'查询/秒':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}  各阶段 p50/p99(ms)")
+        for size in sizes:
+            seed_seconds = seed_history(rag_search, size - seeded, batch_size=args.batch_size, start=seeded)
+            seeded = size
+            level = {"size": size, "seed_seconds": round(seed_seconds, 3),
+                     "disk_mb": round(directory_size_mb(db_dir), 1), "max_rss_mb": round(max_rss_mb(), 1), "modes": {}}
+            for mode in RETRIEVAL_MODES:
+                measure_queries(rag_search, queries[:10], mode, args.k)  # 预热
+                rate, stages = measure_queries(rag_search, queries, mode, args.k)
+                level["modes"][mode] = {"qps": round(rate, 2), "stages": {
+                    kind: {q: round(percentile(values, q), 3) for q in (50, 95, 99)} for kind, values in stages.items()
+                }}
+                query = level["modes"][mode]["stages"]["query"]
+                details = "  ".join(f"{kind} {row[50]:.2f}/{row[99]:.2f}"
+                                    for kind, row in level["modes"][mode]["stages"].items() if kind != "query")
+                print(f"{size:>9} {mode:<8} {rate:>9.1f} {query[50]:>9.2f} {query[95]:>9.2f} {query[99]:>9.2f}  {details}")
+            print(f"{size:>9} 写入 {seed_seconds:.2f}s，磁盘 {level['disk_mb']}MB，进程峰值RSS {level['max_rss_mb']}MB")
+            report.append(level)
+        rag_search.close()
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Shell进程池基准测试 - 比较每条命令新建子进程与复用常驻bash进程的每秒命令数
+
+用法:
+    python benchmarks/bench_shell_pool.py [--commands N] [--threads N] [--pool-size N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_agent.context import request_context  # noqa: E402
+from shell_agent.shell_executor import ShellExecutor  # noqa: E402
+from shell_agent.shell_pool import ShellPool  # noqa: E402
+
+# 典型的短命令：内建命令、单个外部程序和简单管道
+COMMANDS = ["echo hello", "pwd", "ls /", "date +%s", "printf 'a\\nb\\n' | wc -l"]
+
+
+def run_case(executor, commands, threads, session_id=None):
+    """执行全部命令，返回 (每秒命令数, 单条耗时列表(ms))"""
+    def run_one(command):
+        with request_context(session_id=session_id):
+            start = time.perf_counter()
+            success, output = executor.execute_command(command)
+            assert success, output
+            return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if threads == 1:
+        latencies = [run_one(command) for command in commands]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(run_one, commands))
+    return len(commands) / (time.perf_counter() - start), sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shell进程池基准测试")
+    parser.add_argument("--commands", type=int, default=500, help="每种方式执行的命令数")
+    parser.add_argument("--threads", type=int, default=1, help="并发执行命令的线程数")
+    parser.add_argument("--pool-size", type=int, default=4, help="共享worker数")
+    args = parser.parse_args()
+
+    commands = [COMMANDS[i % len(COMMANDS)] for i in range(args.commands)]
+    pool = ShellPool(size=args.pool_size, max_commands=10 ** 9)
+    cases = [
+        ("每条命令新建进程", ShellExecutor(guard=None), None),
+        ("进程池（共享worker，子shell隔离）", ShellExecutor(guard=None, shell_pool=pool), None),
+        ("进程池（会话worker）", ShellExecutor(guard=None, shell_pool=pool), "bench"),
+    ]
+    if args.threads > 1:
+        # 会话worker串行执行同一会话的命令，并发测试中不具可比性
+        cases = cases[:2]
+
+    try:
+        print(f"{'方式':<36} {'命令/秒':>10} {'平均(ms)':>10} {'p50(ms)':>10} {'p99(ms)':>10}")
+        for name, executor, session_id in cases:
+            run_case(executor, commands[:20], args.threads, session_id)  # 预热，启动worker
+            rate, latencies = run_case(executor, commands, args.threads, session_id)
+            print(f"{name:<36} {rate:>10.1f} {statistics.mean(latencies):>10.2f} "
+                  f"{latencies[len(latencies) // 2]:>10.2f} {latencies[int(len(latencies) * 0.99) - 1]:>10.2f}")
+        print(f"\n进程池统计: {pool.stats()}")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+启动耗时基准测试 - 测量导入耗时、ShellAgent 构造耗时（立即/延迟初始化）以及一次短命令调用的总耗时
+
+每次测量都在新的Python进程中进行，避免模块缓存的影响。指定阈值时，中位数超过阈值则以非零状态退出，
+可在持续集成中用于发现启动耗时的回退。
+
+用法:
+    python benchmarks/bench_startup.py [--runs N] [--importtime] [--max-import-ms MS] [--max-lazy-ms MS]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程中执行的代码，{setup} 之前的导入计入 import_ms，之后计入 init_ms
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+{imports}
+imported = time.perf_counter()
+{setup}
+done = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "init_ms": (done - imported) * 1000,
+                   "heavy_modules": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+# 冷启动时希望避免导入的重量级模块
+HEAVY_MODULES = ("langchain.agents", "langchain_openai", "openai", "langchain_chroma", "chromadb",
+                 "langchain_text_splitters")
+
+AGENT_ARGS = "rag_persist_directory={db_dir!r}, embedding_backend='hashing', write_behind_history=False"
+
+CASES = [
+    ("导入 shell_agent.agent", "import shell_agent.agent", ""),
+    ("导入 main.py", "import main", ""),
+    ("构造 ShellAgent（立即初始化）", "from shell_agent.agent import ShellAgent",
+     "agent = ShellAgent(" + AGENT_ARGS + ")"),
+    ("构造 ShellAgent（延迟初始化）", "from shell_agent.agent import ShellAgent",
+     "agent = ShellAgent(" + AGENT_ARGS + ", lazy_init=True)"),
+    ("延迟初始化 + 执行一条字面命令", "from shell_agent.agent import ShellAgent",
+     "agent = ShellAgent(" + AGENT_ARGS + ", lazy_init=True)\n"
+     "agent.process_input('echo hello')\n"
+     "agent.close()"),
+]
+
+
+def run_case(imports, setup, db_dir, env):
+    """在新进程中执行一次测量，返回 (进程总耗时ms, 进程内测量结果)"""
+    code = SNIPPET.format(root=ROOT, imports=imports, setup=setup.format(db_dir=db_dir), heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True,
+                               text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    # ShellAgent 会打印初始化信息，测量结果是最后一行
+    return wall_ms, json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_importtime(env, top):
+    """用 -X importtime 列出导入 shell_agent.agent 时累计耗时最多的模块"""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import shell_agent.agent"],
+                               cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    print(f"\n导入 shell_agent.agent 时累计耗时最多的 {top} 个模块:")
+    for cumulative_us, module in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:>8.1f}ms  {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="每种情况的测量次数")
+    parser.add_argument("--importtime", action="store_true", help="额外列出导入耗时最多的模块")
+    parser.add_argument("--max-import-ms", type=float, help="导入 shell_agent.agent 的中位数耗时上限")
+    parser.add_argument("--max-lazy-ms", type=float, help="延迟初始化时构造 ShellAgent 的中位数进程总耗时上限")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # 构造LLM客户端需要API密钥，测试中不会发起请求
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    db_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    results = {}
+    try:
+        # 先创建一次数据库，测量的是打开已有数据库的情况
+        run_case(CASES[2][1], CASES[2][2], db_dir, env)
+        print(f"{'情况':<32} {'进程总耗时(ms)':>14} {'导入(ms)':>10} {'初始化(ms)':>12}  已导入的重量级模块")
+        for name, imports, setup in CASES:
+            samples = [run_case(imports, setup, db_dir, env) for _ in range(args.runs)]
+            wall = statistics.median(sample[0] for sample in samples)
+            import_ms = statistics.median(sample[1]["import_ms"] for sample in samples)
+            init_ms = statistics.median(sample[1]["init_ms"] for sample in samples)
+            results[name] = (wall, import_ms, init_ms)
+            heavy = ", ".join(samples[-1][1]["heavy_modules"]) or "-"
+            print(f"{name:<32} {wall:>14.1f} {import_ms:>10.1f} {init_ms:>12.1f}  {heavy}")
+        if args.importtime:
+            print_importtime(env, top=15)
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    failures = []
+    if args.max_import_ms is not None and results[CASES[0][0]][1] > args.max_import_ms:
+        failures.append(f"导入耗时 {results[CASES[0][0]][1]:.1f}ms 超过上限 {args.max_import_ms}ms")
+    if args.max_lazy_ms is not None and results[CASES[3][0]][0] > args.max_lazy_ms:
+        failures.append(f"延迟初始化的进程总耗时 {results[CASES[3][0]][0]:.1f}ms 超过上限 {args.max_lazy_ms}ms")
+    for failure in failures:
+        print(f"回退: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
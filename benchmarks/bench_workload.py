@@ -0,0 +1,151 @@
+"""
+离线工作负载基准测试 - 用脚本化的假LLM和假嵌入模型回放请求工作负载，统计吞吐量和各阶段的延迟与内存
+
+不需要网络和API密钥：LLM和嵌入调用由 offline.py 中的假模型按配置的延迟模拟，命令真实执行。
+工作负载为JSONL文件，--trace-file 写出的追踪记录和 --batch 的输入文件都可以直接回放。
+阶段即追踪记录中的span类别（llm、tool、embedding、vector_query、lexical_query、subprocess等），
+内存为各阶段期间Python堆的净增长（tracemalloc），只在串行回放时准确。
+
+用法:
+    python benchmarks/bench_workload.py [--workload FILE] [--repeat N] [--concurrency N] [--pipeline agent|direct|speculative]
+        [--llm-latency-ms MS] [--embedding-latency-ms MS] [--history N] [--json FILE]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from offline import FakeChatModel, FakeEmbeddings, load_workload, max_rss_mb, percentile, seed_history  # noqa: E402
+from shell_agent.agent import PIPELINE_MODES, ShellAgent  # noqa: E402
+from shell_agent.rag_search import RETRIEVAL_MODES  # noqa: E402
+from shell_agent.runner import ConcurrentRunner  # noqa: E402
+
+DEFAULT_WORKLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workloads", "sample.jsonl")
+
+
+def replay(agent, requests, concurrency):
+    """回放请求，返回 (结果列表, 总耗时秒)"""
+    start = time.perf_counter()
+    if concurrency == 1:
+        results = []
+        for request in requests:
+            started = time.perf_counter()
+            result = agent.process_input(request["input"], tenant=request.get("tenant"),
+                                         session_id=request.get("session_id"))
+            result.setdefault("timings", {}).setdefault("total_ms", (time.perf_counter() - started) * 1000)
+            results.append(result)
+    else:
+        runner = ConcurrentRunner(agent, concurrency=concurrency)
+        results = runner.run_sync([request["input"] for request in requests], request_kwargs=[
+            {"tenant": request.get("tenant"), "session_id": request.get("session_id")} for request in requests
+        ])
+    return results, time.perf_counter() - start
+
+
+def stage_stats(results):
+    """按阶段汇总延迟百分位数和内存增长"""
+    durations = {"request": [result["timings"]["total_ms"] for result in results]}
+    allocations = {}
+    for result in results:
+        timings = result["timings"]
+        request_alloc = timings.get("spans", {}).get("attributes", {}).get("alloc_kb")
+        if request_alloc is not None:
+            allocations.setdefault("request", []).append(request_alloc)
+        for kind, duration in timings.get("by_kind_ms", {}).items():
+            durations.setdefault(kind, []).append(duration)
+        for kind, alloc in timings.get("by_kind_alloc_kb", {}).items():
+            allocations.setdefault(kind, []).append(alloc)
+    stats = {}
+    for kind, values in durations.items():
+        memory = allocations.get(kind, [])
+        stats[kind] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "mean_alloc_kb": round(statistics.mean(memory), 1) if memory else None,
+            "max_alloc_kb": round(max(memory), 1) if memory else None
+        }
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线工作负载基准测试")
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD, help="工作负载JSONL文件")
+    parser.add_argument("--repeat", type=int, default=3, help="工作负载回放次数")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时处理的请求数")
+    parser.add_argument("--pipeline", choices=PIPELINE_MODES, default="agent", help="请求处理流水线")
+    parser.add_argument("--retrieval-mode", choices=RETRIEVAL_MODES, default="hybrid", help="历史命令检索模式")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="每次LLM调用的模拟延迟")
+    parser.add_argument("--llm-jitter-ms", type=float, default=50, help="LLM延迟的抖动范围")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30, help="每次嵌入调用的模拟延迟")
+    parser.add_argument("--history", type=int, default=1000, help="回放前向历史库写入的合成历史条数")
+    parser.add_argument("--no-cache", action="store_true", help="禁用命令缓存")
+    parser.add_argument("--no-context-budget", action="store_true", help="不压缩Agent草稿区，用于比较提示词token数")
+    parser.add_argument("--no-memory", action="store_true", help="不跟踪内存分配（tracemalloc 会拖慢执行）")
+    parser.add_argument("--json", metavar="FILE", help="把统计结果写入JSON文件")
+    args = parser.parse_args()
+
+    requests = load_workload(args.workload) * args.repeat
+    llm = FakeChatModel(commands={r["input"]: r["command"] for r in requests if r.get("command")},
+                        latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms)
+    embeddings = FakeEmbeddings(latency_ms=args.embedding_latency_ms)
+    db_dir = tempfile.mkdtemp(prefix="bench_workload_")
+    try:
+        start = time.perf_counter()
+        agent = ShellAgent(rag_persist_directory=db_dir, llm=llm, embeddings=embeddings, embedding_backend="fake",
+                           pipeline=args.pipeline, retrieval_mode=args.retrieval_mode,
+                           enable_cache=not args.no_cache, write_behind_history=False, embedding_cache_size=0,
+                           context_budget=not args.no_context_budget, verbose=False)
+        init_ms = (time.perf_counter() - start) * 1000
+        seed_seconds = seed_history(agent.rag_search, args.history) if args.history else 0.0
+
+        if not args.no_memory:
+            tracemalloc.start()
+        with redirect_stdout(StringIO()):
+            results, elapsed = replay(agent, requests, args.concurrency)
+        heap_peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024 if tracemalloc.is_tracing() else None
+        tracemalloc.stop()
+        agent.close()
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    stats = stage_stats(results)
+    succeeded = sum(1 for result in results if result.get("success"))
+    print(f"工作负载: {args.workload}（{len(requests)} 个请求，并发 {args.concurrency}，流水线 {args.pipeline}）")
+    print(f"构造 ShellAgent: {init_ms:.1f}ms，写入 {args.history} 条历史: {seed_seconds:.2f}s")
+    print(f"吞吐量: {len(results) / elapsed:.2f} 请求/秒，成功 {succeeded}/{len(results)}，"
+          f"缓存命中 {sum(1 for r in results if r.get('cache_hit'))}，快速路径 {sum(1 for r in results if r.get('fast_path'))}")
+    prompt_tokens = sum(result["timings"]["tokens"]["prompt_tokens"] for result in results)
+    completion_tokens = sum(result["timings"]["tokens"]["completion_tokens"] for result in results)
+    tokens_saved = sum(result.get("context_budget", {}).get("tokens_saved", 0) for result in results)
+    print(f"LLM tokens: 提示 {prompt_tokens}，生成 {completion_tokens}，上下文压缩节省 {tokens_saved}")
+    heap = f"{heap_peak_mb:.1f}MB" if heap_peak_mb is not None else "-"
+    print(f"内存: Python堆峰值 {heap}，进程峰值RSS {max_rss_mb():.1f}MB\n")
+    print(f"{'阶段':<16} {'次数':>6} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10} {'平均内存增长(KB)':>18} {'最大内存增长(KB)':>18}")
+    for kind, row in sorted(stats.items(), key=lambda item: (item[0] != "request", -item[1]["p50_ms"])):
+        mean_alloc = f"{row['mean_alloc_kb']:.1f}" if row["mean_alloc_kb"] is not None else "-"
+        max_alloc = f"{row['max_alloc_kb']:.1f}" if row["max_alloc_kb"] is not None else "-"
+        print(f"{kind:<16} {row['count']:>6} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f} {row['p99_ms']:>10.2f} "
+              f"{mean_alloc:>18} {max_alloc:>18}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"workload": args.workload, "requests": len(results), "concurrency": args.concurrency,
+                       "pipeline": args.pipeline, "throughput_rps": len(results) / elapsed,
+                       "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                       "tokens_saved": tokens_saved, "heap_peak_mb": heap_peak_mb, "max_rss_mb": max_rss_mb(), "stages": stats},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+离线基准测试工具 - 脚本化的假聊天模型、确定性的假嵌入模型、工作负载读取与历史库填充
+
+假模型不发起任何网络请求，按配置的延迟睡眠后返回确定的结果，
+使基准测试只测量本项目自身的开销（检索、执行、缓存、追踪等），且每次运行结果可比较。
+"""
+import json
+import math
+import random
+import shlex
+import sys
+import time
+import zlib
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# 错误分析等不绑定工具的调用返回的固定文本
+ANALYSIS_TEXT = "错误原因：命令执行失败。解决方案：检查命令和参数是否正确后重试。"
+
+
+def _latency_seconds(latency_ms: float, jitter_ms: float, key: str) -> float:
+    """按内容哈希确定的延迟，同一输入在每次运行中的延迟相同"""
+    jitter = (zlib.crc32(key.encode("utf-8")) % 1000 / 1000 * 2 - 1) * jitter_ms if jitter_ms else 0.0
+    return max(0.0, latency_ms + jitter) / 1000
+
+
+class FakeChatModel(BaseChatModel):
+    """脚本化的假聊天模型
+
+    根据绑定的工具判断调用方：绑定了 GeneratedCommand 时按直接流水线返回结构化命令；
+    绑定了Agent工具时按工具调用循环依次搜索历史、执行命令、保存历史或分析错误，最后给出回答；
+    未绑定工具时（错误分析）返回固定文本。命令由 commands 按用户输入查找，找不到时回显用户输入。
+    """
+
+    commands: Dict[str, str] = {}
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    search_history: bool = True
+    model: str = "fake-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model}
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def command_for(self, user_input: str) -> str:
+        """用户输入对应的命令"""
+        return self.commands.get(user_input) or f"echo {shlex.quote(user_input)}"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        tool_names = {tool["function"]["name"] for tool in kwargs.get("tools") or []}
+        human = [message for message in messages if isinstance(message, HumanMessage)]
+        user_input = str(human[-1].content) if human else ""
+        time.sleep(_latency_seconds(self.latency_ms, self.jitter_ms, f"{user_input}:{len(messages)}"))
+
+        if "GeneratedCommand" in tool_names:
+            message = self._tool_call("GeneratedCommand", {"command": self.command_for(user_input),
+                                                           "explanation": ""}, len(messages))
+        elif "execute_shell_command" in tool_names:
+            message = self._agent_step(messages, user_input, tool_names)
+        else:
+            message = AIMessage(content=ANALYSIS_TEXT)
+
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = len(str(message.content)) // 4 + 8 * len(message.tool_calls)
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _agent_step(self, messages: List[BaseMessage], user_input: str, tool_names: set) -> AIMessage:
+        """工具调用循环中的下一步，由上一次调用的工具及其结果决定"""
+        called = {}
+        for message in messages:
+            if isinstance(message, AIMessage):
+                for call in message.tool_calls:
+                    called[call["id"]] = call
+        last = messages[-1]
+        last_tool = called.get(last.tool_call_id) if isinstance(last, ToolMessage) else None
+        command = self.command_for(user_input)
+
+        if last_tool is None:
+            if self.search_history and "search_similar_commands" in tool_names:
+                return self._tool_call("search_similar_commands", {"__arg1": user_input}, len(messages))
+            return self._tool_call("execute_shell_command", {"__arg1": command}, len(messages))
+        if last_tool["name"] == "search_similar_commands":
+            return self._tool_call("execute_shell_command", {"__arg1": command}, len(messages))
+        if last_tool["name"] == "execute_shell_command":
+            # execute_shell_command 的 (success, output) 以JSON数组的形式放入草稿区
+            output = str(last.content)
+            try:
+                success = bool(json.loads(output)[0])
+            except (ValueError, TypeError, IndexError, KeyError):
+                success = False
+            if success:
+                return self._tool_call("save_command_history", {
+                    "user_input": user_input, "command": command, "result": output[:200], "success": True
+                }, len(messages))
+            return self._tool_call("analyze_command_error", {
+                "user_input": user_input, "command": command, "error_message": output[:200]
+            }, len(messages))
+        return AIMessage(content=f"已执行命令: {command}")
+
+    @staticmethod
+    def _tool_call(name: str, args: Dict[str, Any], step: int) -> AIMessage:
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{step}_{name}"}])
+
+
+class FakeEmbeddings(Embeddings):
+    """确定性的假嵌入模型
+
+    把单词哈希到固定维度后做L2归一化，相同文本得到相同向量、共享单词的文本彼此相似；
+    每次调用按配置的延迟睡眠一次，模拟远程嵌入API的往返时间。
+    """
+
+    def __init__(self, dimensions: int = 64, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        """初始化假嵌入模型
+
+        Args:
+            dimensions: 向量维度
+            latency_ms: 每次调用的模拟延迟（毫秒）
+            jitter_ms: 延迟的抖动范围（毫秒），由输入内容确定
+        """
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.model = f"fake-{dimensions}"
+
+    def _vectorize(self, texts: List[str]) -> List[List[float]]:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                matrix[row, zlib.crc32(word.encode("utf-8")) % self.dimensions] += 1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if texts:
+            time.sleep(_latency_seconds(self.latency_ms, self.jitter_ms, texts[0]))
+        return self._vectorize(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(_latency_seconds(self.latency_ms, self.jitter_ms, text))
+        return self._vectorize([text])[0]
+
+
+def load_workload(path: str) -> List[Dict[str, Any]]:
+    """读取工作负载JSONL文件
+
+    每行至少包含 input，可选 command（假模型为该请求生成的命令）、tenant 和 session_id；
+    --trace-file 写出的追踪记录和 --batch 的输入文件都可以直接作为工作负载回放。
+    """
+    requests = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"input": record}
+            if record.get("input"):
+                requests.append(record)
+    return requests
+
+
+# 生成历史记录用的请求模板：(用户请求, 命令)
+HISTORY_TEMPLATES = [
+    ("查看 {path} 目录下的文件", "ls -la {path}"),
+    ("统计 {path} 下 {ext} 文件的数量", "find {path} -name '*.{ext}' | wc -l"),
+    ("在 {path} 中搜索 {word}", "grep -rn {word} {path}"),
+    ("查看 {path} 占用的磁盘空间", "du -sh {path}"),
+    ("压缩 {path} 目录", "tar czf backup_{n}.tar.gz {path}"),
+    ("查看 {path}/{word}.log 的最后 {n} 行", "tail -n {n} {path}/{word}.log"),
+    ("查找 {path} 下最近修改的 {ext} 文件", "find {path} -name '*.{ext}' -mtime -{n}"),
+    ("查看占用端口 {n} 的进程", "lsof -i :{n}"),
+]
+HISTORY_PATHS = ["/var/log", "/etc", "/tmp", "/home/user/project", "/opt/app", "/srv/data", "~/Downloads"]
+HISTORY_WORDS = ["error", "timeout", "config", "nginx", "redis", "deploy", "token", "cache", "worker", "main"]
+HISTORY_EXTS = ["py", "log", "json", "txt", "sh", "md", "yaml"]
+
+
+def synthetic_history(count: int, seed: int = 0, start: int = 0) -> Iterable[Dict[str, Any]]:
+    """生成 count 条互不重复的命令历史记录，start 为第一条记录的序号，用于分多次追加"""
+    rng = random.Random(f"{seed}:{start}")
+    now = time.time()
+    for i in range(start, start + count):
+        request, command = HISTORY_TEMPLATES[rng.randrange(len(HISTORY_TEMPLATES))]
+        values = {"path": f"{rng.choice(HISTORY_PATHS)}/d{i}", "word": rng.choice(HISTORY_WORDS),
+                  "ext": rng.choice(HISTORY_EXTS), "n": rng.randint(1, 9999)}
+        yield {"user_input": request.format(**values), "command": command.format(**values),
+               "result": "", "success": rng.random() < 0.9, "timestamp": now - rng.random() * 86400 * 90}
+
+
+def seed_history(rag_search, count: int, batch_size: int = 5000, tenant: Optional[str] = None,
+                 seed: int = 0, start: int = 0) -> float:
+    """向历史库批量写入 count 条合成的命令历史，返回耗时（秒）
+
+    直接走写回队列使用的批量写入路径，每批一次嵌入调用和一次upsert。
+    """
+    began = time.perf_counter()
+    batch = []
+    with redirect_stdout(StringIO()):
+        for record in synthetic_history(count, seed, start):
+            record["tenant"] = tenant
+            batch.append(record)
+            if len(batch) >= batch_size:
+                rag_search._write_history_batch(batch)
+                batch = []
+        if batch:
+            rag_search._write_history_batch(batch)
+    return time.perf_counter() - began
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法计算百分位数，values 为空时返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def max_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB），不支持的平台返回0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
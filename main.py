@@ -3,8 +3,17 @@ Shell智能体应用程序入口
 """
 import os
 import sys
+import asyncio
+import contextlib
 from dotenv import load_dotenv
-from shell_agent.agent import ShellAgent
+from shell_agent.agent import ShellAgent, PIPELINE_MODES
+from shell_agent.batch import BatchProcessor
+from shell_agent.embeddings import EMBEDDING_BACKENDS
+from shell_agent.events import EVENT_ANALYSIS, EVENT_COMMAND, EVENT_OUTPUT, EVENT_RESULT, EVENT_SIMILAR_COMMANDS
+from shell_agent.maintenance import RetentionPolicy
+from shell_agent.rag_search import RETRIEVAL_MODES, RAGSearch
+from shell_agent.sandbox import ResourceLimits
+from shell_agent.tracing import TraceFileWriter, format_span_tree
 from shell_agent.utils import EnvUtils
 import argparse
 
@@ -52,31 +61,163 @@ class Printer:
         """打印命令"""
         Printer.print(text, 'command')
 
-def main():
-    """主函数"""
-    parser = argparse.ArgumentParser(description="Shell智能体 - 基于LangChain的智能Shell助手")
-    parser.add_argument("--model", default="gpt-3.5-turbo", help="使用的OpenAI模型名称")
-    parser.add_argument("--db-dir", default="./chroma_db", help="RAG向量数据库持久化目录")
-    parser.add_argument("--timeout", type=int, default=30, help="命令执行超时时间（秒）")
-    parser.add_argument("--max-output-length", type=int, default=2000, help="命令输出最大长度")
-    args = parser.parse_args()
+def print_output_chunk(stream_name, text):
+    """实时打印命令输出块，stderr以红色显示"""
+    if stream_name == "stderr":
+        sys.stdout.write(f"\033[31m{text}\033[0m")
+    else:
+        sys.stdout.write(text)
+    sys.stdout.flush()
 
-    # 检查OpenAI API密钥
-    is_valid, error_msg = EnvUtils.check_openai_api_key()
-    if not is_valid:
-        Printer.error(error_msg)
-        return
-
-    # 初始化Shell智能体
+def create_agent(args, stream_output=False, verbose=True):
+    """根据命令行参数初始化Shell智能体"""
     Printer.info(f"初始化Shell智能体 (模型: {args.model})...")
     agent = ShellAgent(
         model_name=args.model, 
         rag_persist_directory=args.db_dir,
         command_timeout=args.timeout,
-        max_output_length=args.max_output_length
+        max_output_length=args.max_output_length,
+        enable_cache=not args.no_cache,
+        enable_fast_path=not args.no_fast_path,
+        enable_error_cache=not args.no_error_cache,
+        command_guard=not args.no_guard,
+        destructive_policy=args.destructive,
+        resource_limits=ResourceLimits(
+            cpu_seconds=args.cpu_limit,
+            memory_bytes=args.memory_limit * 1024 * 1024,
+            file_size_bytes=args.file_size_limit * 1024 * 1024,
+            open_files=args.open_files_limit,
+            output_bytes=args.output_limit * 1024 * 1024
+        ) if args.sandbox else None,
+        shell_pool_size=args.shell_pool,
+        lazy_init=args.lazy_init,
+        error_rules=not args.no_error_rules,
+        pipeline=args.pipeline,
+        speculation_threshold=args.speculation_threshold,
+        cache_ttl=args.cache_ttl,
+        cache_similarity_threshold=args.cache_similarity,
+        embedding_cache_size=args.embedding_cache_size,
+        stream_output=stream_output,
+        write_behind_history=not args.sync_history,
+        embedding_backend=args.embedding_backend,
+        retrieval_mode=args.retrieval_mode,
+        trace_callbacks=[TraceFileWriter(args.trace_file)] if args.trace_file else None,
+        context_budget=not args.no_context_budget,
+        max_prompt_tokens=args.max_prompt_tokens or None,
+        max_observation_tokens=args.max_observation_tokens or None,
+        verbose=verbose
     )
+    if args.rebuild_index:
+        Printer.info("正在重建向量索引...")
+        agent.rag_search.rebuild_index()
     Printer.success("Shell智能体初始化完成!")
+    return agent
+
+def run_batch(args, result_stream):
+    """批处理模式：并发处理JSONL请求并流式写出结果"""
+    agent = create_agent(args, verbose=False)
+    processor = BatchProcessor(agent, parallelism=args.parallelism, tenant=args.tenant)
+
+    input_stream = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+    try:
+        if args.batch_output == "-":
+            requests = processor.read_requests(input_stream)
+            processed = asyncio.run(processor.run(requests, result_stream))
+            stats = {"total": len(requests), "skipped": 0, "processed": processed}
+        else:
+            stats = asyncio.run(processor.run_file(input_stream, args.batch_output, resume=args.resume))
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        agent.close()
+
+    Printer.success(f"批处理完成: 共 {stats['total']} 条，跳过 {stats['skipped']} 条，处理 {stats['processed']} 条")
+
+def print_index_report(label, stats):
+    """打印历史库的规模和检索延迟"""
+    latency = stats["latency"]
+    print(f"{label}: {stats['records']} 条记录（{stats['collections']} 个集合），词法索引 {stats['lexical_entries']} 条，"
+          f"磁盘 {stats['disk_mb']}MB；向量查询 p50/p95 {latency['vector_p50_ms']}/{latency['vector_p95_ms']}ms，"
+          f"BM25查询 p50/p95 {latency['lexical_p50_ms']}/{latency['lexical_p95_ms']}ms")
+
+def run_maintenance(args):
+    """历史库维护模式：依次从快照恢复、维护历史库、导出快照，不创建LLM和Agent"""
+    rag_search = RAGSearch(persist_directory=args.db_dir, embedding_cache_size=args.embedding_cache_size,
+                           write_behind=False, embedding_backend=args.embedding_backend,
+                           retrieval_mode=args.retrieval_mode)
+    try:
+        if args.import_snapshot:
+            Printer.info(f"正在从快照 {args.import_snapshot} 恢复历史库...")
+            rag_search.import_snapshot(args.import_snapshot)
+        if args.maintain:
+            Printer.info("正在维护历史库...")
+            report = rag_search.maintain(
+                policy=RetentionPolicy(max_age_days=args.max_age_days, drop_failed=args.drop_failed,
+                                       min_uses=args.min_uses, max_entries=args.max_entries),
+                merge_by_command=args.merge_by_command,
+                compact=not args.no_compact
+            )
+            print_index_report("维护前", report["before"])
+            print_index_report("维护后", report["after"])
+            removed = "，".join(f"{reason} {count}" for reason, count in report["removed"].items() if count) or "无"
+            print(f"删除原因: {removed}")
+        if args.export_snapshot:
+            Printer.info(f"正在导出快照到 {args.export_snapshot}...")
+            rag_search.export_snapshot(args.export_snapshot)
+    finally:
+        rag_search.close()
+    Printer.success("历史库维护完成!")
 
+def render_events(agent, user_input, session_id=None, tenant=None):
+    """逐个显示处理过程中的流式事件，返回最终结果"""
+    commands_shown = 0
+    analysis_started = False
+    for event in agent.stream_input(user_input, session_id=session_id, tenant=tenant):
+        if event.type == EVENT_COMMAND:
+            # 显示生成的命令，随后实时显示其输出
+            print("\n📋 生成的命令:")
+            Printer.command(event.data["command"])
+            print("\n🖥️ 执行结果:")
+            commands_shown += 1
+        elif event.type == EVENT_OUTPUT:
+            print_output_chunk(event.data["stream"], event.data["text"])
+        elif event.type == EVENT_ANALYSIS:
+            if not analysis_started:
+                print("\n🔍 错误分析和解决方案:")
+                analysis_started = True
+            sys.stdout.write(event.data["text"])
+            sys.stdout.flush()
+        elif event.type == EVENT_SIMILAR_COMMANDS:
+            # 相似历史命令在结果之后统一显示
+            continue
+        elif event.type == EVENT_RESULT:
+            result = event.data["result"]
+            if analysis_started:
+                print()
+
+    if result.get("cache_hit"):
+        Printer.info(f"(命中命令缓存: {result['cache_hit']})")
+    if result.get("fast_path"):
+        Printer.info("(输入为可直接执行的命令，已跳过Agent规划)")
+
+    # 没有执行任何命令时（如Agent出错）补充显示结果
+    if not commands_shown:
+        print("\n📋 生成的命令:")
+        Printer.command(result["command"])
+        print("\n🖥️ 执行结果:")
+        print(result["output"])
+    if result["success"]:
+        Printer.success("✅ 命令执行成功!")
+    else:
+        Printer.error("❌ 命令执行失败!")
+        # 错误分析未以流式事件产出时（如Agent未调用分析工具）补充显示
+        if result["error_analysis"] and not analysis_started:
+            print("\n🔍 错误分析和解决方案:")
+            print(result["error_analysis"])
+    return result
+
+def run_interactive(agent, args):
+    """交互模式主循环"""
     Printer.info("欢迎使用Shell智能体! 输入您的需求，智能体将生成并执行相应的Shell命令。")
     Printer.info("输入 'exit' 或 'quit' 退出程序。")
 
@@ -92,27 +233,18 @@ def main():
                 Printer.info("感谢使用Shell智能体，再见!")
                 break
 
-            # 处理用户输入
+            # 处理用户输入，命令、输出和错误分析一产生就立即显示；
+            # 启用Shell进程池时整个交互会话共用一个shell，cd和export在请求之间保留
             Printer.info("正在处理您的请求...")
-            result = agent.process_input(user_input)
-
-            # 显示生成的命令
-            print("\n📋 生成的命令:")
-            Printer.command(result["command"])
+            result = render_events(agent, user_input, session_id="interactive", tenant=args.tenant)
 
-            # 显示执行结果
-            print("\n🖥️ 执行结果:")
-            if result["success"]:
-                Printer.success("✅ 命令执行成功!")
-                print(result["output"])
-            else:
-                Printer.error("❌ 命令执行失败!")
-                print(result["output"])
-
-                # 显示错误分析和解决方案
-                if result["error_analysis"]:
-                    print("\n🔍 错误分析和解决方案:")
-                    print(result["error_analysis"])
+            # 显示耗时树
+            if args.profile and result.get("timings"):
+                timings = result["timings"]
+                print(f"\n⏱️ 耗时分析 (总计 {timings['total_ms']:.1f}ms，LLM调用 {timings['llm_calls']} 次，"
+                      f"tokens {timings['tokens']['total_tokens']}，"
+                      f"上下文压缩节省 {result.get('context_budget', {}).get('tokens_saved', 0)}):")
+                print(format_span_tree(timings["spans"]))
 
             # 显示相似的历史命令
             if result["similar_commands"]:
@@ -123,10 +255,109 @@ def main():
                     print(f"   执行结果: {'成功' if cmd['success'] else '失败'}")
                     print()
 
+        except EOFError:
+            break
         except KeyboardInterrupt:
             Printer.info("\n操作已取消。输入 'exit' 或 'quit' 退出程序。")
         except Exception as e:
             Printer.error(f"\n发生错误: {str(e)}")
 
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="Shell智能体 - 基于LangChain的智能Shell助手")
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="使用的OpenAI模型名称")
+    parser.add_argument("--db-dir", default="./chroma_db", help="RAG向量数据库持久化目录")
+    parser.add_argument("--timeout", type=int, default=30, help="命令执行超时时间（秒）")
+    parser.add_argument("--max-output-length", type=int, default=2000, help="命令输出最大长度")
+    parser.add_argument("--no-cache", action="store_true", help="禁用命令缓存")
+    parser.add_argument("--pipeline", choices=PIPELINE_MODES, default="agent",
+                        help="请求处理流水线：agent 由模型调用工具完成，direct 只调用一次LLM生成命令，"
+                             "speculative 在 direct 的基础上并发检索、生成与推测执行")
+    parser.add_argument("--speculation-threshold", type=float, default=0.85,
+                        help="speculative 流水线中推测执行历史只读命令所需的最低相似度")
+    parser.add_argument("--no-error-cache", action="store_true", help="禁用错误分析缓存")
+    parser.add_argument("--no-error-rules", action="store_true", help="禁用常见错误的本地规则表，所有错误都交给LLM分析")
+    parser.add_argument("--no-guard", action="store_true", help="禁用执行前的命令安全检查")
+    parser.add_argument("--destructive", choices=("allow", "dry_run", "reject"), default="allow",
+                        help="破坏性操作（删除文件、终止进程等）的处理方式：放行、演练或拒绝")
+    parser.add_argument("--sandbox", action="store_true",
+                        help="沙箱模式：命令在独立进程组中带资源上限运行，超时或输出超限时终止整个进程组")
+    parser.add_argument("--cpu-limit", type=int, default=30, help="沙箱模式下每个进程的CPU时间上限（秒）")
+    parser.add_argument("--memory-limit", type=int, default=1024, help="沙箱模式下每个进程的地址空间上限（MB）")
+    parser.add_argument("--file-size-limit", type=int, default=100, help="沙箱模式下可写入的单个文件大小上限（MB）")
+    parser.add_argument("--open-files-limit", type=int, default=256, help="沙箱模式下每个进程可打开的文件数上限")
+    parser.add_argument("--output-limit", type=int, default=16, help="沙箱模式下命令输出的总字节数上限（MB）")
+    parser.add_argument("--shell-pool", type=int, default=0, metavar="N",
+                        help="使用N个常驻bash进程执行命令（0为每条命令新建进程），交互模式下cd和环境变量在请求间保留")
+    parser.add_argument("--lazy-init", action="store_true",
+                        help="延迟初始化：LLM客户端、Agent和向量数据库在首次使用时才导入和创建，缩短启动时间")
+    parser.add_argument("--no-context-budget", action="store_true",
+                        help="不压缩Agent草稿区，工具输出和检索到的历史命令原样放回提示词")
+    parser.add_argument("--max-prompt-tokens", type=int, default=4000, help="每次Agent迭代的提示词token上限（0为不限制）")
+    parser.add_argument("--max-observation-tokens", type=int, default=500,
+                        help="放回提示词的单个工具输出的token上限（0为不截断）")
+    parser.add_argument("--no-fast-path", action="store_true", help="禁用字面命令快速路径，所有输入都交给Agent处理")
+    parser.add_argument("--tenant", metavar="NAME",
+                        help="租户（如用户名或主机名），命令历史的检索和保存只在该租户内进行；批处理请求可用 tenant 字段单独指定")
+    parser.add_argument("--cache-ttl", type=float, default=3600, help="命令缓存条目存活时间（秒）")
+    parser.add_argument("--cache-similarity", type=float, default=0.95, help="近似重复请求的相似度阈值（0~1）")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default="openai",
+                        help="嵌入后端：openai 或本地CPU计算的 hashing")
+    parser.add_argument("--retrieval-mode", choices=RETRIEVAL_MODES, default="hybrid",
+                        help="历史命令检索模式：hybrid（BM25与向量融合）、vector 或 lexical")
+    parser.add_argument("--rebuild-index", action="store_true", help="用当前嵌入后端重建向量索引（切换后端后使用）")
+    parser.add_argument("--maintain", action="store_true",
+                        help="维护历史库后退出：合并重复的命令历史、按保留策略删除记录并压缩索引，报告维护前后的索引大小和检索延迟")
+    parser.add_argument("--max-age-days", type=float, metavar="DAYS", help="维护时删除最近一次执行早于该天数的命令历史")
+    parser.add_argument("--drop-failed", action="store_true", help="维护时删除从未执行成功的命令历史")
+    parser.add_argument("--min-uses", type=int, default=0, help="维护时删除执行次数少于该值的命令历史")
+    parser.add_argument("--max-entries", type=int, metavar="N", help="维护时每个集合最多保留N条最近执行的命令历史")
+    parser.add_argument("--merge-by-command", action="store_true",
+                        help="维护时把命令相同、请求说法不同的历史也合并为一条（默认只合并请求和命令都相同的）")
+    parser.add_argument("--no-compact", action="store_true", help="维护时只删除和更新有变化的记录，不重建集合和回收磁盘空间")
+    parser.add_argument("--export-snapshot", metavar="DIR", help="把历史库导出为快照目录（JSONL记录和NumPy向量）后退出")
+    parser.add_argument("--import-snapshot", metavar="DIR", help="从快照目录恢复历史库后退出，嵌入模型相同时无需重新嵌入")
+    parser.add_argument("--embedding-cache-size", type=int, default=100000, help="本地嵌入缓存最大条目数（0为禁用）")
+    parser.add_argument("--stream", action="store_true", help="流式读取命令输出，每个输出流只在内存中保留有界的开头和结尾")
+    parser.add_argument("--sync-history", action="store_true", help="同步保存命令历史（默认异步批量写入）")
+    parser.add_argument("--profile", action="store_true", help="每次请求后打印耗时树（LLM、工具、嵌入、检索、子进程）")
+    parser.add_argument("--trace-file", metavar="FILE", help="将每次请求的耗时追踪记录追加写入JSONL文件")
+    parser.add_argument("--batch", metavar="FILE", help="批处理模式：从JSONL文件（'-'为标准输入）读取请求")
+    parser.add_argument("--batch-output", metavar="FILE", default="-", help="批处理结果JSONL文件（默认'-'为标准输出）")
+    parser.add_argument("--parallelism", type=int, default=4, help="批处理模式下同时处理的请求数")
+    parser.add_argument("--resume", action="store_true", help="批处理模式下跳过结果文件中已完成的请求")
+    args = parser.parse_args()
+
+    # 检查OpenAI API密钥
+    is_valid, error_msg = EnvUtils.check_openai_api_key()
+    if not is_valid:
+        Printer.error(error_msg)
+        return
+
+    if args.sandbox and args.shell_pool:
+        Printer.error("--shell-pool 不能与 --sandbox 同时使用")
+        return
+
+    if args.maintain or args.export_snapshot or args.import_snapshot:
+        run_maintenance(args)
+        return
+
+    if args.batch:
+        if args.resume and args.batch_output == "-":
+            Printer.error("--resume 需要通过 --batch-output 指定结果文件")
+            return
+        # 结果写入标准输出时，其他提示信息改写到标准错误，保持结果为纯JSONL
+        result_stream = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            run_batch(args, result_stream)
+        return
+
+    agent = create_agent(args, stream_output=args.stream)
+
+    try:
+        run_interactive(agent, args)
+    finally:
+        agent.close()
+
 if __name__ == "__main__":
     main()
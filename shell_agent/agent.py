@@ -1,18 +1,43 @@
 """
 Shell智能体主类 - 整合所有功能模块
 """
-from typing import Dict, Any, List, Optional
-from langchain.agents import AgentExecutor, create_openai_tools_agent
+import asyncio
+import contextvars
+import inspect
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.tools import StructuredTool, Tool
-from langchain_openai import ChatOpenAI
 
-from .param_model import SaveCommandHistoryParams, AnalyzeCommandErrorParams
-from .shell_executor import ShellExecutor
+from .param_model import SaveCommandHistoryParams, AnalyzeCommandErrorParams, GeneratedCommand
+from .shell_executor import ShellExecutor, OutputCallback
 from .error_analyzer import ErrorAnalyzer
+from .error_cache import ErrorAnalysisCache, ErrorRules
 from .rag_search import RAGSearch
+from .cache import CommandCache
+from .command_detector import CommandDetector
+from .command_guard import CommandGuard
+from .sandbox import ResourceLimits
+from .shell_pool import ShellPool
+from .context import emit_event, request_context
+from .context_budget import ContextBudget
+from .events import AgentEvent, EventCallback, EVENT_RESULT, EVENT_SIMILAR_COMMANDS
+from .tracing import Trace, TraceCallback, span
 from .utils import PlatformUtils
 
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.embeddings import Embeddings
+
+# 请求处理流水线：agent 由模型通过工具调用驱动整个流程；
+# direct 预先检索相似命令，只调用一次LLM生成命令，执行和保存历史由代码完成；
+# speculative 在 direct 的基础上让检索、命令生成、推测执行、错误分析和重试中互不依赖的步骤并发进行
+PIPELINE_MODES = ("agent", "direct", "speculative")
+
 
 def _extract_command_info(result: Dict[str, Any], max_output_length: int = 2000) -> Dict[str, Any]:
     """从Agent执行结果中提取命令执行信息"""
@@ -62,16 +87,176 @@ class ShellAgent:
     """Shell智能体主类，整合所有功能模块"""
 
     def __init__(self, model_name: str = "gpt-3.5-turbo", rag_persist_directory: str = "./chroma_db", 
-                 command_timeout: int = 30, max_output_length: int = 2000):
-        """初始化Shell智能体"""
-        self.shell_executor = ShellExecutor(timeout=command_timeout)
-        self.llm = ChatOpenAI(model=model_name, temperature=0)
-        self.error_analyzer = ErrorAnalyzer(llm=self.llm)
-        self.rag_search = RAGSearch(persist_directory=rag_persist_directory)
+                 command_timeout: int = 30, max_output_length: int = 2000,
+                 enable_cache: bool = True, cache_ttl: Optional[float] = 3600, cache_max_size: int = 1000,
+                 cache_similarity_threshold: float = 0.95, embedding_cache_size: int = 100000,
+                 stream_output: bool = False, output_callback: Optional[OutputCallback] = None,
+                 write_behind_history: bool = True, embedding_backend: str = "openai",
+                 retrieval_mode: str = "hybrid", trace_callbacks: Optional[List[TraceCallback]] = None,
+                 enable_fast_path: bool = True, pipeline: str = "agent",
+                 enable_error_cache: bool = True, error_cache_ttl: Optional[float] = 7 * 24 * 3600,
+                 error_rules: bool = True, command_guard: bool = True, destructive_policy: str = "allow",
+                 resource_limits: Optional[ResourceLimits] = None, shell_pool_size: int = 0,
+                 shell_pool_max_commands: int = 200, lazy_init: bool = False,
+                 llm: Optional["BaseChatModel"] = None, embeddings: Optional["Embeddings"] = None,
+                 context_budget: bool = True, max_prompt_tokens: Optional[int] = 4000,
+                 max_observation_tokens: Optional[int] = 500, speculation_threshold: float = 0.85,
+                 verbose: bool = True):
+        """初始化Shell智能体
+
+        Args:
+            enable_cache: 是否启用命令缓存，命中时跳过Agent循环直接重放命令
+            cache_ttl: 缓存条目存活时间（秒）
+            cache_max_size: 缓存最大条目数
+            cache_similarity_threshold: 近似重复请求的相似度阈值，大于1时只做精确匹配
+            embedding_cache_size: 本地嵌入缓存的最大条目数，为0时禁用
+            stream_output: 是否流式读取命令输出，内存占用不随输出大小增长
+            output_callback: 流式模式下的输出块回调 (流名称, 文本)，可用于实时显示输出
+            write_behind_history: 是否异步批量保存命令历史，使保存不阻塞请求
+            embedding_backend: 嵌入后端，"openai" 或本地的 "hashing"
+            retrieval_mode: 历史命令检索模式，"hybrid"（BM25与向量融合）、"vector" 或 "lexical"
+            trace_callbacks: 每次请求结束后以追踪记录调用的回调列表
+            enable_fast_path: 是否启用字面命令快速路径，输入本身就是可执行命令时跳过Agent循环直接执行
+            pipeline: 请求处理流水线，"agent"（工具调用循环）、"direct"（单次LLM调用生成命令）
+                或 "speculative"（direct 的并发版本，见 _run_speculative）
+            enable_error_cache: 是否按错误签名缓存错误分析，缓存持久化在 rag_persist_directory 下
+            error_cache_ttl: 错误分析缓存条目存活时间（秒）
+            error_rules: 是否用本地规则表直接回答常见错误（命令不存在、权限不足、文件不存在等）
+            command_guard: 是否在执行前静态检查命令，拒绝危险或永不结束的命令、限制无界输出
+            destructive_policy: 破坏性操作的处理方式，"allow"、"dry_run"（演练）或 "reject"
+            resource_limits: 沙箱资源上限，设置后命令在独立进程组中带CPU/内存/文件大小/输出上限运行，
+                结果中的 resource_usage 记录每条命令的资源使用情况
+            shell_pool_size: 常驻Shell进程池的共享worker数，大于0时命令由常驻bash进程执行，
+                调用时传入 session_id 的请求在该会话专属的shell中执行，保留cd和环境变量；不能与沙箱同时使用
+            shell_pool_max_commands: 共享worker回收前最多执行的命令数
+            lazy_init: 是否延迟初始化。为True时构造时不创建LLM客户端、Agent执行器、嵌入客户端和向量数据库，
+                各组件在首次使用时才导入和创建；每次请求开始时在后台打开向量数据库，与LLM调用重叠。
+                字面命令等不需要LLM的请求不会导入LLM相关的库
+            llm: 自定义的聊天模型，设置后不创建 ChatOpenAI 客户端（如离线基准测试中的脚本化模型）
+            embeddings: 自定义的嵌入模型，设置后不按 embedding_backend 创建
+            context_budget: 是否压缩Agent草稿区：工具输出按token截断、检索到的历史命令只保留请求和命令，
+                结果中的 context_budget 记录节省的token数
+            max_prompt_tokens: 每次Agent迭代的提示词token上限（本地分词器估算），为None时不限制
+            max_observation_tokens: 放回草稿区的单个工具输出的token上限，为None时不截断
+            speculation_threshold: speculative 流水线中，请求相似度不低于该值的成功历史命令若为只读命令，
+                在LLM生成命令的同时推测执行；大于1时不推测执行
+            verbose: Agent执行器是否打印每一步的思考和工具调用（批处理时应关闭）
+        """
+        if pipeline not in PIPELINE_MODES:
+            raise ValueError(f"不支持的处理流水线: {pipeline}，可选值: {', '.join(PIPELINE_MODES)}")
+        self.shell_executor = ShellExecutor(
+            timeout=command_timeout, stream_output=stream_output, output_callback=output_callback,
+            guard=CommandGuard(destructive_policy=destructive_policy) if command_guard else None,
+            resource_limits=resource_limits,
+            shell_pool=ShellPool(size=shell_pool_size, max_commands=shell_pool_max_commands)
+            if shell_pool_size > 0 else None
+        )
+        self.model_name = model_name
+        self.lazy_init = lazy_init
+        self.verbose = verbose
+        self._components: Dict[str, Any] = {}
+        self._init_lock = threading.RLock()
+        if llm is not None:
+            self._components["llm"] = llm
+        error_cache = ErrorAnalysisCache(
+            path=os.path.join(rag_persist_directory, "error_analysis_cache.jsonl"),
+            ttl=error_cache_ttl
+        ) if enable_error_cache else None
+        self.error_analyzer = ErrorAnalyzer(cache=error_cache, rules=ErrorRules() if error_rules else None,
+                                            llm_factory=lambda: self.llm)
+        self.rag_search = RAGSearch(persist_directory=rag_persist_directory,
+                                    embedding_cache_size=embedding_cache_size,
+                                    write_behind=write_behind_history,
+                                    embedding_backend=embedding_backend,
+                                    retrieval_mode=retrieval_mode,
+                                    lazy=lazy_init,
+                                    embeddings=embeddings)
         self.max_output_length = max_output_length
+        self.command_cache = CommandCache(
+            model_name=model_name,
+            max_size=cache_max_size,
+            ttl=cache_ttl,
+            similarity_threshold=cache_similarity_threshold
+        ) if enable_cache else None
+        self.trace_callbacks: List[TraceCallback] = list(trace_callbacks or [])
+        self.command_detector = CommandDetector() if enable_fast_path else None
+        self.pipeline = pipeline
+        self.speculation_threshold = speculation_threshold
+        # 判断历史命令是否只读；未启用安全检查时也需要
+        self.read_only_guard = self.shell_executor.guard or CommandGuard()
+        self.context_budget = ContextBudget(model_name, max_prompt_tokens=max_prompt_tokens,
+                                            max_observation_tokens=max_observation_tokens) if context_budget else None
+
+        if not lazy_init:
+            self.agent_executor
+            self.direct_chain
+
+    def close(self):
+        """释放资源，写完待保存的命令历史和错误分析缓存并关闭Shell进程池"""
+        self.rag_search.close()
+        if self.error_analyzer.cache is not None:
+            self.error_analyzer.cache.close()
+        self.shell_executor.close()
+
+    def _component(self, name: str, factory: Callable[[], Any]) -> Any:
+        """返回按名称缓存的组件，首次访问时调用 factory 创建"""
+        component = self._components.get(name)
+        if component is None:
+            with self._init_lock:
+                component = self._components.get(name)
+                if component is None:
+                    with span(name, "init"):
+                        component = self._components[name] = factory()
+        return component
+
+    @property
+    def llm(self) -> "BaseChatModel":
+        """LLM客户端"""
+        return self._component("llm", self._create_llm)
+
+    @property
+    def tools(self) -> List[Any]:
+        """Agent可调用的工具列表"""
+        return self._component("tools", self._create_tools)
+
+    @property
+    def agent_executor(self) -> "AgentExecutor":
+        """Agent执行器"""
+        return self._component("agent_executor", self._create_agent_executor)
+
+    @property
+    def direct_chain(self):
+        """直接流水线的命令生成链"""
+        return self._component("direct_chain", self._create_direct_chain)
+
+    def _create_llm(self) -> "BaseChatModel":
+        """创建LLM客户端"""
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model=self.model_name, temperature=0)
+
+    def _start_warm_up(self):
+        """延迟初始化时在后台打开向量数据库，使其与本次请求的LLM调用重叠"""
+        if self.lazy_init:
+            self.rag_search.warm_up()
+
+    def _prefetch_pipeline(self):
+        """延迟初始化时在后台创建当前流水线所需的LLM客户端和执行器
+
+        在确定请求需要LLM（未走快速路径）后调用，使LLM相关库的导入与命令缓存查找、
+        向量数据库的打开重叠；主线程用到时若尚未创建完成，会在组件锁上等待。
+        """
+        name = "agent_executor" if self.pipeline == "agent" else "direct_chain"
+        if not self.lazy_init or name in self._components:
+            return
+
+        def prefetch():
+            try:
+                getattr(self, name)
+            except Exception as e:
+                # 主线程使用时会再次尝试创建并抛出错误
+                print(f"预先创建 {name} 失败: {str(e)}")
 
-        self.tools = self._create_tools()
-        self.agent_executor = self._create_agent_executor()
+        threading.Thread(target=prefetch, daemon=True).start()
 
     def _create_tools(self) -> List[Any]:
         """创建工具列表"""
@@ -79,33 +264,49 @@ class ShellAgent:
             Tool(
                 name="search_similar_commands",
                 func=self.rag_search.get_similar_commands,
+                coroutine=self.rag_search.aget_similar_commands,
                 description="搜索与用户输入相似的历史命令，输入为用户需求字符串。"
             ),
             Tool(
                 name="execute_shell_command",
                 func=self.shell_executor.execute_command,
+                coroutine=self.shell_executor.aexecute_command,
                 description="执行shell命令并返回一个元组(success: bool, output: str)。"
             ),
             StructuredTool.from_function(
                 func=self.error_analyzer.analyze_error,
+                coroutine=self.error_analyzer.aanalyze_error,
                 name="analyze_command_error",
                 description="分析shell命令执行错误并提供解决方案。",
                 args_schema=AnalyzeCommandErrorParams
             ),
             StructuredTool.from_function(
                 func=self.rag_search.add_shell_command_history,
+                coroutine=self.rag_search.aadd_shell_command_history,
                 name="save_command_history",
                 description="将命令执行历史保存到数据库中。",
                 args_schema=SaveCommandHistoryParams
             )
         ]
 
-    def _create_agent_executor(self) -> AgentExecutor:
-        """创建agent执行器"""
-        # 检测当前操作系统
+    @staticmethod
+    def _system_info() -> Tuple[bool, str, str]:
+        """检测当前操作系统，返回 (是否Windows, 操作系统名称, shell类型)"""
         is_windows = PlatformUtils.is_windows()
         os_type = "Windows" if is_windows else "Linux/macOS"
         shell_type = "PowerShell" if is_windows else "bash"
+        return is_windows, os_type, shell_type
+
+    def _create_agent_executor(self) -> "AgentExecutor":
+        """创建agent执行器"""
+        from langchain.agents import AgentExecutor
+        from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
+        from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+        from langchain_core.runnables import RunnablePassthrough
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+
+        # 检测当前操作系统
+        is_windows, os_type, shell_type = self._system_info()
 
         system_prompt = f"""你是一个专业的Shell命令助手。你的任务是根据用户的需求，生成一个合适的shell命令，然后使用 `execute_shell_command` 工具来执行它。
 
@@ -130,55 +331,688 @@ class ShellAgent:
         - 你可以调用 `search_similar_commands` 来获取灵感。
         - **重要**: 始终考虑当前操作系统，生成兼容的命令。
         """
+        # 启用上下文预算时去掉源码缩进，每次迭代都会重发系统提示
+        compact_prompt = inspect.cleandoc(system_prompt) if self.context_budget is not None else system_prompt
         prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
+            ("system", compact_prompt),
             ("human", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad")
         ])
 
-        agent = create_openai_tools_agent(self.llm, self.tools, prompt)
+        # 与 create_openai_tools_agent 相同的结构，草稿区由上下文预算压缩
+        tool_definitions = [convert_to_openai_tool(tool) for tool in self.tools]
+        if self.context_budget is not None:
+            self.context_budget.set_fixed_prompt(compact_prompt, tool_definitions, original_prompt=system_prompt)
+            budget = self.context_budget
+            format_scratchpad = lambda x: budget.format_scratchpad(x["intermediate_steps"], x["input"])
+        else:
+            format_scratchpad = lambda x: format_to_openai_tool_messages(x["intermediate_steps"])
+        agent = (
+            RunnablePassthrough.assign(agent_scratchpad=format_scratchpad)
+            | prompt
+            | self.llm.bind(tools=tool_definitions)
+            | OpenAIToolsAgentOutputParser()
+        )
 
         return AgentExecutor(
             agent=agent,
             tools=self.tools,
-            verbose=True,
+            verbose=self.verbose,
             handle_parsing_errors=True,
             return_intermediate_steps=True
         )
 
-    def process_input(self, user_input: str) -> Dict[str, Any]:
+    def _create_direct_chain(self):
+        """创建直接流水线使用的命令生成链，LLM以结构化输出返回命令"""
+        is_windows, os_type, shell_type = self._system_info()
+
+        system_prompt = f"""你是一个专业的Shell命令助手。请根据用户的需求，生成一个合适的shell命令。
+
+        **系统信息**:
+
+        - 当前操作系统: {os_type}
+        - 使用shell类型: {shell_type}
+
+        **命令生成规则**:
+        1. 根据当前操作系统生成兼容的命令
+        2. {"如果是Windows系统，优先使用PowerShell命令" if is_windows else "如果是Linux/macOS系统，优先使用bash命令"}
+        3. 确保生成的命令在对应系统上能够正常执行
+        4. 只返回一条可直接执行的命令，不要包含解释性文字或Markdown代码块
+
+        **相似的历史命令**（仅供参考，可能为空）:
+        {{similar_commands}}
         """
-        处理用户输入，通过Agent协调工具执行，并返回结构化结果。
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", inspect.cleandoc(system_prompt) if self.context_budget is not None else system_prompt),
+            ("human", "{input}")
+        ])
+        return prompt | self.llm.with_structured_output(GeneratedCommand)
+
+    @staticmethod
+    def _format_similar_commands(similar_commands: List[Dict[str, Any]]) -> str:
+        """把相似历史命令格式化为提示词中的列表"""
+        lines = [
+            f"- 请求: {item.get('user_input', '')} -> 命令: {item['command']}"
+            f"（{'成功' if item.get('success') else '失败'}）"
+            for item in similar_commands if item.get("command")
+        ]
+        return "\n".join(lines) or "无"
+
+    def _direct_result(self, user_input: str, command: str, success: bool, output: str, error_analysis: str,
+                       similar_commands: List[Dict[str, Any]],
+                       attempts: Optional[List[Tuple[str, bool, str]]] = None) -> Dict[str, Any]:
+        """组装直接流水线的结果，intermediate_steps 按Agent流程的格式记录实际执行的步骤
+
+        Args:
+            attempts: 实际依次执行的 (命令, 是否成功, 输出)，默认只有 command 一条
+        """
+        from langchain_core.agents import AgentAction
+
+        if self.command_cache is not None and success and command:
+            self.command_cache.put(user_input, command)
+
+        steps = [(AgentAction(tool="execute_shell_command", tool_input=attempt, log=""), (ok, text))
+                 for attempt, ok, text in attempts or [(command, success, output)]]
+        if error_analysis:
+            steps.append((AgentAction(tool="analyze_command_error", log="", tool_input={
+                "user_input": user_input, "command": command, "error_message": output}), error_analysis))
+        return {
+            "command": command,
+            "success": success,
+            "output": self._truncate_output(output),
+            "error_analysis": error_analysis,
+            "similar_commands": similar_commands,
+            "intermediate_steps": steps,
+            "cache_hit": None,
+            "fast_path": False
+        }
+
+    def _run_direct(self, user_input: str, trace: Trace) -> Dict[str, Any]:
+        """直接流水线：预先检索，一次LLM调用生成命令，由代码执行命令并保存历史，失败时才分析错误"""
+        similar_commands = self.rag_search.get_similar_commands(user_input)
+        emit_event(EVENT_SIMILAR_COMMANDS, similar_commands=similar_commands)
+        generated = self.direct_chain.invoke(
+            {"input": user_input, "similar_commands": self._format_similar_commands(similar_commands)},
+            config={"callbacks": [trace.callback_handler]}
+        )
+        trace.callback_handler.close_iteration()
+        command = generated.command.strip()
+        with span("execute_shell_command", "tool"):
+            success, output = self.shell_executor.execute_command(command)
+        if success:
+            with span("save_command_history", "tool"):
+                self.rag_search.add_shell_command_history(user_input, command, output, True)
+            error_analysis = ""
+        else:
+            with span("analyze_command_error", "tool"):
+                error_analysis = self.error_analyzer.analyze_error(user_input, command, output)
+        return self._direct_result(user_input, command, success, output, error_analysis, similar_commands)
+
+    async def _arun_direct(self, user_input: str, trace: Trace) -> Dict[str, Any]:
+        """_run_direct 的异步版本"""
+        similar_commands = await self.rag_search.aget_similar_commands(user_input)
+        emit_event(EVENT_SIMILAR_COMMANDS, similar_commands=similar_commands)
+        generated = await self.direct_chain.ainvoke(
+            {"input": user_input, "similar_commands": self._format_similar_commands(similar_commands)},
+            config={"callbacks": [trace.callback_handler]}
+        )
+        trace.callback_handler.close_iteration()
+        command = generated.command.strip()
+        with span("execute_shell_command", "tool"):
+            success, output = await self.shell_executor.aexecute_command(command)
+        if success:
+            with span("save_command_history", "tool"):
+                await self.rag_search.aadd_shell_command_history(user_input, command, output, True)
+            error_analysis = ""
+        else:
+            with span("analyze_command_error", "tool"):
+                error_analysis = await self.error_analyzer.aanalyze_error(user_input, command, output)
+        return self._direct_result(user_input, command, success, output, error_analysis, similar_commands)
+
+    def _generate_command(self, user_input: str, similar_commands: List[Dict[str, Any]],
+                          config: Dict[str, Any]) -> str:
+        """用直接流水线的命令生成链生成一条命令"""
+        generated = self.direct_chain.invoke(
+            {"input": user_input, "similar_commands": self._format_similar_commands(similar_commands)}, config=config
+        )
+        return generated.command.strip()
+
+    async def _agenerate_command(self, user_input: str, similar_commands: List[Dict[str, Any]],
+                                 config: Dict[str, Any]) -> str:
+        """_generate_command 的异步版本"""
+        generated = await self.direct_chain.ainvoke(
+            {"input": user_input, "similar_commands": self._format_similar_commands(similar_commands)}, config=config
+        )
+        return generated.command.strip()
+
+    def _speculation_candidate(self, similar_commands: List[Dict[str, Any]]) -> Optional[str]:
+        """挑选可以推测执行的历史命令：执行成功、请求相似度不低于 speculation_threshold 且为只读命令
+
+        与 CommandCache.match_similar 一样比较用户请求与历史记录中的请求（request_similarity），
+        而不是与整条历史文档的向量距离。
+        """
+        best, best_similarity = None, self.speculation_threshold
+        for item in similar_commands:
+            similarity = item.get("request_similarity")
+            if not item.get("success") or not item.get("command") or similarity is None:
+                continue
+            if similarity >= best_similarity and self.read_only_guard.is_read_only(item["command"]):
+                best, best_similarity = item["command"], similarity
+        return best
+
+    @staticmethod
+    def _retry_input(user_input: str, command: str, output: str) -> str:
+        """重试时交给LLM的输入，附上失败的命令和错误信息的结尾部分"""
+        return (f"{user_input}\n\n上一次生成的命令执行失败，请生成修正后的命令。\n"
+                f"失败的命令: {command}\n错误信息: {output[-1000:]}")
+
+    def _retry(self, user_input: str, command: str, output: str, similar_commands: List[Dict[str, Any]],
+               config: Dict[str, Any]) -> Optional[Tuple[str, bool, str]]:
+        """生成修正后的命令并执行，成功时保存历史
+
+        Returns:
+            Optional[Tuple[str, bool, str]]: (命令, 是否成功, 输出)，生成的命令与失败的命令相同时不执行，返回None
+        """
+        retry_command = self._generate_command(self._retry_input(user_input, command, output), similar_commands,
+                                               config)
+        if not retry_command or retry_command == command:
+            return None
+        with span("retry_shell_command", "tool"):
+            success, retry_output = self.shell_executor.execute_command(retry_command)
+        if success:
+            with span("save_command_history", "tool"):
+                self.rag_search.add_shell_command_history(user_input, retry_command, retry_output, True)
+        return retry_command, success, retry_output
+
+    async def _aretry(self, user_input: str, command: str, output: str, similar_commands: List[Dict[str, Any]],
+                      config: Dict[str, Any]) -> Optional[Tuple[str, bool, str]]:
+        """_retry 的异步版本"""
+        retry_command = await self._agenerate_command(self._retry_input(user_input, command, output),
+                                                      similar_commands, config)
+        if not retry_command or retry_command == command:
+            return None
+        with span("retry_shell_command", "tool"):
+            success, retry_output = await self.shell_executor.aexecute_command(retry_command)
+        if success:
+            with span("save_command_history", "tool"):
+                await self.rag_search.aadd_shell_command_history(user_input, retry_command, retry_output, True)
+        return retry_command, success, retry_output
+
+    def _speculative_result(self, user_input: str, attempts: List[Tuple[str, bool, str]], error_analysis: str,
+                            similar_commands: List[Dict[str, Any]], candidate: Optional[str],
+                            hit: bool) -> Dict[str, Any]:
+        """组装推测流水线的结果：重试成功时报告重试的命令，否则报告第一条命令（错误分析针对的命令）
+
+        结果中的 speculation 记录推测执行的历史命令、是否被LLM生成的命令证实以及重试的命令。
+        """
+        command, success, output = attempts[-1] if attempts[-1][1] else attempts[0]
+        result = self._direct_result(user_input, command, success, output, error_analysis, similar_commands,
+                                     attempts)
+        result["speculation"] = {"candidate": candidate, "hit": hit,
+                                 "retry_command": attempts[1][0] if len(attempts) > 1 else None}
+        return result
+
+    def _run_speculative(self, user_input: str, trace: Trace, use_cache: bool) -> Dict[str, Any]:
+        """推测流水线：把直接流水线中互不依赖的步骤并发执行，墙钟耗时接近其中最慢的一步而不是各步之和
+
+        1. 以本地BM25检索到的相似命令为示例立即开始生成命令，同时进行完整的（需要嵌入调用的）检索；
+        2. 检索结果中有高置信度的只读历史命令时，在LLM生成命令的同时推测执行它，LLM生成的命令
+           与之相同时直接使用推测执行的结果，否则取消推测执行；启用命令缓存时，近似重复请求的检查
+           也在这一步进行，重放成功则取消命令生成；
+        3. 命令执行失败时，错误分析与重试（生成修正后的命令并执行）同时进行，重试成功则取消错误分析，
+           否则返回原命令的失败结果和错误分析。
+
+        同步版本的各分支在线程池中执行，落选分支中已经开始的LLM调用和命令无法中断，只丢弃其结果；
+        异步版本会取消落选的任务并终止推测执行的子进程。
         """
+        config = {"callbacks": [trace.callback_handler]}
+        pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative")
+
+        def submit(fn: Callable[..., Any], *args: Any) -> Future:
+            # 复制当前上下文，各分支共享请求上下文，span挂在本次请求的耗时树上
+            return pool.submit(contextvars.copy_context().run, fn, *args)
+
         try:
-            # Agent执行核心任务
-            result = self.agent_executor.invoke({"input": user_input})
+            examples = self.rag_search.get_similar_commands(user_input, mode="lexical")
+            retrieval = submit(self.rag_search.get_similar_commands, user_input)
+            generation = submit(self._generate_command, user_input, examples, config)
+            candidate = self._speculation_candidate(examples)
+            speculation = submit(self.shell_executor.execute_command, candidate) if candidate else None
+
+            similar_commands = retrieval.result()
+            entry = self.command_cache.match_similar(similar_commands) if use_cache else None
+            if entry is not None:
+                replay = speculation if entry["command"] == candidate else \
+                    submit(self.shell_executor.execute_command, entry["command"])
+                success, output = replay.result()
+                if success:
+                    return self._cache_hit_result(user_input, entry, "similar", output, similar_commands)
+            emit_event(EVENT_SIMILAR_COMMANDS, similar_commands=similar_commands)
+            if candidate is None:
+                candidate = self._speculation_candidate(similar_commands)
+                speculation = submit(self.shell_executor.execute_command, candidate) if candidate else None
+
+            command = generation.result()
+            trace.callback_handler.close_iteration()
+            hit = speculation is not None and command == candidate
+            if hit:
+                success, output = speculation.result()
+            else:
+                with span("execute_shell_command", "tool"):
+                    success, output = self.shell_executor.execute_command(command)
+            attempts = [(command, success, output)]
+            if success:
+                with span("save_command_history", "tool"):
+                    self.rag_search.add_shell_command_history(user_input, command, output, True)
+                return self._speculative_result(user_input, attempts, "", similar_commands, candidate, hit)
+
+            analysis = submit(self.error_analyzer.analyze_error, user_input, command, output)
+            retried = self._retry(user_input, command, output, similar_commands, config)
+            if retried is not None:
+                attempts.append(retried)
+                if retried[1]:
+                    return self._speculative_result(user_input, attempts, "", similar_commands, candidate, hit)
+            return self._speculative_result(user_input, attempts, analysis.result(), similar_commands, candidate, hit)
+        finally:
+            # 不等待落选的分支，尚未开始的直接取消
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _arun_speculative(self, user_input: str, trace: Trace, use_cache: bool) -> Dict[str, Any]:
+        """_run_speculative 的异步版本，落选的分支被取消，推测执行的子进程随之终止"""
+        config = {"callbacks": [trace.callback_handler]}
+        tasks: List[asyncio.Task] = []
+
+        def start(coroutine) -> asyncio.Task:
+            task = asyncio.create_task(coroutine)
+            tasks.append(task)
+            return task
 
-            # 提取命令执行信息
-            command_info = _extract_command_info(result, self.max_output_length)
+        try:
+            examples = await self.rag_search.aget_similar_commands(user_input, mode="lexical")
+            retrieval = start(self.rag_search.aget_similar_commands(user_input))
+            generation = start(self._agenerate_command(user_input, examples, config))
+            candidate = self._speculation_candidate(examples)
+            speculation = start(self.shell_executor.aexecute_command(candidate)) if candidate else None
+
+            similar_commands = await retrieval
+            entry = self.command_cache.match_similar(similar_commands) if use_cache else None
+            if entry is not None:
+                replay = speculation if entry["command"] == candidate else \
+                    start(self.shell_executor.aexecute_command(entry["command"]))
+                success, output = await replay
+                if success:
+                    return self._cache_hit_result(user_input, entry, "similar", output, similar_commands)
+            emit_event(EVENT_SIMILAR_COMMANDS, similar_commands=similar_commands)
+            if candidate is None:
+                candidate = self._speculation_candidate(similar_commands)
+                speculation = start(self.shell_executor.aexecute_command(candidate)) if candidate else None
+
+            command = await generation
+            trace.callback_handler.close_iteration()
+            hit = speculation is not None and command == candidate
+            if hit:
+                success, output = await speculation
+            else:
+                if speculation is not None:
+                    speculation.cancel()
+                with span("execute_shell_command", "tool"):
+                    success, output = await self.shell_executor.aexecute_command(command)
+            attempts = [(command, success, output)]
+            if success:
+                with span("save_command_history", "tool"):
+                    await self.rag_search.aadd_shell_command_history(user_input, command, output, True)
+                return self._speculative_result(user_input, attempts, "", similar_commands, candidate, hit)
+
+            analysis = start(self.error_analyzer.aanalyze_error(user_input, command, output))
+            retried = await self._aretry(user_input, command, output, similar_commands, config)
+            if retried is not None:
+                attempts.append(retried)
+                if retried[1]:
+                    return self._speculative_result(user_input, attempts, "", similar_commands, candidate, hit)
+            return self._speculative_result(user_input, attempts, await analysis, similar_commands, candidate, hit)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
 
-            # 获取相似命令
+    def _truncate_output(self, output: str) -> str:
+        """限制输出长度，避免token超限"""
+        if len(output) > self.max_output_length:
+            return output[:self.max_output_length] + "\n... (输出已截断)"
+        return output
+
+    def _find_cache_entry(self, user_input: str, similar: bool = True
+                          ) -> Tuple[Optional[Dict[str, Any]], str, Optional[List[Dict[str, Any]]]]:
+        """查找命令缓存：先做精确匹配，未命中时用相似历史命令判断是否为近似重复请求
+
+        Args:
+            similar: 是否检查近似重复请求，为False时只做精确匹配
+
+        Returns:
+            (缓存条目或None, 命中类型, 查找过程中检索到的相似命令或None)
+        """
+        with span("command_cache", "cache"):
+            entry = self.command_cache.get(user_input)
+            if entry is not None or not similar:
+                return entry, "exact", None
             similar_commands = self.rag_search.get_similar_commands(user_input)
+            return self.command_cache.match_similar(similar_commands), "similar", similar_commands
+
+    def _cache_hit_result(self, user_input: str, entry: Dict[str, Any], hit_type: str, output: str,
+                          similar_commands: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """组装缓存命中（重放成功）时的结果"""
+        self.command_cache.put(user_input, entry["command"])
+        emit_event(EVENT_SIMILAR_COMMANDS, similar_commands=similar_commands)
+        return {
+            "command": entry["command"],
+            "success": True,
+            "output": self._truncate_output(output),
+            "error_analysis": "",
+            "similar_commands": similar_commands,
+            "intermediate_steps": [],
+            "cache_hit": hit_type,
+            "fast_path": False
+        }
+
+    def _lookup_cache(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """查找命令缓存，命中时直接重放命令而不调用LLM
+
+        重放失败的缓存条目会被移除，调用方随后回退到完整的Agent流程。
+        speculative 流水线在这里只做精确匹配，近似重复请求的检查与命令生成并发进行。
+        """
+        entry, hit_type, similar_commands = self._find_cache_entry(user_input, self.pipeline != "speculative")
+        if entry is None:
+            return None
+
+        success, output = self.shell_executor.execute_command(entry["command"])
+        if not success:
+            self.command_cache.invalidate(user_input)
+            return None
+
+        if similar_commands is None:
+            similar_commands = self.rag_search.get_similar_commands(user_input)
+        return self._cache_hit_result(user_input, entry, hit_type, output, similar_commands)
+
+    async def _alookup_cache(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """_lookup_cache 的异步版本"""
+        entry, hit_type, similar_commands = await asyncio.to_thread(self._find_cache_entry, user_input,
+                                                                    self.pipeline != "speculative")
+        if entry is None:
+            return None
+
+        success, output = await self.shell_executor.aexecute_command(entry["command"])
+        if not success:
+            self.command_cache.invalidate(user_input)
+            return None
+
+        if similar_commands is None:
+            similar_commands = await self.rag_search.aget_similar_commands(user_input)
+        return self._cache_hit_result(user_input, entry, hit_type, output, similar_commands)
+
+    def _detect_command(self, user_input: str) -> Optional[str]:
+        """判断用户输入本身是否为可直接执行的命令，未启用快速路径时返回None"""
+        if self.command_detector is None:
+            return None
+        with span("detect_command", "fast_path"):
+            return self.command_detector.detect(user_input)
+
+    def _fast_path_result(self, command: str, output: str) -> Dict[str, Any]:
+        """组装快速路径的结果，不做相似命令检索以免额外的嵌入调用"""
+        return {
+            "command": command,
+            "success": True,
+            "output": self._truncate_output(output),
+            "error_analysis": "",
+            "similar_commands": [],
+            "intermediate_steps": [],
+            "cache_hit": None,
+            "fast_path": True
+        }
+
+    def _run_fast_path(self, user_input: str, command: str) -> Optional[Dict[str, Any]]:
+        """直接执行字面命令，成功时保存历史
+
+        执行失败（包括命令不存在）时不保存历史并返回None，由正常流程处理该请求：
+        识别器可能把自然语言误认为命令，失败的结果不能作为这个请求的回答。
+        """
+        success, output = self.shell_executor.execute_command(command)
+        if not success:
+            return None
+        self.rag_search.add_shell_command_history(user_input, command, output, True)
+        return self._fast_path_result(command, output)
+
+    async def _arun_fast_path(self, user_input: str, command: str) -> Optional[Dict[str, Any]]:
+        """_run_fast_path 的异步版本"""
+        success, output = await self.shell_executor.aexecute_command(command)
+        if not success:
+            return None
+        await self.rag_search.aadd_shell_command_history(user_input, command, output, True)
+        return self._fast_path_result(command, output)
+
+    def _check_cache_bypass(self, bypass_cache: bool) -> bool:
+        """判断本次请求是否需要查找命令缓存"""
+        if self.command_cache is None:
+            return False
+        if bypass_cache:
+            self.command_cache.bypassed += 1
+            return False
+        return True
 
-            return {
-                "command": command_info["command"],
-                "success": command_info["success"],
-                "output": command_info["output"],
-                "error_analysis": command_info["error_analysis"],
-                "similar_commands": similar_commands,
-                "intermediate_steps": result.get("intermediate_steps", [])
-            }
+    def _agent_result(self, user_input: str, result: Dict[str, Any],
+                      similar_commands: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """从Agent执行结果组装结构化结果，并缓存执行成功的命令"""
+        emit_event(EVENT_SIMILAR_COMMANDS, similar_commands=similar_commands)
+        # 提取命令执行信息
+        command_info = _extract_command_info(result, self.max_output_length)
 
+        # 缓存执行成功的命令，供后续重复请求直接重放
+        if self.command_cache is not None and command_info["success"] and command_info["command"]:
+            self.command_cache.put(user_input, command_info["command"])
+
+        return {
+            "command": command_info["command"],
+            "success": command_info["success"],
+            "output": command_info["output"],
+            "error_analysis": command_info["error_analysis"],
+            "similar_commands": similar_commands,
+            "intermediate_steps": result.get("intermediate_steps", []),
+            "cache_hit": None,
+            "fast_path": False
+        }
+
+    @staticmethod
+    def _error_result(user_input: str, error: Exception, similar_commands: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Agent执行出错时的降级结果"""
+        print(f"Agent执行出错: {str(error)}")
+        return {
+            "input": user_input,
+            "command": "",
+            "success": False,
+            "output": f"处理时发生错误: {error}",
+            "error_analysis": "",
+            "similar_commands": similar_commands,
+            "intermediate_steps": [],
+            "cache_hit": None,
+            "fast_path": False,
+            "error": str(error)
+        }
+
+    def _finish_request(self, user_input: str, result: Dict[str, Any], context, trace: Trace) -> Dict[str, Any]:
+        """补充检索统计和耗时，把追踪记录交给回调，并产出 result 事件"""
+        result["retrieval_stats"] = context.stats()
+        result["resource_usage"] = context.resource_usage
+        result["context_budget"] = context.budget_stats()
+        result["timings"] = trace.summary()
+        context.emit(EVENT_RESULT, result=result)
+        if self.trace_callbacks:
+            record = {"input": user_input, "command": result.get("command", ""),
+                      "success": result.get("success", False), **result["timings"]}
+            for callback in self.trace_callbacks:
+                try:
+                    callback(record)
+                except Exception as e:
+                    print(f"追踪回调出错: {str(e)}")
+        return result
+
+    def process_input(self, user_input: str, bypass_cache: bool = False,
+                      event_callback: Optional[EventCallback] = None,
+                      session_id: Optional[str] = None, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        处理用户输入，通过Agent协调工具执行，并返回结构化结果。
+
+        每次调用都在独立的请求上下文中执行，Agent工具与最终结果组装共享同一次检索，
+        结果中的 retrieval_stats 记录本次请求的嵌入调用和向量查询次数，
+        timings 记录本次请求的耗时树（Agent迭代、LLM调用及token、工具调用、嵌入、检索和子进程），
+        context_budget 记录上下文压缩少发送的token数和单次迭代提示词的最大估算token数。
+
+        输入本身就是当前shell可直接执行的命令时（见 CommandDetector），跳过Agent循环直接执行，
+        执行成功时结果中的 fast_path 为True，执行失败时继续按正常流程处理。
+        pipeline 为 "direct" 时不运行Agent循环，只调用一次LLM生成命令，结果字段与Agent流程相同。
+
+        Args:
+            user_input: 用户输入
+            bypass_cache: 为True时跳过命令缓存，强制走完整的Agent流程
+            event_callback: 流式事件回调，处理过程中按顺序收到 AgentEvent，最后一个事件为 result
+            session_id: 会话ID，启用Shell进程池时同一会话的命令在同一个shell中执行，保留cd和环境变量
+            tenant: 租户（如用户或主机），相似命令检索、历史保存和命令缓存只在该租户的数据内进行，
+                为None时使用默认租户
+        """
+        self._start_warm_up()
+        trace = Trace("process_input", input=user_input)
+        with request_context(event_callback, session_id, tenant) as context, trace.activate():
+            result = self._process_input(user_input, bypass_cache, trace)
+        return self._finish_request(user_input, result, context, trace)
+
+    def _process_input(self, user_input: str, bypass_cache: bool, trace: Trace) -> Dict[str, Any]:
+        """process_input 的实际处理逻辑，需在请求上下文中调用"""
+        command = self._detect_command(user_input)
+        if command is not None:
+            result = self._run_fast_path(user_input, command)
+            if result is not None:
+                return result
+        self._prefetch_pipeline()
+
+        use_cache = self._check_cache_bypass(bypass_cache)
+        if use_cache:
+            cached_result = self._lookup_cache(user_input)
+            if cached_result is not None:
+                return cached_result
+
+        try:
+            if self.pipeline == "direct":
+                return self._run_direct(user_input, trace)
+            if self.pipeline == "speculative":
+                return self._run_speculative(user_input, trace, use_cache)
+            # Agent执行核心任务
+            result = self.agent_executor.invoke({"input": user_input},
+                                                config={"callbacks": [trace.callback_handler]})
+            return self._agent_result(user_input, result, self.rag_search.get_similar_commands(user_input))
         except Exception as e:
-            print(f"Agent执行出错: {str(e)}")
             # 简化降级处理
-            return {
-                "input": user_input,
-                "command": "",
-                "success": False,
-                "output": f"处理时发生错误: {e}",
-                "error_analysis": "",
-                "similar_commands": self.rag_search.get_similar_commands(user_input),
-                "intermediate_steps": [],
-                "error": str(e)
-            }
+            return self._error_result(user_input, e, self.rag_search.get_similar_commands(user_input))
+
+    async def aprocess_input(self, user_input: str, bypass_cache: bool = False,
+                             event_callback: Optional[EventCallback] = None,
+                             session_id: Optional[str] = None, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """process_input 的异步版本
+
+        使用LangChain的异步执行路径（ainvoke）和asyncio子进程，等待网络和子进程时不阻塞事件循环，
+        可在同一进程内并发处理多个请求。每个请求拥有独立的请求上下文，LLM和嵌入客户端在请求间共享。
+        """
+        self._start_warm_up()
+        trace = Trace("aprocess_input", input=user_input)
+        with request_context(event_callback, session_id, tenant) as context, trace.activate():
+            result = await self._aprocess_input(user_input, bypass_cache, trace)
+        return self._finish_request(user_input, result, context, trace)
+
+    async def _aprocess_input(self, user_input: str, bypass_cache: bool, trace: Trace) -> Dict[str, Any]:
+        """aprocess_input 的实际处理逻辑，需在请求上下文中调用"""
+        command = await asyncio.to_thread(self._detect_command, user_input)
+        if command is not None:
+            result = await self._arun_fast_path(user_input, command)
+            if result is not None:
+                return result
+        self._prefetch_pipeline()
+
+        use_cache = self._check_cache_bypass(bypass_cache)
+        if use_cache:
+            cached_result = await self._alookup_cache(user_input)
+            if cached_result is not None:
+                return cached_result
+
+        try:
+            if self.pipeline == "direct":
+                return await self._arun_direct(user_input, trace)
+            if self.pipeline == "speculative":
+                return await self._arun_speculative(user_input, trace, use_cache)
+            result = await self.agent_executor.ainvoke({"input": user_input},
+                                                       config={"callbacks": [trace.callback_handler]})
+            similar_commands = await self.rag_search.aget_similar_commands(user_input)
+            return self._agent_result(user_input, result, similar_commands)
+        except Exception as e:
+            return self._error_result(user_input, e, await self.rag_search.aget_similar_commands(user_input))
+
+    def stream_input(self, user_input: str, bypass_cache: bool = False,
+                     session_id: Optional[str] = None, tenant: Optional[str] = None) -> Iterator[AgentEvent]:
+        """以流式事件的形式处理用户输入
+
+        请求在后台线程中处理，事件一产生就交给调用方：相似历史命令、确定执行的命令、
+        命令输出块、错误分析的增量文本，最后是包含完整结果的 result 事件。
+
+        Args:
+            user_input: 用户输入
+            bypass_cache: 为True时跳过命令缓存
+            session_id: 会话ID，含义同 process_input
+            tenant: 租户，含义同 process_input
+
+        Yields:
+            AgentEvent: 流式事件
+        """
+        events: "queue.Queue[Any]" = queue.Queue()
+
+        def worker():
+            try:
+                self.process_input(user_input, bypass_cache, event_callback=events.put, session_id=session_id,
+                                   tenant=tenant)
+            except BaseException as e:
+                events.put(e)
+
+        threading.Thread(target=worker, daemon=True).start()
+        while True:
+            event = events.get()
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+            if event.type == EVENT_RESULT:
+                return
+
+    async def astream_input(self, user_input: str, bypass_cache: bool = False, session_id: Optional[str] = None,
+                            tenant: Optional[str] = None) -> AsyncIterator[AgentEvent]:
+        """stream_input 的异步版本，基于 aprocess_input，事件可能来自线程池中的工作线程"""
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Optional[AgentEvent]]" = asyncio.Queue()
+        task = asyncio.create_task(self.aprocess_input(
+            user_input, bypass_cache,
+            event_callback=lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+            session_id=session_id,
+            tenant=tenant
+        ))
+
+        def on_done(done: "asyncio.Task"):
+            # 处理出错时没有 result 事件，放入None唤醒等待方
+            if not done.cancelled() and done.exception() is not None:
+                events.put_nowait(None)
+
+        task.add_done_callback(on_done)
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    await task
+                    return
+                yield event
+                if event.type == EVENT_RESULT:
+                    return
+        finally:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,128 @@
+"""
+批处理模块 - 从JSONL文件批量处理用户请求，并以JSONL流式写出结构化结果
+"""
+import json
+import os
+from typing import Any, Dict, IO, Iterable, List, Optional, Set
+
+from .agent import ShellAgent
+from .runner import ConcurrentRunner
+
+# 写入结果文件的字段
+RESULT_FIELDS = ("command", "success", "output", "error_analysis", "timings", "cache_hit", "fast_path", "resource_usage",
+                 "context_budget", "speculation", "error")
+
+
+class BatchProcessor:
+    """批量处理JSONL请求
+
+    输入每行可以是 {"id": ..., "input": ..., "tenant": ...} 对象或单独的JSON字符串，缺少id时使用行号，
+    缺少tenant时使用构造时指定的租户；
+    结果按完成顺序逐行写出并立即刷新，中断后可根据已有结果文件跳过已完成的请求。
+    """
+
+    def __init__(self, agent: ShellAgent, parallelism: int = 4, tenant: Optional[str] = None):
+        """初始化批处理器
+
+        Args:
+            agent: Shell智能体实例
+            parallelism: 同时处理的最大请求数
+            tenant: 请求未指定租户时使用的租户
+        """
+        self.runner = ConcurrentRunner(agent, concurrency=parallelism)
+        self.tenant = tenant
+
+    @staticmethod
+    def read_requests(stream: IO[str]) -> List[Dict[str, Any]]:
+        """读取JSONL请求
+
+        Returns:
+            List[Dict[str, Any]]: 请求列表，每项包含 id 和 input，指定了租户时还包含 tenant
+        """
+        requests = []
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"input": record}
+            user_input = record.get("input", record.get("user_input"))
+            if not isinstance(user_input, str):
+                raise ValueError(f"第 {line_number} 行缺少 input 字段")
+            request = {"id": str(record.get("id", line_number)), "input": user_input}
+            if record.get("tenant") is not None:
+                request["tenant"] = str(record["tenant"])
+            requests.append(request)
+        return requests
+
+    @staticmethod
+    def completed_ids(output_path: str) -> Set[str]:
+        """读取已有结果文件中已完成的请求id，忽略中断时写了一半的行"""
+        done: Set[str] = set()
+        if not os.path.exists(output_path):
+            return done
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(str(json.loads(line)["id"]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return done
+
+    @staticmethod
+    def _ensure_trailing_newline(output_path: str):
+        """若结果文件以不完整的行结尾，补上换行，避免与新结果拼在同一行"""
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            return
+        with open(output_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    @staticmethod
+    def format_result(request: Dict[str, Any], result: Dict[str, Any]) -> str:
+        """将处理结果格式化为一行JSON"""
+        record = {"id": request["id"], "input": request["input"]}
+        if "tenant" in request:
+            record["tenant"] = request["tenant"]
+        for field in RESULT_FIELDS:
+            if field in result:
+                record[field] = result[field]
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+    async def run(self, requests: Iterable[Dict[str, Any]], output: IO[str]) -> int:
+        """并发处理请求，并按完成顺序写出结果
+
+        Returns:
+            int: 本次处理的请求数
+        """
+        requests = list(requests)
+        count = 0
+        request_kwargs = [{"tenant": r.get("tenant", self.tenant)} for r in requests]
+        async for index, result in self.runner.iter_completed([r["input"] for r in requests], request_kwargs):
+            output.write(self.format_result(requests[index], result) + "\n")
+            output.flush()
+            count += 1
+        return count
+
+    async def run_file(self, input_stream: IO[str], output_path: str, resume: bool = False) -> Dict[str, int]:
+        """处理JSONL请求流并写入结果文件
+
+        Args:
+            input_stream: JSONL请求输入流
+            output_path: 结果文件路径
+            resume: 是否跳过结果文件中已完成的请求并追加写入
+
+        Returns:
+            Dict[str, int]: 处理统计 (total, skipped, processed)
+        """
+        requests = self.read_requests(input_stream)
+        done = self.completed_ids(output_path) if resume else set()
+        pending = [r for r in requests if r["id"] not in done]
+
+        if resume:
+            self._ensure_trailing_newline(output_path)
+        with open(output_path, "a" if resume else "w", encoding="utf-8") as output:
+            processed = await self.run(pending, output)
+        return {"total": len(requests), "skipped": len(requests) - len(pending), "processed": processed}
@@ -0,0 +1,159 @@
+"""
+缓存模块 - 提供LRU/TTL缓存以及命令结果缓存
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .context import get_request_context
+from .utils import DocumentUtils, PlatformUtils
+
+
+class LRUTTLCache:
+    """线程安全的LRU缓存，条目超过TTL后自动失效"""
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = 3600):
+        """初始化缓存
+
+        Args:
+            max_size: 最大条目数，超出时淘汰最久未使用的条目
+            ttl: 条目存活时间（秒），为None时永不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取条目，命中时将其移到最近使用的位置"""
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._is_expired(item[0], now):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, stored_at: Optional[float] = None):
+        """写入条目，必要时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (stored_at if stored_at is not None else time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """删除条目并返回其值"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item is not None else None
+
+    def items(self) -> List[Tuple[Hashable, float, Any]]:
+        """返回所有未过期条目 (键, 写入时间, 值)，按最近使用顺序排列"""
+        now = time.time()
+        with self._lock:
+            return [(key, stored_at, value) for key, (stored_at, value) in self._data.items()
+                    if not self._is_expired(stored_at, now)]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CommandCache:
+    """命令缓存，以规范化的用户输入、操作系统/shell、模型名称和租户为键
+
+    精确命中时直接重放已成功执行过的命令；未精确命中时，可根据RAG检索到的
+    相似历史命令判断是否为近似重复请求。
+    """
+
+    def __init__(self, model_name: str, max_size: int = 1000, ttl: Optional[float] = 3600,
+                 similarity_threshold: float = 0.95):
+        """初始化命令缓存
+
+        Args:
+            model_name: 生成命令所用的模型名称
+            max_size: 最大缓存条目数
+            ttl: 缓存条目存活时间（秒）
+            similarity_threshold: 近似重复判定的相似度阈值（0~1），大于1时禁用近似匹配
+        """
+        self.model_name = model_name
+        self.similarity_threshold = similarity_threshold
+        self._cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self.near_hits = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def normalize(user_input: str) -> str:
+        """规范化用户输入：去除首尾空白和结尾标点、合并空白、转为小写"""
+        return DocumentUtils.normalize_user_input(user_input)
+
+    def make_key(self, user_input: str) -> Tuple[str, str, str, str, str]:
+        """生成缓存键 (规范化输入, 操作系统, shell, 模型名称, 租户)，租户取自当前请求上下文"""
+        os_type = "Windows" if PlatformUtils.is_windows() else "Linux/macOS"
+        shell_type = PlatformUtils.get_shell_command()[0]
+        context = get_request_context()
+        tenant = (context.tenant if context is not None else None) or ""
+        return self.normalize(user_input), os_type, shell_type, self.model_name, tenant
+
+    def get(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """精确查找缓存的命令"""
+        return self._cache.get(self.make_key(user_input))
+
+    def put(self, user_input: str, command: str):
+        """缓存一条执行成功的命令"""
+        self._cache.set(self.make_key(user_input), {"user_input": user_input, "command": command})
+
+    def invalidate(self, user_input: str):
+        """使某条缓存失效（例如重放失败时）"""
+        self._cache.pop(self.make_key(user_input))
+
+    def match_similar(self, similar_commands: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """从相似历史命令中挑选请求相似度超过阈值的成功命令
+
+        比较的是用户请求与历史记录中的请求（request_similarity），而不是与整条历史文档的向量距离：
+        历史文档还包含命令本身，即使请求完全相同，文档距离换算出的相似度也远低于阈值。
+
+        Args:
+            similar_commands: RAGSearch.get_similar_commands 的返回结果
+
+        Returns:
+            Optional[Dict[str, Any]]: 命中的条目，未命中时返回None
+        """
+        best = None
+        best_similarity = self.similarity_threshold
+        for item in similar_commands:
+            similarity = item.get("request_similarity")
+            if not item.get("success") or not item.get("command") or similarity is None:
+                continue
+            if similarity >= best_similarity:
+                best, best_similarity = item, similarity
+        if best is None:
+            return None
+        self.near_hits += 1
+        return {"user_input": best.get("user_input", ""), "command": best["command"],
+                "similarity": best_similarity}
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        return {
+            "hits": self._cache.hits,
+            "near_hits": self.near_hits,
+            "misses": self._cache.misses,
+            "bypassed": self.bypassed,
+            "size": len(self._cache)
+        }
@@ -0,0 +1,149 @@
+"""
+命令识别模块 - 在本地判断用户输入是否本身就是当前shell可直接执行的命令
+"""
+import os
+import re
+import shlex
+import shutil
+import subprocess
+from typing import List, Optional
+
+from .utils import PlatformUtils
+
+
+class CommandDetector:
+    """字面命令识别器
+
+    用户经常直接输入命令（如 ``ls -la``、``git status``），这类输入无需LLM规划即可执行。
+    识别完全在本地完成：按shell规则切分输入，检查第一个词是否为shell内建命令或PATH中的
+    可执行文件，并在bash下用 ``bash -n`` 检查语法。为避免把英文自然语言（如
+    "free memory"、"file size of main.py"）误当成命令，不含管道、重定向等shell操作符的输入中，
+    其余的词都必须像参数：选项、数字、已存在的路径或含有路径、变量、通配符等符号的词；
+    只有 git、docker 等子命令式工具的第一个参数可以是普通单词。交互式程序，以及不带参数时
+    会等待标准输入的程序（如 ``python``、``cat``）不视为命令。
+    """
+
+    # bash内建命令和关键字，它们不在PATH中
+    BASH_BUILTINS = frozenset({
+        ".", ":", "[", "[[", "alias", "bg", "cd", "command", "declare", "dirs", "echo", "env", "eval",
+        "exec", "export", "false", "fg", "for", "function", "hash", "help", "history", "if", "jobs",
+        "kill", "let", "local", "popd", "printf", "pushd", "pwd", "read", "readonly", "set", "shopt",
+        "source", "test", "time", "times", "trap", "true", "type", "typeset", "ulimit", "umask",
+        "unalias", "unset", "until", "wait", "while", "{", "("
+    })
+    # PowerShell的常用别名；Verb-Noun形式的cmdlet按命名规则识别
+    POWERSHELL_ALIASES = frozenset({
+        "cat", "cd", "cls", "copy", "cp", "del", "dir", "echo", "gci", "gc", "gps", "kill", "ls",
+        "man", "md", "mkdir", "move", "mv", "ps", "pwd", "rd", "ren", "rm", "rmdir", "sls", "type"
+    })
+
+    # 子命令式工具，第一个参数可以是普通单词（如 git status、docker ps）
+    SUBCOMMAND_TOOLS = frozenset({
+        "git", "docker", "podman", "kubectl", "npm", "yarn", "pnpm", "pip", "pip3", "cargo", "go", "make",
+        "systemctl", "journalctl", "apt", "apt-get", "brew", "conda", "poetry", "uv", "helm", "terraform"
+    })
+    # 交互式或不会自行结束的程序，无论是否带参数都不视为命令
+    INTERACTIVE = frozenset({
+        "vi", "vim", "nvim", "nano", "emacs", "less", "more", "man", "top", "htop", "watch", "yes", "ssh",
+        "telnet", "ftp", "sftp", "screen", "tmux"
+    })
+    # 不带参数时读取标准输入或进入交互模式的程序
+    STDIN_READERS = frozenset({
+        "python", "python3", "ipython", "node", "ruby", "irb", "perl", "php", "lua", "R", "julia", "ghci",
+        "bash", "sh", "zsh", "dash", "fish", "bc", "dc", "cat", "tac", "sort", "uniq", "wc", "head", "tail",
+        "tee", "sed", "awk", "tr", "xargs", "grep", "read", "ed", "nc", "sqlite3", "mysql", "psql", "redis-cli",
+        "mongo", "gdb", "pdb", "time"
+    })
+
+    _CMDLET_RE = re.compile(r"^[A-Za-z]+-[A-Za-z]+$")
+    _ENV_ASSIGNMENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+    _QUOTED_RE = re.compile(r"'[^']*'|\"[^\"]*\"")
+    _CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+    # 出现这些操作符说明输入是shell命令行（管道、重定向、命令连接、命令替换）
+    _SHELL_OPERATOR_RE = re.compile(r"[|&;<>`]|\$\(")
+    # 只由字母组成的普通单词，不是选项、路径或变量
+    _PLAIN_WORD_RE = re.compile(r"^[A-Za-z][A-Za-z']*$")
+
+    def __init__(self, syntax_check_timeout: float = 2.0):
+        """初始化命令识别器
+
+        Args:
+            syntax_check_timeout: ``bash -n`` 语法检查的超时时间（秒）
+        """
+        self.syntax_check_timeout = syntax_check_timeout
+        self.is_windows = PlatformUtils.is_windows()
+
+    def _split(self, text: str) -> Optional[List[str]]:
+        """按shell规则切分输入，引号不匹配时返回None"""
+        try:
+            return shlex.split(text, posix=not self.is_windows)
+        except ValueError:
+            return None
+
+    def _is_executable(self, name: str) -> bool:
+        """判断命令名是否为shell内建命令、PowerShell cmdlet或可执行文件"""
+        if self.is_windows:
+            if name.lower() in self.POWERSHELL_ALIASES or self._CMDLET_RE.match(name):
+                return True
+        elif name in self.BASH_BUILTINS:
+            return True
+        if os.sep in name or (os.altsep and os.altsep in name):
+            return os.path.isfile(name) and os.access(name, os.X_OK)
+        return shutil.which(name) is not None
+
+    def _looks_like_arguments(self, name: str, args: List[str]) -> bool:
+        """判断命令名之后的词是否都像参数而不是英文自然语言"""
+        for index, arg in enumerate(args):
+            if not self._PLAIN_WORD_RE.match(arg) or os.path.exists(arg):
+                continue
+            if index == 0 and name in self.SUBCOMMAND_TOOLS:
+                continue
+            return False
+        return True
+
+    def _check_syntax(self, command: str) -> bool:
+        """用 ``bash -n`` 检查语法；PowerShell没有等价的快速检查，直接视为通过"""
+        if self.is_windows:
+            return True
+        shell = PlatformUtils.get_shell_command()[0]
+        try:
+            completed = subprocess.run([shell, "-n", "-c", command], stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                       timeout=self.syntax_check_timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        return completed.returncode == 0
+
+    def detect(self, user_input: str) -> Optional[str]:
+        """判断用户输入是否为可直接执行的命令
+
+        Args:
+            user_input: 用户输入
+
+        Returns:
+            Optional[str]: 可直接执行时返回命令（去除首尾空白），否则返回None
+        """
+        command = user_input.strip()
+        if not command or "\n" in command:
+            return None
+        # 引号外出现中文通常是自然语言描述
+        if self._CJK_RE.search(self._QUOTED_RE.sub("", command)):
+            return None
+
+        tokens = self._split(command)
+        if not tokens:
+            return None
+        # 跳过前导的环境变量赋值，如 FOO=bar make
+        words = list(tokens)
+        while words and self._ENV_ASSIGNMENT_RE.match(words[0]):
+            words.pop(0)
+        if not words or not self._is_executable(words[0]):
+            return None
+        name, args = os.path.basename(words[0]), words[1:]
+        if name in self.INTERACTIVE or (not args and name in self.STDIN_READERS):
+            return None
+        if not self._SHELL_OPERATOR_RE.search(self._QUOTED_RE.sub("", command)) and \
+                not self._looks_like_arguments(name, args):
+            return None
+
+        return command if self._check_syntax(command) else None
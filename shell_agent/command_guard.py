@@ -0,0 +1,973 @@
+"""
+命令安全检查模块 - 在启动子进程前静态分析命令的风险和开销，决定放行、改写、演练或拒绝
+"""
+import os
+import re
+import shlex
+from typing import Iterator, List, Optional, Set, Tuple
+
+from .utils import PlatformUtils
+
+
+class CommandAssessment:
+    """一条命令的静态分析结果"""
+
+    ALLOW = "allow"
+    REWRITE = "rewrite"
+    DRY_RUN = "dry_run"
+    REJECT = "reject"
+
+    def __init__(self, command: str):
+        """初始化分析结果
+
+        Args:
+            command: 原始命令
+        """
+        self.command = command
+        self.action = self.ALLOW
+        self.rewritten: Optional[str] = None
+        # 风险标签：catastrophic、destructive、network、unbounded_output、interactive、unparsable
+        self.risks: List[str] = []
+        self.reasons: List[str] = []
+
+    def flag(self, risk: str, reason: str):
+        """记录一项风险"""
+        if risk not in self.risks:
+            self.risks.append(risk)
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+
+    @property
+    def command_to_run(self) -> Optional[str]:
+        """实际应执行的命令，拒绝或演练时为None"""
+        if self.action in (self.REJECT, self.DRY_RUN):
+            return None
+        return self.rewritten or self.command
+
+    def describe(self) -> str:
+        """生成说明文字，作为未执行命令时的输出返回给调用方"""
+        reasons = "；".join(self.reasons)
+        if self.action == self.REJECT:
+            return f"命令未执行，已被安全检查拒绝: {reasons}"
+        if self.action == self.DRY_RUN:
+            return f"演练模式: 命令包含破坏性操作，未实际执行: {self.command}\n识别到的风险: {reasons}"
+        if self.action == self.REWRITE:
+            return f"命令已改写为 {self.rewritten}: {reasons}"
+        return ""
+
+    def __repr__(self) -> str:
+        return f"CommandAssessment({self.action!r}, risks={self.risks!r}, rewritten={self.rewritten!r})"
+
+
+class CommandGuard:
+    """命令静态分析器
+
+    按bash的词法把命令切分为由管道、;、&&、||、换行和括号连接的简单命令，跳过保留字和分组符号，
+    逐个识别可执行文件、参数和重定向目标，估计风险与开销：
+    - 格式化磁盘、删除根目录或系统目录、写块设备、关机、fork炸弹等直接拒绝；
+    - 交互式或永不结束的命令（如 ``tail -f``、``top``、``vim``）直接拒绝；
+    - 输出无界的命令（如 ``yes``、``find /``、读取大文件）在末尾追加 ``head`` 限制输出，
+      ``ping`` 补充 ``-c``；
+    - 破坏性操作按 destructive_policy 放行、演练（有原生演练选项时改写为演练命令，
+      否则不执行）或拒绝；
+    - 命令替换、进程替换、``bash -c``、``eval`` 以及通过管道或 here document 传给 bash 的嵌套命令
+      按同样规则递归分析，改写后放回原位；其中任何部分无法解析时拒绝整条命令。
+    只做纯字符串分析和少量 stat 调用，不启动任何进程；PowerShell 命令不做检查。
+    """
+
+    DESTRUCTIVE_POLICIES = ("allow", "dry_run", "reject")
+
+    # 控制操作符和重定向操作符，按长度从长到短匹配
+    _OPERATORS = sorted(["|", "|&", "||", "&&", ";", "&", ";;", ";&", ";;&", "(", ")", "\n", "<", ">", ">>", ">|",
+                         "<>", "<&", ">&", "&>", "&>>", "<<", "<<-", "<<<"], key=len, reverse=True)
+    _SEPARATORS = {"|", "|&", "||", "&&", ";", "&", ";;", ";&", ";;&", "(", ")", "\n"}
+    _CASE_SEPARATORS = {";;", ";&", ";;&"}
+    _WORD_BREAKS = " \t\n;&|()<>"
+    # 出现在命令位置时不是命令本身的保留字和分组符号，真正的命令在其后
+    _RESERVED_WORDS = {"{", "}", "!", "if", "then", "else", "elif", "fi", "while", "until", "do", "done", "esac"}
+    _ENV_ASSIGNMENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+    _FORK_BOMB_RE = re.compile(r":\s*\(\s*\)\s*\{[^}]*:\s*\|\s*:\s*&")
+    # 包装命令及其带参数的选项，真正的可执行文件在其后
+    _WRAPPERS = {"sudo": {"-u", "-g", "-C"}, "env": {"-u"}, "nohup": set(), "time": set(),
+                 "nice": {"-n"}, "ionice": {"-c", "-n"}, "timeout": set(), "command": set(), "exec": set(),
+                 "builtin": set()}
+    _SUBSHELLS = {"bash", "sh", "zsh", "dash"}
+
+    _SYSTEM_PATHS = {"/", "/*", "~", "~/", "~/*", "$HOME", "${HOME}", "/bin", "/boot", "/dev", "/etc",
+                     "/home", "/lib", "/lib64", "/opt", "/root", "/sbin", "/sys", "/usr", "/var"}
+    _DISK_TOOLS = {"mkfs", "fdisk", "sfdisk", "parted", "wipefs", "mkswap"}
+    _POWER_COMMANDS = {"shutdown", "reboot", "halt", "poweroff"}
+    _INTERACTIVE = {"vi", "vim", "nvim", "nano", "emacs", "less", "more", "htop", "watch", "ssh-keygen"}
+    _DESTRUCTIVE = {"rm", "rmdir", "shred", "unlink", "truncate", "dd", "kill", "killall", "pkill", "crontab"}
+    _NETWORK = {"curl", "wget", "ssh", "scp", "sftp", "rsync", "nc", "ncat", "telnet", "ftp", "ping", "ping6",
+                "traceroute", "dig", "nslookup", "host", "whois"}
+    # 子命令为网络操作或破坏性操作的工具
+    _NETWORK_SUBCOMMANDS = {"git": {"clone", "fetch", "pull", "push", "ls-remote"},
+                            "pip": {"install", "download"}, "pip3": {"install", "download"},
+                            "npm": {"install", "i", "publish"}, "apt": {"install", "update"},
+                            "apt-get": {"install", "update"}, "brew": {"install", "update"},
+                            "docker": {"pull", "push"}}
+    _DESTRUCTIVE_SUBCOMMANDS = {"git": {"clean", "reset", "rm"}, "pip": {"uninstall"}, "pip3": {"uninstall"},
+                                "apt": {"remove", "purge", "autoremove"}, "apt-get": {"remove", "purge", "autoremove"},
+                                "yum": {"remove", "erase"}, "dnf": {"remove", "erase"}, "brew": {"uninstall"},
+                                "docker": {"rm", "rmi", "prune"}, "npm": {"uninstall"}}
+    # 原生的演练选项：(可执行文件, 子命令或None) -> 插入的选项
+    _DRY_RUN_FLAGS = {("rsync", None): "--dry-run", ("git", "clean"): "-n",
+                      ("apt", None): "-s", ("apt-get", None): "-s", ("find", None): None}
+    # 管道末尾出现这些命令时输出已有界
+    _BOUNDING = {"head", "wc", "tail"}
+    _ENDLESS_DEVICES = {"/dev/zero", "/dev/urandom", "/dev/random"}
+    # 只读取信息、不修改文件和系统状态的命令，可以在LLM确认之前推测执行：可执行文件 -> (短选项, 长选项)
+    # 只有列出的选项被视为只读，其余选项（如 sort -o、date --set、rg --pre）一律视为可能写文件或执行其他命令。
+    # 短选项字母后带 ":" 表示带参数（参数可连写，如 -n5）；长选项以 "=" 结尾表示带参数（--opt=value 或 --opt value）
+    _READ_ONLY = {
+        "ls": ("1aAcdFGhiklLnprRsStuUX" "w:I:", {"--all", "--almost-all", "--human-readable", "--recursive",
+                                               "--reverse", "--directory", "--size", "--inode", "--classify",
+                                               "--full-time", "--group-directories-first", "--color", "--color=",
+                                               "--sort=", "--time-style=", "--ignore="}),
+        "pwd": ("LP", set()),
+        "echo": ("neE", set()),
+        "printf": ("", set()),
+        "cat": ("AbeEnstTuv", {"--number", "--number-nonblank", "--show-all", "--show-ends", "--show-tabs",
+                               "--squeeze-blank"}),
+        "head": ("qv" "n:c:", {"--quiet", "--verbose", "--lines=", "--bytes="}),
+        "tail": ("qv" "n:c:", {"--quiet", "--verbose", "--lines=", "--bytes="}),
+        "wc": ("lwcmL", {"--lines", "--words", "--bytes", "--chars", "--max-line-length"}),
+        "grep": ("EFGPiIvwxclLoqsnhHbrRaz" "e:f:m:A:B:C:", {
+            "--extended-regexp", "--fixed-strings", "--perl-regexp", "--ignore-case", "--invert-match",
+            "--word-regexp", "--line-regexp", "--count", "--files-with-matches", "--files-without-match",
+            "--only-matching", "--quiet", "--silent", "--line-number", "--with-filename", "--no-filename",
+            "--recursive", "--dereference-recursive", "--text", "--color", "--color=", "--include=", "--exclude=",
+            "--exclude-dir=", "--max-count=", "--regexp=", "--after-context=", "--before-context=", "--context=",
+            "--binary-files="}),
+        "rg": ("iIsSnNlcwvFxuULzHo" "e:g:t:T:A:B:C:m:M:j:", {
+            "--ignore-case", "--smart-case", "--case-sensitive", "--line-number", "--no-line-number",
+            "--files-with-matches", "--count", "--word-regexp", "--invert-match", "--fixed-strings", "--hidden",
+            "--no-ignore", "--follow", "--files", "--json", "--vimgrep", "--heading", "--no-heading",
+            "--with-filename", "--no-filename", "--only-matching", "--multiline", "--stats", "--type=",
+            "--type-not=", "--glob=", "--iglob=", "--max-count=", "--max-depth=", "--context=", "--after-context=",
+            "--before-context=", "--regexp=", "--color=", "--sort="}),
+        # find 的表达式都是单横线的完整单词
+        "find": ("", {"-name=", "-iname=", "-path=", "-ipath=", "-wholename=", "-iwholename=", "-regex=", "-iregex=",
+                      "-lname=", "-ilname=", "-type=", "-xtype=", "-mtime=", "-mmin=", "-atime=", "-amin=",
+                      "-ctime=", "-cmin=", "-size=", "-newer=", "-user=", "-group=", "-perm=", "-links=",
+                      "-inum=", "-samefile=", "-maxdepth=", "-mindepth=", "-printf=", "-empty", "-readable",
+                      "-writable", "-executable", "-not", "-and", "-or", "-a", "-o", "-prune", "-print", "-print0",
+                      "-ls", "-depth", "-xdev", "-follow", "-L", "-H", "-P", "-true", "-false", "-nouser",
+                      "-nogroup"}),
+        "du": ("ahscxkmLbD" "d:", {"--all", "--human-readable", "--summarize", "--total", "--apparent-size", "--si",
+                                   "--bytes", "--one-file-system", "--max-depth=", "--exclude=", "--block-size="}),
+        "df": ("ahHiTklPx" "t:", {"--all", "--human-readable", "--si", "--inodes", "--print-type", "--local",
+                                  "--portability", "--total", "--output", "--output=", "--type=", "--exclude-type=",
+                                  "--block-size="}),
+        "date": ("uRI" "d:r:", {"--utc", "--universal", "--rfc-email", "--iso-8601", "--iso-8601=", "--rfc-3339=",
+                                "--date=", "--reference="}),
+        "whoami": ("", set()),
+        "id": ("ugGnrz", {"--user", "--group", "--groups", "--name", "--real", "--zero"}),
+        "uname": ("asnrvmpio", {"--all", "--kernel-name", "--nodename", "--kernel-release", "--kernel-version",
+                                "--machine", "--processor", "--hardware-platform", "--operating-system"}),
+        "uptime": ("ps", {"--pretty", "--since"}),
+        # free -s/-c 会反复输出，不列入
+        "free": ("bkmghltw", {"--bytes", "--kilo", "--mega", "--giga", "--human", "--si", "--total", "--wide"}),
+        "ps": ("aAdeflFjHLMTwxr" "o:p:C:U:G:t:u:", {"--forest", "--no-headers", "--sort=", "--pid=", "--ppid=",
+                                                   "--user=", "--format="}),
+        "stat": ("LftF" "c:", {"--dereference", "--file-system", "--terse", "--format=", "--printf="}),
+        "file": ("bLhizkpsNE" "f:m:", {"--brief", "--mime", "--mime-type", "--mime-encoding", "--dereference",
+                                       "--no-dereference", "--files-from="}),
+        "which": ("as", {"--all", "--skip-alias"}),
+        "type": ("afptP", set()),
+        "printenv": ("0", {"--null"}),
+        "sort": ("bdfghiMnRrsuVcCz" "k:t:S:", {"--ignore-leading-blanks", "--dictionary-order", "--ignore-case",
+                                              "--general-numeric-sort", "--human-numeric-sort", "--month-sort",
+                                              "--numeric-sort", "--random-sort", "--reverse", "--stable", "--unique",
+                                              "--version-sort", "--check", "--zero-terminated", "--key=",
+                                              "--field-separator=", "--buffer-size="}),
+        "uniq": ("cdDiuz" "f:s:w:", {"--count", "--repeated", "--unique", "--ignore-case", "--zero-terminated",
+                                     "--skip-fields=", "--skip-chars=", "--check-chars="}),
+        "cut": ("snz" "b:c:f:d:", {"--only-delimited", "--complement", "--zero-terminated", "--bytes=",
+                                   "--characters=", "--fields=", "--delimiter=", "--output-delimiter="}),
+        "tr": ("cdsCt", {"--complement", "--delete", "--squeeze-repeats", "--truncate-set1"}),
+        "basename": ("az" "s:", {"--multiple", "--zero", "--suffix="}),
+        "dirname": ("z", {"--zero"}),
+        "realpath": ("eLmPqsz", {"--canonicalize-existing", "--canonicalize-missing", "--logical", "--physical",
+                                 "--quiet", "--strip", "--no-symlinks", "--zero", "--relative-to=",
+                                 "--relative-base="}),
+        "readlink": ("efmnqsvz", {"--canonicalize", "--canonicalize-existing", "--canonicalize-missing",
+                                  "--no-newline", "--quiet", "--silent", "--verbose", "--zero"}),
+        "tree": ("adfilpsughDFqNrtvCJXx" "L:P:I:", {"--dirsfirst", "--du", "--noreport", "--prune", "--charset=",
+                                                    "--sort="}),
+        "nproc": ("", {"--all", "--ignore="}),
+        "md5sum": ("bctwz", {"--binary", "--check", "--text", "--tag", "--quiet", "--status", "--strict", "--warn"}),
+        "sha1sum": ("bctwz", {"--binary", "--check", "--text", "--tag", "--quiet", "--status", "--strict", "--warn"}),
+        "sha256sum": ("bctwz", {"--binary", "--check", "--text", "--tag", "--quiet", "--status", "--strict",
+                                "--warn"}),
+        "diff": ("abBdEiNqrsTtuwy" "U:C:x:X:", {"--brief", "--unified", "--unified=", "--context", "--context=",
+                                               "--recursive", "--new-file", "--ignore-case", "--ignore-all-space",
+                                               "--ignore-space-change", "--ignore-blank-lines", "--side-by-side",
+                                               "--report-identical-files", "--suppress-common-lines", "--text",
+                                               "--normal", "--minimal", "--strip-trailing-cr", "--color",
+                                               "--color=", "--exclude=", "--width="}),
+        "cmp": ("blsz" "i:n:", {"--print-bytes", "--verbose", "--quiet", "--silent", "--bytes=",
+                                "--ignore-initial="}),
+        "column": ("tnex" "s:c:o:N:", {"--table", "--separator=", "--output-separator=", "--table-columns="}),
+        "lsof": ("anPilRtUwVbhKNX" "p:u:c:d:g:s:F:", set()),
+    }
+    _READ_ONLY_SUBCOMMANDS = {"git": {"status", "log", "diff", "show", "rev-parse", "ls-files", "blame", "describe",
+                                      "shortlog"},
+                              "docker": {"ps", "images", "inspect"}, "pip": {"list", "show", "freeze"},
+                              "pip3": {"list", "show", "freeze"}, "npm": {"ls", "list"}}
+    # 只读子命令允许的选项，格式同 _READ_ONLY；git 的 --output、--ext-diff、--textconv 等会写文件或执行外部程序，不列入
+    _READ_ONLY_SUBCOMMAND_OPTIONS = {
+        "git": ("pqvsbuzwcdimoMCrtelkNa" "n:L:U:S:G:", {
+            "--stat", "--shortstat", "--numstat", "--summary", "--name-only", "--name-status", "--cached", "--staged",
+            "--oneline", "--graph", "--all", "--decorate", "--no-decorate", "--abbrev-commit", "--reverse",
+            "--no-merges", "--merges", "--first-parent", "--follow", "--patch", "--no-patch", "--short",
+            "--porcelain", "--branch", "--ignored", "--abbrev-ref", "--show-toplevel", "--git-dir",
+            "--is-inside-work-tree", "--verify", "--symbolic-full-name", "--others", "--modified", "--deleted",
+            "--exclude-standard", "--tags", "--always", "--long", "--dirty", "--numbered", "--email", "--color",
+            "--no-color", "--word-diff", "--ignore-all-space", "--relative", "--quiet", "--exit-code", "--pretty",
+            "--format=", "--pretty=", "--since=", "--until=", "--after=", "--before=", "--author=", "--grep=",
+            "--max-count=", "--porcelain=", "--untracked-files=", "--abbrev=", "--date=", "--diff-filter=",
+            "--unified=", "--word-diff=", "--color="}),
+        "docker": ("aqsl" "f:n:", {"--all", "--quiet", "--no-trunc", "--size", "--latest", "--digests", "--format=",
+                                   "--filter=", "--last=", "--type="}),
+        "pip": ("oulev", {"--outdated", "--uptodate", "--local", "--user", "--editable", "--verbose", "--files",
+                          "--not-required", "--exclude-editable", "--all", "--format="}),
+        "pip3": ("oulev", {"--outdated", "--uptodate", "--local", "--user", "--editable", "--verbose", "--files",
+                           "--not-required", "--exclude-editable", "--all", "--format="}),
+        "npm": ("ag", {"--all", "--json", "--long", "--parseable", "--global", "--prod", "--dev", "--depth=",
+                       "--omit="}),
+    }
+    # 可以写作 -N 的数值选项（如 head -5、grep -3、git log -1）
+    _NUMERIC_OPTION_RE = re.compile(r"^-\d+$")
+    _NUMERIC_OPTIONS = {"head", "tail", "grep", "git"}
+
+    def __init__(self, destructive_policy: str = "allow", max_output_lines: int = 1000,
+                 max_file_bytes: int = 10 * 1024 * 1024, ping_count: int = 4, max_depth: int = 3):
+        """初始化命令分析器
+
+        Args:
+            destructive_policy: 破坏性操作的处理方式，"allow"、"dry_run" 或 "reject"
+            max_output_lines: 改写无界输出命令时 head 保留的行数
+            max_file_bytes: 超过该大小的文件被视为大文件，读取时限制输出
+            ping_count: ping 未指定次数时补充的 -c 参数
+            max_depth: 分析嵌套命令（命令替换、``bash -c``、``eval`` 等）的最大深度，嵌套更深的命令被拒绝
+        """
+        if destructive_policy not in self.DESTRUCTIVE_POLICIES:
+            raise ValueError(f"不支持的破坏性操作处理方式: {destructive_policy}，"
+                             f"可选值: {', '.join(self.DESTRUCTIVE_POLICIES)}")
+        self.destructive_policy = destructive_policy
+        self.max_output_lines = max_output_lines
+        self.max_file_bytes = max_file_bytes
+        self.ping_count = ping_count
+        self.max_depth = max_depth
+        self.enabled = not PlatformUtils.is_windows()
+
+    @staticmethod
+    def _closing_paren(command: str, index: int) -> Optional[int]:
+        """从 index 开始找到与已打开的左括号匹配的右括号位置，跳过引号和转义字符，找不到时返回None"""
+        depth, quote = 1, ""
+        while index < len(command):
+            char = command[index]
+            if char == "\\" and quote != "'":
+                index += 2
+                continue
+            if quote:
+                if char == quote:
+                    quote = ""
+            elif char in "'\"":
+                quote = char
+            elif char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+                if depth == 0:
+                    return index
+            index += 1
+        return None
+
+    @classmethod
+    def _substitutions(cls, command: str) -> Optional[List[Tuple[int, int, int, int, bool]]]:
+        """找出最外层的命令替换 ``$(...)``、```...```、进程替换 ``<(...)``/``>(...)`` 和算术展开 ``$((...))`` 的位置
+
+        单引号中的内容和注释不是替换，双引号中的 ``<(`` 也不是进程替换。
+
+        Returns:
+            Optional[List[Tuple[int, int, int, int, bool]]]: (起点, 终点, 内部起点, 内部终点, 内部是否为命令) 列表，
+            算术展开的内部不是命令；括号或反引号不匹配时返回None
+        """
+        found = []
+        index, quote = 0, ""
+        while index < len(command):
+            char = command[index]
+            if char == "\\" and quote != "'":
+                index += 2
+                continue
+            if quote == "'":
+                if char == "'":
+                    quote = ""
+            elif char == "'" and not quote:
+                quote = "'"
+            elif char == '"':
+                quote = "" if quote else '"'
+            elif char == "#" and not quote and (index == 0 or command[index - 1].isspace()):
+                newline = command.find("\n", index)
+                index = len(command) if newline == -1 else newline
+                continue
+            elif char == "`":
+                end = index + 1
+                while end < len(command) and command[end] != "`":
+                    end += 2 if command[end] == "\\" else 1
+                if end >= len(command):
+                    return None
+                found.append((index, end + 1, index + 1, end, True))
+                index = end + 1
+                continue
+            elif command.startswith("$(", index) or (char in "<>" and not quote and
+                                                     command.startswith("(", index + 1)):
+                end = cls._closing_paren(command, index + 2)
+                if end is None:
+                    return None
+                found.append((index, end + 1, index + 2, end, not command.startswith("$((", index)))
+                index = end + 1
+                continue
+            index += 1
+        return found
+
+    @classmethod
+    def _read_word(cls, text: str, index: int) -> Tuple[str, int]:
+        """从 index 开始读取一个参数，去掉引号并处理转义
+
+        Returns:
+            Tuple[str, int]: (参数值, 参数在 text 中的终点)
+
+        Raises:
+            ValueError: 引号或 ``${`` 不匹配
+        """
+        value = []
+        while index < len(text) and text[index] not in cls._WORD_BREAKS:
+            char = text[index]
+            if char == "\\":
+                # 反斜杠加换行是续行，不属于参数
+                if text[index + 1:index + 2] != "\n":
+                    value.append(text[index + 1:index + 2])
+                index += 2
+            elif char == "'":
+                end = text.find("'", index + 1)
+                if end == -1:
+                    raise ValueError("单引号不匹配")
+                value.append(text[index + 1:end])
+                index = end + 1
+            elif text.startswith("$'", index):
+                end = index + 2
+                while end < len(text) and text[end] != "'":
+                    end += 2 if text[end] == "\\" else 1
+                if end >= len(text):
+                    raise ValueError("$'...' 引号不匹配")
+                raw = text[index + 2:end]
+                try:
+                    value.append(raw.encode("latin-1", "backslashreplace").decode("unicode_escape"))
+                except UnicodeDecodeError:
+                    value.append(raw)
+                index = end + 1
+            elif char == '"':
+                index += 1
+                while index < len(text) and text[index] != '"':
+                    if text[index] == "\\" and text[index + 1:index + 2] in ("$", "`", '"', "\\", "\n"):
+                        if text[index + 1] != "\n":
+                            value.append(text[index + 1])
+                        index += 2
+                        continue
+                    value.append(text[index])
+                    index += 1
+                if index >= len(text):
+                    raise ValueError("双引号不匹配")
+                index += 1
+            elif text.startswith("${", index):
+                end = text.find("}", index)
+                if end == -1:
+                    raise ValueError("${ 不匹配")
+                value.append(text[index:end + 1])
+                index = end + 1
+            else:
+                value.append(char)
+                index += 1
+        return "".join(value), index
+
+    @staticmethod
+    def _read_heredoc(text: str, index: int, delimiter: str, strip_tabs: bool) -> Tuple[str, int]:
+        """从 index 开始读取 here document 的内容直到结束标记行
+
+        Returns:
+            Tuple[str, int]: (内容, 结束标记行之后的位置)
+        """
+        lines = []
+        while index < len(text):
+            newline = text.find("\n", index)
+            end = len(text) if newline == -1 else newline
+            line = text[index:end]
+            index = end + 1 if newline != -1 else end
+            if (line.lstrip("\t") if strip_tabs else line) == delimiter:
+                break
+            lines.append(line + "\n")
+        return "".join(lines), index
+
+    @classmethod
+    def _tokenize(cls, text: str) -> Iterator[Tuple[str, str, int, int]]:
+        """把命令切分为参数和操作符
+
+        按bash的规则处理引号、转义、续行、注释和 here document；重定向前的文件描述符（如 ``2>`` 中的 2）不单独产出。
+
+        Yields:
+            Tuple[str, str, int, int]: (类型, 值, 起点, 终点)，类型为 "word"（去掉引号后的参数）、"op"（操作符）
+            或 "heredoc"（here document 的内容，按 ``<<`` 出现的顺序在其后的换行之后产出）
+
+        Raises:
+            ValueError: 引号不匹配
+        """
+        index = 0
+        heredoc_op = None
+        delimiters: List[Tuple[str, bool]] = []
+        while index < len(text):
+            char = text[index]
+            if char in " \t":
+                index += 1
+                continue
+            if text.startswith("\\\n", index):
+                index += 2
+                continue
+            if char == "#":
+                newline = text.find("\n", index)
+                index = len(text) if newline == -1 else newline
+                continue
+            op = next((op for op in cls._OPERATORS if text.startswith(op, index)), None)
+            if op is not None:
+                yield "op", op, index, index + len(op)
+                index += len(op)
+                if op in ("<<", "<<-"):
+                    heredoc_op = op
+                elif op == "\n":
+                    for delimiter, strip_tabs in delimiters:
+                        start = index
+                        body, index = cls._read_heredoc(text, index, delimiter, strip_tabs)
+                        yield "heredoc", body, start, index
+                    delimiters = []
+                continue
+            value, end = cls._read_word(text, index)
+            if end < len(text) and text[end] in "<>" and text[index:end].isdigit():
+                index = end
+                continue
+            if heredoc_op is not None:
+                delimiters.append((value, heredoc_op == "<<-"))
+                heredoc_op = None
+            yield "word", value, index, end
+            index = end
+        for _ in delimiters:
+            yield "heredoc", "", len(text), len(text)
+
+    @classmethod
+    def _parse(cls, command: str):
+        """把命令切分为简单命令，并记录每个参数在原命令中的位置
+
+        命令替换和进程替换先被替换为等长的占位符再切分，其中的 ;、| 等不会切断外层命令，参数位置也保持不变。
+        命令位置上的保留字和分组符号（``{``、``if``、``then``、``do`` 等）被跳过，``for``/``select`` 的头部和
+        ``case`` 的分支模式不是命令，也被跳过。
+
+        Returns:
+            (简单命令列表, 替换列表)：简单命令为 (参数列表, 重定向目标列表, 之后的连接符, 参数位置列表, 标准输入列表)，
+            参数位置为 (起点, 终点)，标准输入列表为 here document 和 here string 的内容，
+            替换的格式同 _substitutions；引号不匹配等无法解析时返回None
+        """
+        substitutions = cls._substitutions(command)
+        if substitutions is None:
+            return None
+        masked = command
+        for start, end, _, _, _ in substitutions:
+            masked = masked[:start] + "_" * (end - start) + masked[end:]
+
+        segments = []
+        words: List[str] = []
+        spans: List[Tuple[int, int]] = []
+        redirects: List[str] = []
+        stdin: List[str] = []
+        # 等待 here document 内容的标准输入列表，按 << 出现的顺序
+        heredoc_owners: List[List[str]] = []
+        # 重定向操作符，下一个参数是其目标
+        redirect = None
+        # 跳过非命令参数的状态："header" 为 for/select 的头部，"case" 为 case 的头部，
+        # "pattern" 为 case 分支的模式，"name" 为 function 之后的函数名
+        skipping = None
+        case_depth = 0
+        try:
+            for kind, value, start, end in cls._tokenize(masked):
+                if kind == "heredoc":
+                    heredoc_owners.pop(0).append(value)
+                    continue
+                if redirect is not None:
+                    if kind != "word":
+                        return None
+                    if redirect in ("<<", "<<-"):
+                        heredoc_owners.append(stdin)
+                    elif redirect == "<<<":
+                        stdin.append(value + "\n")
+                    elif not (redirect in ("<&", ">&") and (value.isdigit() or value == "-")):
+                        redirects.append(value)
+                    redirect = None
+                    continue
+                if kind == "op":
+                    if value not in cls._SEPARATORS:
+                        redirect = value
+                    elif skipping == "pattern":
+                        if value == ")":
+                            skipping = None
+                    else:
+                        segments.append((words, redirects, value, spans, stdin))
+                        words, redirects, spans, stdin = [], [], [], []
+                        if skipping == "header":
+                            skipping = None
+                        if value in cls._CASE_SEPARATORS and case_depth:
+                            skipping = "pattern"
+                    continue
+                if skipping == "pattern":
+                    if value == "esac":
+                        case_depth -= 1
+                        skipping = None
+                    continue
+                if skipping == "case":
+                    if value == "in":
+                        skipping = "pattern"
+                    continue
+                if skipping is not None:
+                    if skipping == "name":
+                        skipping = None
+                    continue
+                # 带引号的保留字只是普通参数
+                if not words and masked[start:end] == value:
+                    if value in cls._RESERVED_WORDS:
+                        if value == "esac" and case_depth:
+                            case_depth -= 1
+                        continue
+                    if value in ("for", "select", "case", "function"):
+                        skipping = {"for": "header", "select": "header", "case": "case", "function": "name"}[value]
+                        case_depth += value == "case"
+                        continue
+                words.append(value)
+                spans.append((start, end))
+        except (ValueError, IndexError):
+            return None
+        if redirect is not None:
+            return None
+        segments.append((words, redirects, "", spans, stdin))
+        return [segment for segment in segments if segment[0] or segment[1] or segment[4]], substitutions
+
+    @classmethod
+    def split_pipeline(cls, command: str) -> Optional[List[Tuple[List[str], List[str], str]]]:
+        """把命令切分为简单命令
+
+        Returns:
+            Optional[List[Tuple[List[str], List[str], str]]]: (参数列表, 重定向目标列表, 之后的连接符) 列表，
+            引号不匹配等无法解析时返回None
+        """
+        parsed = cls._parse(command)
+        if parsed is None:
+            return None
+        return [(words, redirects, separator) for words, redirects, separator, _, _ in parsed[0]]
+
+    @classmethod
+    def _strip_wrappers(cls, words: List[str]) -> List[str]:
+        """去掉前导的环境变量赋值和 sudo、nohup 等包装命令"""
+        index = 0
+        while index < len(words):
+            word = words[index]
+            if cls._ENV_ASSIGNMENT_RE.match(word):
+                index += 1
+            elif word in cls._WRAPPERS:
+                options = cls._WRAPPERS[word]
+                index += 1
+                while index < len(words) and words[index].startswith("-"):
+                    index += 2 if words[index] in options else 1
+                if word == "timeout" and index < len(words):
+                    index += 1  # 跳过时长参数
+            else:
+                break
+        return words[index:]
+
+    @staticmethod
+    def _has_flag(args: List[str], short: str = "", long: Tuple[str, ...] = ()) -> bool:
+        """判断参数中是否出现某个短选项（可合并书写，如 -rf）或长选项"""
+        for arg in args:
+            if arg in long:
+                return True
+            if short and arg.startswith("-") and not arg.startswith("--") and short in arg[1:]:
+                return True
+        return False
+
+    def _is_large_file(self, path: str) -> bool:
+        try:
+            return os.path.isfile(path) and os.path.getsize(path) > self.max_file_bytes
+        except OSError:
+            return False
+
+    @staticmethod
+    def _shell_operand(args: List[str]) -> Tuple[bool, bool, Optional[int]]:
+        """解析 bash/sh 的选项
+
+        Returns:
+            Tuple[bool, bool, Optional[int]]: (是否有 -c, 是否有 -s, 第一个操作数的下标)，
+            有 -c 时第一个操作数是要执行的命令，否则是脚本文件；没有操作数时下标为None
+        """
+        read_command = read_stdin = False
+        index = 0
+        while index < len(args):
+            arg = args[index]
+            if arg in ("-", "--"):
+                index += 1
+                break
+            if arg.startswith("--"):
+                index += 1
+                continue
+            if len(arg) < 2 or arg[0] not in "-+":
+                break
+            read_command = read_command or "c" in arg[1:]
+            read_stdin = read_stdin or "s" in arg[1:]
+            # -o/-O 的参数是选项名
+            index += 2 if arg[-1] in "oO" else 1
+        return read_command, read_stdin, index if index < len(args) else None
+
+    @classmethod
+    def _pipe_text(cls, words: List[str], stdin: List[str]) -> Optional[str]:
+        """命令通过管道输出的文本，只能确定 echo、printf 和读取 here document 的 cat 的输出，其余返回None"""
+        words = cls._strip_wrappers(words)
+        if not words:
+            return None
+        exe, args = os.path.basename(words[0]), words[1:]
+        if exe == "echo":
+            while args and re.match(r"^-[neE]+$", args[0]):
+                args = args[1:]
+            return " ".join(args).replace("\\n", "\n") + "\n"
+        if exe == "printf":
+            return " ".join(args).replace("\\n", "\n")
+        if exe == "cat" and not args and stdin:
+            return "".join(stdin)
+        return None
+
+    def _check_segment(self, words: List[str], redirects: List[str], spans: List[Tuple[int, int]],
+                       stdin: List[Optional[str]], assessment: CommandAssessment,
+                       depth: int) -> Tuple[str, bool, List[Tuple[int, int, str]]]:
+        """分析一个简单命令
+
+        Args:
+            words: 参数列表
+            redirects: 重定向目标列表
+            spans: 各参数在所属命令中的 (起点, 终点)
+            stdin: 命令从标准输入读取的文本（here document、here string 或管道前一个命令的输出），
+                无法确定时为None
+            assessment: 合并分析结果的对象
+            depth: 当前的嵌套深度
+
+        Returns:
+            Tuple[str, bool, List[Tuple[int, int, str]]]: (可执行文件名, 输出是否无界, 对所属命令的改写)，
+            改写为 (起点, 终点, 替换文本)
+        """
+        wrapped = len(words) - len(self._strip_wrappers(words))
+        words, spans = words[wrapped:], spans[wrapped:]
+        for target in redirects:
+            if re.match(r"^/dev/(sd|hd|nvme|disk|mmcblk|xvd|vd)", target):
+                assessment.flag("catastrophic", f"向块设备 {target} 写入数据")
+        if not words:
+            return "", False, []
+
+        exe = os.path.basename(words[0])
+        args = words[1:]
+        subcommand = next((arg for arg in args if not arg.startswith("-")), None)
+        positional = [arg for arg in args if not arg.startswith("-")]
+        unbounded = False
+
+        # bash -c "..." 和 eval 执行的命令按同样规则分析，需要改写时把改写后的命令重新加引号放回原位
+        if exe in self._SUBSHELLS:
+            read_command, read_stdin, operand = self._shell_operand(args)
+            if read_command:
+                if operand is None:
+                    return exe, False, []
+                _, rewritten = self._assess_into(args[operand], assessment, depth + 1)
+                if rewritten == args[operand]:
+                    return exe, False, []
+                start, end = spans[operand + 1]
+                return exe, False, [(start, end, shlex.quote(rewritten))]
+            if read_stdin or operand is None:
+                # 从标准输入读取的命令无法放回原位改写，需要时改为限制整个命令的输出
+                for script in stdin:
+                    if script is None:
+                        assessment.flag("unparsable", f"无法确定通过管道传给 {exe} 执行的命令")
+                    elif self._assess_into(script, assessment, depth + 1)[1] != script:
+                        unbounded = True
+                return exe, unbounded, []
+        if exe == "eval":
+            if not args:
+                return exe, False, []
+            script = " ".join(args)
+            _, rewritten = self._assess_into(script, assessment, depth + 1)
+            if rewritten == script:
+                return exe, False, []
+            return exe, False, [(spans[1][0], spans[-1][1], shlex.quote(rewritten))]
+        if exe == "xargs":
+            inner = [arg for arg in args if not arg.startswith("-")]
+            if inner:
+                exe = os.path.basename(inner[0])
+                args = inner[1:]
+                positional = [arg for arg in args if not arg.startswith("-")]
+
+        if exe.split(".")[0] in self._DISK_TOOLS:
+            assessment.flag("catastrophic", f"{exe} 会格式化或重新分区磁盘")
+        elif exe in self._POWER_COMMANDS or (exe == "init" and positional[:1] in (["0"], ["6"])):
+            assessment.flag("catastrophic", f"{exe} 会关闭或重启系统")
+        elif exe == "dd" and any(arg.startswith("of=/dev/") for arg in args):
+            assessment.flag("catastrophic", "dd 直接写入设备")
+        elif exe in ("rm", "chmod", "chown", "chgrp") and \
+                (self._has_flag(args, "r", ("--recursive",)) or self._has_flag(args, "R")) and \
+                any(arg.rstrip("/") in self._SYSTEM_PATHS or arg in self._SYSTEM_PATHS for arg in positional):
+            assessment.flag("catastrophic", f"{exe} 递归作用于根目录、主目录或系统目录")
+
+        if exe in self._INTERACTIVE or (exe == "top" and not self._has_flag(args, "b")):
+            assessment.flag("interactive", f"{exe} 是交互式命令，无法在非交互环境中结束")
+        elif exe in ("tail", "journalctl") and self._has_flag(args, "f", ("--follow",)):
+            assessment.flag("interactive", f"{exe} -f 会持续等待新输出，永不结束")
+
+        if exe in self._DESTRUCTIVE or subcommand in self._DESTRUCTIVE_SUBCOMMANDS.get(exe, ()):
+            assessment.flag("destructive", f"{exe} 会删除或修改数据、终止进程")
+        elif exe == "find" and ("-delete" in args or any(
+                arg in ("-exec", "-execdir", "-ok") and index + 1 < len(args) and args[index + 1] in ("rm", "shred")
+                for index, arg in enumerate(args))):
+            assessment.flag("destructive", "find 会删除匹配的文件")
+        elif exe == "rsync" and any(arg.startswith("--delete") or arg == "--remove-source-files" for arg in args):
+            assessment.flag("destructive", "rsync 会删除目标或源中的文件")
+        elif exe == "git" and subcommand == "push" and self._has_flag(args, "f", ("--force",)):
+            assessment.flag("destructive", "git push --force 会覆盖远程历史")
+
+        if exe == "rsync" and not any(":" in arg for arg in positional):
+            pass  # 本地目录之间的同步
+        elif exe in self._NETWORK or subcommand in self._NETWORK_SUBCOMMANDS.get(exe, ()):
+            assessment.flag("network", f"{exe} 需要访问网络")
+
+        if exe == "yes":
+            unbounded = True
+        elif exe in ("cat", "od", "xxd", "hexdump", "base64") and \
+                any(arg in self._ENDLESS_DEVICES for arg in positional):
+            unbounded = True
+        elif exe == "cat" and any(self._is_large_file(arg) for arg in positional):
+            unbounded = True
+        elif exe in ("find", "tree") and positional and positional[0] in self._SYSTEM_PATHS \
+                and "-maxdepth" not in args and "-L" not in args:
+            unbounded = True
+        elif exe in ("ls", "grep", "rg") and self._has_flag(args, "R" if exe == "ls" else "r", ("--recursive",)) \
+                and any(arg in self._SYSTEM_PATHS for arg in positional):
+            unbounded = True
+        if unbounded:
+            assessment.flag("unbounded_output", f"{exe} 可能产生无界输出或遍历整个文件系统")
+
+        # ping 未指定次数时永不结束，在 ping 之后补充 -c
+        if exe in ("ping", "ping6") and not self._has_flag(args, "c"):
+            assessment.flag("unbounded_output", f"{exe} 未指定 -c 时会一直运行")
+            end = next(span[1] for word, span in zip(words, spans) if os.path.basename(word) == exe)
+            return exe, unbounded, [(end, end, f" -c {self.ping_count}")]
+        return exe, unbounded, []
+
+    def _assess_into(self, command: str, assessment: CommandAssessment, depth: int):
+        """分析命令并把结果合并到 assessment 中
+
+        命令替换、进程替换、``bash -c``、``eval`` 以及通过管道或 here document 传给 bash 的嵌套命令按同样规则递归分析，
+        需要改写时在原位替换为改写后的命令；每一层的输出无界时在该层末尾追加 head 限制输出。
+        无法解析或嵌套超过 max_depth 层时记录 unparsable 风险。
+
+        Returns:
+            (简单命令列表, 改写后的命令)：简单命令为 (可执行文件名, 参数列表, 输出是否无界, 之后的连接符)，
+            无法解析时简单命令列表为None；不需要改写时改写后的命令与 command 相同
+        """
+        if self._FORK_BOMB_RE.search(command):
+            assessment.flag("catastrophic", "fork炸弹会耗尽系统进程资源")
+        if depth > self.max_depth:
+            assessment.flag("unparsable", f"嵌套命令超过 {self.max_depth} 层，无法分析")
+            return None, command
+        parsed = self._parse(command)
+        if parsed is None:
+            assessment.flag("unparsable", "无法解析命令（引号、括号或重定向不完整）")
+            return None, command
+        segments, substitutions = parsed
+
+        edits = []
+        for _, _, inner_start, inner_end, is_command in substitutions:
+            if not is_command:
+                continue
+            inner = command[inner_start:inner_end]
+            _, rewritten = self._assess_into(inner, assessment, depth + 1)
+            if rewritten != inner:
+                edits.append((inner_start, inner_end, rewritten))
+        checked = []
+        previous = None
+        for words, redirects, separator, spans, stdin in segments:
+            # 没有 here document 时，管道前一个命令的输出是标准输入
+            sources: List[Optional[str]] = list(stdin)
+            if not sources and previous is not None and previous[2] in ("|", "|&"):
+                sources.append(self._pipe_text(previous[0], previous[4]))
+            exe, unbounded, segment_edits = self._check_segment(words, redirects, spans, sources, assessment, depth)
+            for edit in segment_edits:
+                # 与命令替换重叠的参数（如 bash -c "$(...)"）无法原样放回，改为限制整个命令的输出
+                if any(edit[0] < end and start < edit[1] for start, end, _, _, _ in substitutions):
+                    unbounded = True
+                else:
+                    edits.append(edit)
+            checked.append((exe, words, unbounded, separator))
+            previous = (words, redirects, separator, spans, stdin)
+
+        rewritten = command
+        for start, end, text in sorted(edits, reverse=True):
+            rewritten = rewritten[:start] + text + rewritten[end:]
+        if any(unbounded for _, _, unbounded, _ in checked):
+            rewritten = self._bound_output(rewritten, checked) or rewritten
+        return checked, rewritten
+
+    def _bound_output(self, command: str, checked) -> Optional[str]:
+        """在命令末尾追加 head 限制输出行数，末尾已是限制输出的命令时返回None"""
+        last_exe, last_words = checked[-1][0], self._strip_wrappers(checked[-1][1])
+        if last_exe in self._BOUNDING and not (last_exe == "tail" and "-f" in last_words):
+            return None
+        if last_exe == "grep" and any(self._has_flag(last_words, flag) for flag in "cql"):
+            return None
+        if all(separator in ("|", "|&", "") for _, _, _, separator in checked):
+            return f"{command} | head -n {self.max_output_lines}"
+        return f"{{ {command}\n}} | head -n {self.max_output_lines}"
+
+    @classmethod
+    def _read_only_operands(cls, exe: str, args: List[str], short: str, long: Set[str]) -> Optional[List[str]]:
+        """检查参数中的选项是否都在只读选项白名单中
+
+        长选项按 ``--opt=value`` 中等号前的部分匹配；合并书写的短选项逐个字母匹配，
+        遇到带参数的字母时其后的字符（如 ``-oFILE`` 中的 FILE）或下一个参数是它的参数。
+
+        Returns:
+            Optional[List[str]]: 除选项及其参数以外的操作数，有不在白名单中的选项时返回None
+        """
+        operands = []
+        expect_value = False
+        for arg_index, arg in enumerate(args):
+            if expect_value:
+                expect_value = False
+                continue
+            if arg == "--":
+                operands.extend(args[arg_index + 1:])
+                break
+            if not arg.startswith("-") or arg == "-":
+                operands.append(arg)
+                continue
+            if exe in cls._NUMERIC_OPTIONS and cls._NUMERIC_OPTION_RE.match(arg):
+                continue
+            if arg.startswith("--") or exe == "find":
+                name = arg.split("=", 1)[0]
+                if name in long:
+                    continue
+                if name + "=" not in long:
+                    return None
+                expect_value = "=" not in arg
+                continue
+            for index, char in enumerate(arg[1:], 1):
+                position = short.find(char)
+                if char == ":" or position == -1:
+                    return None
+                if short[position + 1:position + 2] == ":":
+                    expect_value = index == len(arg) - 1
+                    break
+        return operands
+
+    def is_read_only(self, command: str) -> bool:
+        """判断命令是否只读，只读命令可以在LLM确认之前推测执行
+
+        每个简单命令都必须是已知的只读命令（或只读的子命令），所有选项都在其只读选项白名单中，
+        不能重定向到 /dev/null 以外的文件，不能在后台运行，也不能包含命令替换或进程替换；无法解析时视为非只读。
+        """
+        if not self.enabled:
+            return False
+        parsed = self._parse(command)
+        if parsed is None or not parsed[0] or parsed[1]:
+            return False
+        for words, redirects, separator, _, _ in parsed[0]:
+            if not words or separator == "&" or any(target != "/dev/null" for target in redirects):
+                return False
+            exe, args = os.path.basename(words[0]), words[1:]
+            positional = [arg for arg in args if not arg.startswith("-")]
+            if exe in self._READ_ONLY_SUBCOMMANDS:
+                subcommand = positional[0] if positional else None
+                # 子命令之前的全局选项（如 git -c、git -C）可能改变配置或工作目录
+                if subcommand not in self._READ_ONLY_SUBCOMMANDS[exe] or args[0] != subcommand:
+                    return False
+                short, long = self._READ_ONLY_SUBCOMMAND_OPTIONS[exe]
+                args = args[1:]
+            elif exe in self._READ_ONLY:
+                short, long = self._READ_ONLY[exe]
+            else:
+                return False
+            operands = self._read_only_operands(exe, args, short, long)
+            if operands is None:
+                return False
+            # date 的非格式参数会设置系统时间，uniq 的第二个参数是输出文件
+            if exe == "date" and any(not operand.startswith("+") for operand in operands):
+                return False
+            if exe == "uniq" and len(operands) > 1:
+                return False
+        return True
+
+    def _dry_run_command(self, command: str, checked) -> Optional[str]:
+        """对单个简单命令，使用原生演练选项改写；不支持时返回None"""
+        if len(checked) != 1:
+            return None
+        exe, words, _, _ = checked[0]
+        words = self._strip_wrappers(words)
+        subcommand = next((word for word in words[1:] if not word.startswith("-")), None)
+        for key in ((exe, subcommand), (exe, None)):
+            if key not in self._DRY_RUN_FLAGS:
+                continue
+            if exe == "find":
+                # 去掉 -delete 后 find 只列出将被删除的文件
+                if "-delete" not in words:
+                    return None
+                return shlex.join(word for word in words if word != "-delete")
+            flag = self._DRY_RUN_FLAGS[key]
+            insert_at = words.index(subcommand) + 1 if key[1] else 1
+            return shlex.join(words[:insert_at] + [flag] + words[insert_at:])
+        return None
+
+    def assess(self, command: str) -> CommandAssessment:
+        """分析命令的风险和开销并给出处理方式
+
+        Args:
+            command: 要执行的shell命令
+
+        Returns:
+            CommandAssessment: 分析结果
+        """
+        assessment = CommandAssessment(command)
+        if not self.enabled or not command.strip():
+            return assessment
+
+        checked, rewritten = self._assess_into(command, assessment, 0)
+        # 无法解析的部分可能包含任何命令，与灾难性操作一样直接拒绝
+        if any(risk in assessment.risks for risk in ("catastrophic", "interactive", "unparsable")):
+            assessment.action = CommandAssessment.REJECT
+            return assessment
+
+        if "destructive" in assessment.risks and self.destructive_policy != "allow":
+            if self.destructive_policy == "reject":
+                assessment.action = CommandAssessment.REJECT
+                return assessment
+            rewritten = self._dry_run_command(command, checked)
+            if rewritten is None:
+                assessment.action = CommandAssessment.DRY_RUN
+                return assessment
+            assessment.action = CommandAssessment.REWRITE
+            assessment.rewritten = rewritten
+            assessment.reasons.append("已改写为原生演练模式")
+            return assessment
+
+        if rewritten != command:
+            assessment.action = CommandAssessment.REWRITE
+            assessment.rewritten = rewritten
+        return assessment
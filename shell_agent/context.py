@@ -0,0 +1,94 @@
+"""
+请求上下文模块 - 在单次请求内共享检索结果并统计调用次数
+"""
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .events import AgentEvent, EventCallback
+
+
+class RequestContext:
+    """单次 process_input 调用的上下文
+
+    缓存查询嵌入和向量检索结果，使Agent工具调用与最终结果组装共享同一次检索，
+    并统计本次请求实际发生的嵌入调用和向量查询次数；设置了事件回调时，
+    各模块通过 emit 把处理过程中的流式事件交给调用方。
+    """
+
+    def __init__(self, event_callback: Optional[EventCallback] = None, session_id: Optional[str] = None,
+                 tenant: Optional[str] = None):
+        """初始化请求上下文
+
+        Args:
+            event_callback: 流式事件回调，为None时不产出事件
+            session_id: 会话ID，启用Shell进程池时同一会话的命令在同一个shell中执行
+            tenant: 租户，命令历史的检索、保存和命令缓存都限定在该租户内，为None时使用默认租户
+        """
+        self.event_callback = event_callback
+        self.session_id = session_id
+        self.tenant = tenant
+        self.query_embeddings: Dict[str, List[float]] = {}
+        self.search_results: Dict[Tuple[str, int, str, Optional[str]], List[Dict[str, Any]]] = {}
+        self.embedding_calls = 0
+        # 沙箱模式下每条命令的资源使用情况
+        self.resource_usage: List[Dict[str, Any]] = []
+        self.vector_queries = 0
+        # 上下文预算：因压缩少发送的token数（固定提示词的节省每次请求只计一次），以及单次迭代提示词的最大估算token数
+        self.tokens_saved = 0
+        self.fixed_tokens_counted = False
+        self.max_prompt_tokens = 0
+
+    def emit(self, event_type: str, **data: Any):
+        """产出一个流式事件"""
+        if self.event_callback is not None:
+            self.event_callback(AgentEvent(event_type, **data))
+
+    def stats(self) -> Dict[str, int]:
+        """返回本次请求的检索统计"""
+        return {
+            "embedding_calls": self.embedding_calls,
+            "vector_queries": self.vector_queries
+        }
+
+    def budget_stats(self) -> Dict[str, int]:
+        """返回本次请求的上下文预算统计"""
+        return {
+            "tokens_saved": self.tokens_saved,
+            "max_prompt_tokens": self.max_prompt_tokens
+        }
+
+
+_current_context: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar(
+    "shell_agent_request_context", default=None
+)
+
+
+def get_request_context() -> Optional[RequestContext]:
+    """获取当前请求上下文，不在请求内时返回None"""
+    return _current_context.get()
+
+
+def has_event_listener() -> bool:
+    """当前请求是否有流式事件的接收方"""
+    context = _current_context.get()
+    return context is not None and context.event_callback is not None
+
+
+def emit_event(event_type: str, **data: Any):
+    """向当前请求产出一个流式事件，不在请求内或没有接收方时忽略"""
+    context = _current_context.get()
+    if context is not None:
+        context.emit(event_type, **data)
+
+
+@contextmanager
+def request_context(event_callback: Optional[EventCallback] = None, session_id: Optional[str] = None,
+                    tenant: Optional[str] = None) -> Iterator[RequestContext]:
+    """在with块内激活一个新的请求上下文"""
+    context = RequestContext(event_callback, session_id, tenant)
+    token = _current_context.set(context)
+    try:
+        yield context
+    finally:
+        _current_context.reset(token)
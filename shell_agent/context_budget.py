@@ -0,0 +1,222 @@
+"""
+上下文预算模块 - 压缩Agent每次迭代重发的工具观察结果，并按本地分词器估算的token数限制提示词长度
+"""
+import json
+import math
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+from .context import get_request_context
+
+# 检索到的历史命令在提示词中只保留这些字段
+EXAMPLE_FIELDS = ("user_input", "command", "success")
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+_encodings: Dict[str, Any] = {}
+_encodings_lock = threading.Lock()
+
+
+def _load_encoding(model_name: str) -> Optional[Any]:
+    """加载模型对应的tiktoken编码，进程内只加载一次；tiktoken不可用或无法下载编码文件时返回None"""
+    with _encodings_lock:
+        if model_name in _encodings:
+            return _encodings[model_name]
+        encoding = None
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"无法加载tiktoken编码，改为按字符数估算token数: {str(e)[:200]}")
+        _encodings[model_name] = encoding
+        return encoding
+
+
+class TokenCounter:
+    """本地token计数器
+
+    优先使用tiktoken按模型的编码精确计数；tiktoken未安装或离线环境中无法获取编码文件时，
+    按每个中日韩字符1个token、其余每4个字符1个token估算。
+    """
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo"):
+        self.model_name = model_name
+        self._encoding: Optional[Any] = None
+        self._loaded = False
+
+    @property
+    def encoding(self) -> Optional[Any]:
+        """tiktoken编码，首次使用时加载"""
+        if not self._loaded:
+            self._encoding = _load_encoding(self.model_name)
+            self._loaded = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """计算文本的token数"""
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        cjk = len(_CJK_RE.findall(text))
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """把文本截断到约 max_tokens 个token，保留开头和结尾（错误信息通常在结尾），中间标注省略的token数"""
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        head_tokens = max_tokens // 2
+        tail_tokens = max_tokens - head_tokens
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            head = self.encoding.decode(tokens[:head_tokens])
+            tail = self.encoding.decode(tokens[-tail_tokens:]) if tail_tokens else ""
+        else:
+            chars_per_token = len(text) / total
+            head = text[:int(head_tokens * chars_per_token)]
+            tail = text[-int(tail_tokens * chars_per_token):] if tail_tokens else ""
+        return f"{head}\n...（已省略约 {total - max_tokens} 个token）...\n{tail}"
+
+
+class ContextBudget:
+    """Agent草稿区（agent_scratchpad）的上下文预算
+
+    代替 LangChain 的 format_to_openai_tool_messages 把中间步骤转换为消息：
+    命令输出和错误分析按 max_observation_tokens 截断，检索到的历史命令只保留请求、命令和是否成功；
+    整个提示词仍超过 max_prompt_tokens 时，从最早的观察结果开始替换为省略说明。
+    中间步骤本身不被修改，最终结果中的命令输出仍是完整的。
+    每次格式化时把观察结果比未压缩时少发送的token数累加到当前请求上下文中，
+    固定提示词压缩节省的token数每次请求只累加一次。
+    """
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo", max_prompt_tokens: Optional[int] = 4000,
+                 max_observation_tokens: Optional[int] = 500):
+        """初始化上下文预算
+
+        Args:
+            model_name: 模型名称，用于选择tiktoken编码
+            max_prompt_tokens: 每次迭代的提示词（系统提示、工具定义、用户输入和草稿区）token上限，为None时不限制
+            max_observation_tokens: 单个工具观察结果的token上限，为None时不截断
+        """
+        self.counter = TokenCounter(model_name)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_observation_tokens = max_observation_tokens
+        # 固定部分（系统提示和工具定义）的token数及其压缩后每次迭代少发送的token数，由 set_fixed_prompt 设置
+        self.fixed_tokens = 0
+        self.fixed_tokens_saved = 0
+
+    def set_fixed_prompt(self, prompt: str, tools: Sequence[Dict[str, Any]], original_prompt: Optional[str] = None):
+        """记录每次迭代都会发送的系统提示和工具定义
+
+        Args:
+            prompt: 实际使用的系统提示
+            tools: OpenAI格式的工具定义
+            original_prompt: 压缩前的系统提示，用于统计节省的token数
+        """
+        self.fixed_tokens = self.counter.count(prompt) + self.counter.count(json.dumps(tools, ensure_ascii=False))
+        if original_prompt is not None:
+            self.fixed_tokens_saved = self.counter.count(original_prompt) - self.counter.count(prompt)
+
+    @staticmethod
+    def _stringify(observation: Any) -> str:
+        """与 LangChain 相同的观察结果字符串化方式"""
+        if isinstance(observation, str):
+            return observation
+        try:
+            return json.dumps(observation, ensure_ascii=False)
+        except Exception:
+            return str(observation)
+
+    def compact_observation(self, tool: str, observation: Any) -> str:
+        """压缩单个工具观察结果
+
+        Args:
+            tool: 工具名称
+            observation: 工具返回值
+
+        Returns:
+            str: 放入草稿区的文本
+        """
+        if tool == "search_similar_commands" and isinstance(observation, list):
+            observation = [{key: item.get(key) for key in EXAMPLE_FIELDS}
+                           for item in observation if isinstance(item, dict)]
+        elif isinstance(observation, tuple) and len(observation) == 2 and isinstance(observation[1], str):
+            # execute_shell_command 返回 (success, output)，只截断输出部分
+            if self.max_observation_tokens is not None:
+                observation = (observation[0], self.counter.truncate(observation[1], self.max_observation_tokens))
+        elif isinstance(observation, str) and self.max_observation_tokens is not None:
+            observation = self.counter.truncate(observation, self.max_observation_tokens)
+        return self._stringify(observation)
+
+    def format_scratchpad(self, intermediate_steps: Sequence[Tuple[Any, Any]], user_input: str = "") -> List[BaseMessage]:
+        """把中间步骤转换为草稿区消息
+
+        Args:
+            intermediate_steps: AgentExecutor 的 (AgentAction, 观察结果) 列表
+            user_input: 用户输入，计入提示词长度
+
+        Returns:
+            List[BaseMessage]: 草稿区消息
+        """
+        messages: List[BaseMessage] = []
+        tool_messages: List[Tuple[ToolMessage, int]] = []
+        original_tokens = compact_tokens = 0
+        for action, observation in intermediate_steps:
+            tool_call_id = getattr(action, "tool_call_id", None)
+            if tool_call_id is None:
+                messages.append(AIMessage(content=action.log))
+                continue
+            messages.extend(message for message in action.message_log if message not in messages)
+            content = self.compact_observation(action.tool, observation)
+            tokens = self.counter.count(content)
+            original_tokens += self.counter.count(self._stringify(observation))
+            compact_tokens += tokens
+            message = ToolMessage(tool_call_id=tool_call_id, content=content, additional_kwargs={"name": action.tool})
+            messages.append(message)
+            tool_messages.append((message, tokens))
+
+        if self.max_prompt_tokens is not None and tool_messages:
+            compact_tokens -= self._fit(messages, tool_messages, user_input)
+
+        context = get_request_context()
+        if context is not None:
+            prompt_tokens = self.fixed_tokens + self.counter.count(user_input) + \
+                sum(self._message_tokens(message) for message in messages)
+            context.tokens_saved += original_tokens - compact_tokens
+            if not context.fixed_tokens_counted:
+                context.tokens_saved += self.fixed_tokens_saved
+                context.fixed_tokens_counted = True
+            context.max_prompt_tokens = max(context.max_prompt_tokens, prompt_tokens)
+        return messages
+
+    def _message_tokens(self, message: BaseMessage) -> int:
+        tokens = self.counter.count(str(message.content))
+        for call in getattr(message, "tool_calls", None) or []:
+            tokens += self.counter.count(call["name"]) + self.counter.count(json.dumps(call["args"], ensure_ascii=False))
+        return tokens
+
+    def _fit(self, messages: List[BaseMessage], tool_messages: List[Tuple[ToolMessage, int]], user_input: str) -> int:
+        """提示词超出上限时从最早的观察结果开始省略，最后一个观察结果只截断不省略，返回减少的token数"""
+        total = self.fixed_tokens + self.counter.count(user_input) + \
+            sum(self._message_tokens(message) for message in messages)
+        excess = total - self.max_prompt_tokens
+        reduced = 0
+        for index, (message, tokens) in enumerate(tool_messages):
+            if excess <= 0:
+                break
+            if index < len(tool_messages) - 1:
+                message.content = f"（为控制上下文长度，已省略该工具的输出，约 {tokens} 个token）"
+            else:
+                # 最后一个观察结果是模型决定下一步的依据，至少保留一小段
+                message.content = self.counter.truncate(message.content, max(tokens - excess, 64))
+            saved = tokens - self.counter.count(message.content)
+            excess -= saved
+            reduced += saved
+        return reduced
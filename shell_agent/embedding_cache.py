@@ -0,0 +1,154 @@
+"""
+嵌入缓存模块 - 将文本嵌入向量持久化到本地SQLite，避免重复调用嵌入模型
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """带本地持久化缓存的嵌入函数包装器
+
+    以 (嵌入模型, 文本) 的哈希为键缓存向量，批量查询时只把未命中的文本发送给底层嵌入模型；
+    缓存条目数超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_path: str, max_entries: int = 100000,
+                 model_name: Optional[str] = None):
+        """初始化嵌入缓存
+
+        Args:
+            embeddings: 底层嵌入模型
+            cache_path: SQLite缓存文件路径
+            max_entries: 最大缓存条目数
+            model_name: 嵌入模型名称，参与缓存键计算；默认从底层模型推断
+        """
+        self.embeddings = embeddings
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.model_name = model_name or self._infer_model_name(embeddings)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _infer_model_name(embeddings: Embeddings) -> str:
+        """推断底层嵌入模型名称"""
+        model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+        return f"{type(embeddings).__name__}:{model}" if model else type(embeddings).__name__
+
+    def _make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量查询缓存，并刷新命中条目的访问时间"""
+        found: Dict[str, List[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._decode(blob)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        """写入新的缓存条目，超出上限时淘汰最久未访问的条目"""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, self._encode(vector), now) for key, vector in items.items()]
+            )
+            self._size += self._conn.total_changes - before
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._size -= overflow
+            self._conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入文档，只有未命中缓存的文本会发送给底层模型"""
+        keys = [self._make_key(text) for text in texts]
+        cached = self._lookup(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本，优先使用缓存"""
+        key = self._make_key(text)
+        cached = self._lookup([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        return {"hits": self.hits, "misses": self.misses, "size": self._size}
+
+    def close(self):
+        """关闭缓存数据库连接"""
+        with self._lock:
+            self._conn.close()
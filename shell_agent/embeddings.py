@@ -0,0 +1,90 @@
+"""
+嵌入后端模块 - 提供可切换的嵌入模型，包括无需网络的本地哈希向量化器
+"""
+import re
+import zlib
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 支持的嵌入后端
+EMBEDDING_BACKENDS = ("openai", "hashing")
+
+
+class HashingEmbeddings(Embeddings):
+    """基于哈希n-gram的本地嵌入模型
+
+    将文本拆分为单词和字符n-gram（对中文按字切分同样适用），用CRC32哈希到固定维度，
+    按对数词频加权后做L2归一化。完全在本地CPU上计算，批量文本一次性向量化，
+    同一文本在任何进程中都得到相同的向量。
+    """
+
+    _TOKEN_RE = re.compile(r"[\w\-./]+|[^\w\s]", re.UNICODE)
+
+    def __init__(self, dimensions: int = 1024, ngram_range: tuple = (2, 4)):
+        """初始化哈希嵌入模型
+
+        Args:
+            dimensions: 向量维度
+            ngram_range: 字符n-gram的长度范围（闭区间）
+        """
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        self.model = f"hashing-{dimensions}-{ngram_range[0]}-{ngram_range[1]}"
+
+    def _features(self, text: str) -> Dict[int, float]:
+        """提取文本的哈希特征及其词频"""
+        counts: Dict[int, float] = {}
+        text = text.lower()
+        features = self._TOKEN_RE.findall(text)
+        min_n, max_n = self.ngram_range
+        for word in text.split():
+            padded = f" {word} "
+            for n in range(min_n, max_n + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        for feature in features:
+            index = zlib.crc32(feature.encode("utf-8")) % self.dimensions
+            counts[index] = counts.get(index, 0.0) + 1.0
+        return counts
+
+    def _vectorize(self, texts: List[str]) -> np.ndarray:
+        """批量向量化文本，返回形状为 (len(texts), dimensions) 的矩阵"""
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            for col, count in self._features(text).items():
+                rows.append(row)
+                cols.append(col)
+                values.append(count)
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        if values:
+            matrix[np.asarray(rows), np.asarray(cols)] = 1.0 + np.log(np.asarray(values, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入文档"""
+        return self._vectorize(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本"""
+        return self._vectorize([text])[0].tolist()
+
+
+def create_embeddings(backend: str = "openai") -> Embeddings:
+    """根据后端名称创建嵌入模型
+
+    Args:
+        backend: 嵌入后端名称，"openai" 使用OpenAI嵌入API，"hashing" 使用本地哈希向量化器
+
+    Returns:
+        Embeddings: 嵌入模型实例
+    """
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+    if backend == "hashing":
+        return HashingEmbeddings()
+    raise ValueError(f"不支持的嵌入后端: {backend}，可选值: {', '.join(EMBEDDING_BACKENDS)}")
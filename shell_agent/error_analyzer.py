@@ -1,22 +1,36 @@
 """
 错误分析模块 - 负责分析命令执行错误并提供解决方案
 """
-from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import Dict, Any, List, AsyncIterator, Callable, Iterator, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
 
+from .context import emit_event, has_event_listener
+from .error_cache import ErrorAnalysisCache, ErrorRules
+from .events import EVENT_ANALYSIS
+from .tracing import span
+
 class ErrorAnalyzer:
     """分析命令执行错误并提供解决方案的类"""
     
-    def __init__(self, llm: BaseChatModel):
+    def __init__(self, llm: Optional[BaseChatModel] = None, cache: Optional[ErrorAnalysisCache] = None,
+                 rules: Optional[ErrorRules] = None, llm_factory: Optional[Callable[[], BaseChatModel]] = None):
         """初始化错误分析器
         
         Args:
             llm: 一个实现了BaseChatModel接口的语言模型实例。
+            cache: 错误分析缓存，签名相同的错误直接复用已有分析，为None时禁用
+            rules: 本地规则表，常见错误直接由规则回答而不调用LLM，为None时禁用
+            llm_factory: 未传入 llm 时，在首次需要调用LLM时用它创建语言模型
         """
-        self.llm = llm
+        if llm is None and llm_factory is None:
+            raise ValueError("需要提供 llm 或 llm_factory")
+        self._llm = llm
+        self._llm_factory = llm_factory
+        self._chain = None
+        self.cache = cache
+        self.rules = rules
         self.prompt = ChatPromptTemplate.from_template(
             """你是一个专业的Shell错误分析专家。
             分析以下命令执行错误，并提供详细的解决方案。
@@ -32,7 +46,20 @@ class ErrorAnalyzer:
             """
         )
         self.output_parser = StrOutputParser()
-        self.chain = self.prompt | self.llm | self.output_parser
+
+    @property
+    def llm(self) -> BaseChatModel:
+        """语言模型，延迟创建时在首次访问时调用 llm_factory"""
+        if self._llm is None:
+            self._llm = self._llm_factory()
+        return self._llm
+
+    @property
+    def chain(self):
+        """错误分析链，首次需要调用LLM时构建"""
+        if self._chain is None:
+            self._chain = self.prompt | self.llm | self.output_parser
+        return self._chain
     
     def analyze_error(self, user_input: str, command: str, error_message: str) -> str:
         """分析错误并提供解决方案
@@ -45,12 +72,118 @@ class ErrorAnalyzer:
         Returns:
             str: 错误分析和解决方案
         """
+        if has_event_listener():
+            return "".join(self._emit_chunks(self.stream_analysis(user_input, command, error_message)))
+        local_analysis = self._lookup_local(command, error_message)
+        if local_analysis is not None:
+            return local_analysis
         try:
             analysis = self.chain.invoke({
                 "user_input": user_input,
                 "command": command,
                 "error_message": error_message
             })
+            self._remember(command, error_message, analysis)
             return analysis
         except Exception as e:
-            return f"分析错误时出现问题: {str(e)}"
\ No newline at end of file
+            return f"分析错误时出现问题: {str(e)}"
+
+    async def aanalyze_error(self, user_input: str, command: str, error_message: str) -> str:
+        """analyze_error 的异步版本，使用 chain.ainvoke 调用LLM"""
+        if has_event_listener():
+            chunks = []
+            async for chunk in self.astream_analysis(user_input, command, error_message):
+                emit_event(EVENT_ANALYSIS, text=chunk)
+                chunks.append(chunk)
+            return "".join(chunks)
+        local_analysis = self._lookup_local(command, error_message)
+        if local_analysis is not None:
+            return local_analysis
+        try:
+            analysis = await self.chain.ainvoke({
+                "user_input": user_input,
+                "command": command,
+                "error_message": error_message
+            })
+            self._remember(command, error_message, analysis)
+            return analysis
+        except Exception as e:
+            return f"分析错误时出现问题: {str(e)}"
+
+    def _lookup_local(self, command: str, error_message: str) -> Optional[str]:
+        """先查本地规则表，再按错误签名查缓存，都未命中时返回None"""
+        with span("error_analysis", "cache") as node:
+            if self.rules is not None:
+                analysis = self.rules.match(command, error_message)
+                if analysis is not None:
+                    if node is not None:
+                        node.attributes["hit"] = "rule"
+                    return analysis
+            if self.cache is not None:
+                analysis = self.cache.get(command, error_message)
+                if analysis is not None:
+                    if node is not None:
+                        node.attributes["hit"] = "cache"
+                    return analysis
+            return None
+
+    def _remember(self, command: str, error_message: str, analysis: str):
+        """缓存LLM给出的分析"""
+        if self.cache is not None and analysis:
+            self.cache.put(command, error_message, analysis)
+
+    @staticmethod
+    def _emit_chunks(chunks: Iterator[str]) -> Iterator[str]:
+        """把分析文本块逐个作为 analysis 事件产出，同时原样传递"""
+        for chunk in chunks:
+            emit_event(EVENT_ANALYSIS, text=chunk)
+            yield chunk
+
+    def stream_analysis(self, user_input: str, command: str, error_message: str) -> Iterator[str]:
+        """流式分析错误，LLM每生成一段文本就立即产出，无需等待整个分析完成
+
+        Args:
+            user_input: 用户的原始输入
+            command: 执行的命令
+            error_message: 错误信息
+
+        Yields:
+            str: 错误分析的增量文本；命中规则表或缓存时一次产出完整分析
+        """
+        local_analysis = self._lookup_local(command, error_message)
+        if local_analysis is not None:
+            yield local_analysis
+            return
+        chunks = []
+        try:
+            for chunk in self.chain.stream({
+                "user_input": user_input,
+                "command": command,
+                "error_message": error_message
+            }):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            yield f"分析错误时出现问题: {str(e)}"
+            return
+        self._remember(command, error_message, "".join(chunks))
+
+    async def astream_analysis(self, user_input: str, command: str, error_message: str) -> AsyncIterator[str]:
+        """stream_analysis 的异步版本"""
+        local_analysis = self._lookup_local(command, error_message)
+        if local_analysis is not None:
+            yield local_analysis
+            return
+        chunks = []
+        try:
+            async for chunk in self.chain.astream({
+                "user_input": user_input,
+                "command": command,
+                "error_message": error_message
+            }):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            yield f"分析错误时出现问题: {str(e)}"
+            return
+        self._remember(command, error_message, "".join(chunks))
@@ -0,0 +1,246 @@
+"""
+错误分析缓存模块 - 按规范化的错误签名复用错误分析，并用本地规则表直接回答常见错误
+"""
+import hashlib
+import json
+import os
+import re
+import shlex
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cache import LRUTTLCache
+from .utils import PlatformUtils
+
+# 规则表和缓存命中时代替针对具体命令的修正建议
+COMMAND_HINT = "3. 修正后的命令: 请根据上述解决方案调整命令 `{command}` 后重试。"
+
+
+class ErrorSignature:
+    """错误签名工具类
+
+    同一类错误的报错信息往往只在路径、数字、进程号和时间戳上不同，
+    去掉这些易变部分后，再结合命令的可执行文件名和操作系统作为缓存键。
+    """
+
+    _PATTERNS = [
+        # 时间戳，如 2024-01-02 03:04:05、2024-01-02T03:04:05.123Z
+        (re.compile(r"\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}:\d{2}(\.\d+)?(z|[+-]\d{2}:?\d{2})?"), "<time>"),
+        (re.compile(r"\b\d{1,2}:\d{2}:\d{2}\b"), "<time>"),
+        # 十六进制地址和哈希
+        (re.compile(r"\b0x[0-9a-f]+\b"), "<hex>"),
+        (re.compile(r"\b[0-9a-f]{12,}\b"), "<hex>"),
+        # Windows路径和类Unix路径（含 ~/ 和 ./ 开头的相对路径）
+        (re.compile(r"\b[a-z]:\\[^\s'\"`:]*"), "<path>"),
+        (re.compile(r"(?<![\w<])(~|\.{1,2})?/[^\s'\"`:]*"), "<path>"),
+        # 其余数字，如进程号、行号、端口和大小
+        (re.compile(r"\d+"), "<n>"),
+    ]
+    _WHITESPACE_RE = re.compile(r"\s+")
+    _ENV_ASSIGNMENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+    # 包装命令，真正的可执行文件是其后的第一个词
+    _WRAPPERS = {"sudo", "env", "nohup", "time", "nice", "command", "exec"}
+
+    @classmethod
+    def normalize(cls, error_message: str, max_length: int = 300) -> str:
+        """去除报错信息中的路径、数字、进程号和时间戳，并合并空白、转为小写"""
+        text = error_message.strip().lower()
+        for pattern, replacement in cls._PATTERNS:
+            text = pattern.sub(replacement, text)
+        return cls._WHITESPACE_RE.sub(" ", text)[:max_length]
+
+    @classmethod
+    def executable(cls, command: str) -> str:
+        """提取命令的可执行文件名，跳过环境变量赋值和 sudo 等包装命令"""
+        try:
+            words = shlex.split(command)
+        except ValueError:
+            words = command.split()
+        for word in words:
+            if cls._ENV_ASSIGNMENT_RE.match(word) or word in cls._WRAPPERS or word.startswith("-"):
+                continue
+            return os.path.basename(word)
+        return ""
+
+    @classmethod
+    def make(cls, command: str, error_message: str) -> Tuple[str, str, str]:
+        """生成错误签名 (可执行文件名, 操作系统, 规范化的报错信息)"""
+        os_type = "Windows" if PlatformUtils.is_windows() else "Linux/macOS"
+        return cls.executable(command), os_type, cls.normalize(error_message)
+
+
+class ErrorRules:
+    """常见错误的本地规则表，匹配时无需调用LLM即可给出分析"""
+
+    # (报错信息正则, 原因, 解决方案)；{executable} 和 {command} 会被替换
+    DEFAULT_RULES: List[Tuple[str, str, str]] = [
+        (r"command not found|is not recognized as (the name of )?a cmdlet|不是内部或外部命令",
+         "系统找不到命令 `{executable}`：该程序未安装、拼写有误，或所在目录不在 PATH 中。",
+         "检查命令拼写；使用包管理器安装该程序（如 `apt install`、`brew install`）；"
+         "若已安装，请将其所在目录加入 PATH 或使用完整路径执行。"),
+        (r"permission denied|access is denied|拒绝访问",
+         "当前用户没有执行 `{executable}` 或访问目标文件/目录所需的权限。",
+         "用 `ls -l` 检查文件权限和所有者；对脚本可执行 `chmod +x`；确实需要时以 `sudo` 运行命令。"),
+        (r"operation not permitted",
+         "操作系统拒绝了该操作，通常需要管理员权限，或目标受到保护（如系统完整性保护、只读挂载）。",
+         "确认是否需要以 `sudo` 运行；检查目标是否位于只读文件系统或受保护的目录。"),
+        (r"no such file or directory|cannot find (the )?path|找不到(指定的)?(文件|路径)",
+         "命令引用的文件或目录不存在。",
+         "用 `ls` 或 `pwd` 确认当前目录和路径拼写；注意相对路径是相对于当前工作目录的。"),
+        (r"is a directory",
+         "命令需要一个文件，但给出的路径是目录。",
+         "指定目录中的具体文件；若要处理整个目录，请使用支持递归的选项（如 `-r`）。"),
+        (r"not a directory",
+         "路径中的某一部分是文件而不是目录。",
+         "检查路径拼写，确认每一级都是存在的目录。"),
+        (r"file exists",
+         "目标文件或目录已存在。",
+         "换一个名称，或在确认可以覆盖后先删除已有目标（`mkdir` 可使用 `-p` 选项）。"),
+        (r"no space left on device",
+         "磁盘空间已满。",
+         "用 `df -h` 查看磁盘使用情况，用 `du -sh *` 找出占用空间大的文件并清理。"),
+        (r"connection refused",
+         "目标地址没有服务在监听对应端口，或被防火墙拒绝。",
+         "确认服务已启动、主机和端口正确（如 `ss -ltn` 查看监听端口），并检查防火墙设置。"),
+        (r"syntax error",
+         "命令存在shell语法错误，如引号或括号不匹配。",
+         "检查引号、括号和特殊字符是否成对并正确转义。"),
+    ]
+
+    def __init__(self, rules: Optional[List[Tuple[str, str, str]]] = None):
+        """初始化规则表
+
+        Args:
+            rules: (报错信息正则, 原因, 解决方案) 列表，为None时使用 DEFAULT_RULES
+        """
+        self.rules = [(re.compile(pattern, re.IGNORECASE), cause, solution)
+                      for pattern, cause, solution in (rules if rules is not None else self.DEFAULT_RULES)]
+        self.hits = 0
+
+    def match(self, command: str, error_message: str) -> Optional[str]:
+        """按顺序匹配规则，命中时返回与LLM分析格式相同的文本，否则返回None"""
+        for pattern, cause, solution in self.rules:
+            if pattern.search(error_message):
+                self.hits += 1
+                values = {"executable": ErrorSignature.executable(command) or command, "command": command}
+                return (f"1. 错误原因分析: {cause.format(**values)}\n"
+                        f"2. 解决方案: {solution.format(**values)}\n"
+                        f"{COMMAND_HINT.format(command=command)}")
+        return None
+
+
+class ErrorAnalysisCache:
+    """错误分析缓存，以错误签名为键，LRU/TTL淘汰，可持久化到JSONL日志
+
+    签名相同的错误可能来自不同的命令，因此只缓存与命令无关的诊断：去掉LLM针对原命令给出的
+    修正后的命令，诊断中出现的原命令替换为占位符，命中时代入当前命令并改为提示按解决方案调整命令。
+    新条目先缓冲在内存中，每 save_batch_size 条追加到日志一次，flush 或 close 时写入剩余条目；
+    日志中被覆盖的行过多时重写日志。
+    """
+
+    # LLM分析的第3部分（修正后的命令）及其之后的内容
+    _FIX_SECTION_RE = re.compile(r"^[\s#*>]*3\s*[.、)）]?[\s*]*修正后的命令.*", re.MULTILINE | re.DOTALL)
+    _COMMAND_PLACEHOLDER = "\0command\0"
+
+    def __init__(self, path: Optional[str] = None, max_size: int = 1000, ttl: Optional[float] = 7 * 24 * 3600,
+                 save_batch_size: int = 16):
+        """初始化缓存
+
+        Args:
+            path: 持久化日志文件路径，为None时只保存在内存中
+            max_size: 最大条目数
+            ttl: 条目存活时间（秒），为None时永不过期
+            save_batch_size: 缓冲多少条新条目后追加到日志
+        """
+        self.path = path
+        self.save_batch_size = save_batch_size
+        self._cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self._save_lock = threading.Lock()
+        self._unsaved: List[Dict[str, Any]] = []
+        self._log_lines = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    @staticmethod
+    def make_key(command: str, error_message: str) -> str:
+        """根据错误签名生成缓存键"""
+        signature = "\0".join(ErrorSignature.make(command, error_message))
+        return hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def diagnosis(cls, command: str, analysis: str) -> str:
+        """提取分析中与命令无关的诊断：去掉修正后的命令，原命令替换为占位符"""
+        diagnosis = cls._FIX_SECTION_RE.sub("", analysis).rstrip()
+        if command.strip():
+            diagnosis = diagnosis.replace(command.strip(), cls._COMMAND_PLACEHOLDER)
+        return diagnosis
+
+    def _load(self):
+        """重放持久化日志，忽略写了一半的行，已过期的条目在读取时自然失效"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._log_lines += 1
+                    self._cache.set(entry["key"], entry["diagnosis"], stored_at=entry["stored_at"])
+        except (OSError, KeyError, TypeError) as e:
+            print(f"加载错误分析缓存失败: {str(e)}")
+
+    def _compact_locked(self):
+        """用当前条目重写日志，去掉被覆盖和已淘汰的行"""
+        # items() 按最近使用顺序排列，重新加载时保持LRU顺序
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, stored_at, diagnosis in self._cache.items():
+                f.write(json.dumps({"key": key, "stored_at": stored_at, "diagnosis": diagnosis},
+                                   ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._log_lines = len(self._cache)
+
+    def flush(self):
+        """把缓冲的新条目追加到持久化日志"""
+        with self._save_lock:
+            entries, self._unsaved = self._unsaved, []
+            if not entries or not self.path:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._log_lines += len(entries)
+                if self._log_lines > 2 * len(self._cache) + 100:
+                    self._compact_locked()
+            except OSError as e:
+                print(f"保存错误分析缓存失败: {str(e)}")
+
+    def get(self, command: str, error_message: str) -> Optional[str]:
+        """查找缓存的错误分析，诊断中代入当前命令"""
+        diagnosis = self._cache.get(self.make_key(command, error_message))
+        if diagnosis is None:
+            return None
+        return f"{diagnosis.replace(self._COMMAND_PLACEHOLDER, command.strip())}\n{COMMAND_HINT.format(command=command)}"
+
+    def put(self, command: str, error_message: str, analysis: str):
+        """缓存一条错误分析的诊断，缓冲满一批时持久化"""
+        diagnosis = self.diagnosis(command, analysis)
+        if not diagnosis:
+            return
+        key, stored_at = self.make_key(command, error_message), time.time()
+        self._cache.set(key, diagnosis, stored_at=stored_at)
+        with self._save_lock:
+            self._unsaved.append({"key": key, "stored_at": stored_at, "diagnosis": diagnosis})
+            full = len(self._unsaved) >= self.save_batch_size
+        if full:
+            self.flush()
+
+    def close(self):
+        """写入缓冲的条目"""
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        return {"hits": self._cache.hits, "misses": self._cache.misses, "size": len(self._cache)}
@@ -0,0 +1,38 @@
+"""
+事件模块 - 定义请求处理过程中按时间顺序产出的流式事件
+"""
+from typing import Any, Callable, Dict
+
+# 检索到相似历史命令，data: {"similar_commands": [...]}
+EVENT_SIMILAR_COMMANDS = "similar_commands"
+# 确定并开始执行一条命令，data: {"command": str}
+EVENT_COMMAND = "command"
+# 命令输出块，data: {"stream": "stdout"/"stderr", "text": str}
+EVENT_OUTPUT = "output"
+# 错误分析的增量文本，data: {"text": str}
+EVENT_ANALYSIS = "analysis"
+# 请求处理完成，data: {"result": process_input 的返回结果}，总是最后一个事件
+EVENT_RESULT = "result"
+
+EVENT_TYPES = (EVENT_SIMILAR_COMMANDS, EVENT_COMMAND, EVENT_OUTPUT, EVENT_ANALYSIS, EVENT_RESULT)
+
+
+class AgentEvent:
+    """流式事件"""
+
+    def __init__(self, type: str, **data: Any):
+        """创建事件
+
+        Args:
+            type: 事件类型，取值见 EVENT_TYPES
+            **data: 事件数据
+        """
+        self.type = type
+        self.data: Dict[str, Any] = data
+
+    def __repr__(self) -> str:
+        return f"AgentEvent({self.type!r}, {self.data!r})"
+
+
+# 事件回调
+EventCallback = Callable[[AgentEvent], None]
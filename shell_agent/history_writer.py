@@ -0,0 +1,188 @@
+"""
+历史写回模块 - 将命令历史异步批量写入向量数据库，并用本地日志保证不丢失
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+
+class HistoryWriter:
+    """命令历史的写回（write-behind）队列
+
+    submit 先把记录追加到本地日志文件再立即返回；后台线程按批大小或时间间隔
+    把待写记录成批交给 write_batch 写入向量数据库。日志每批只 fsync 一次，
+    写入成功后追加一行已完成的记录ID，全部写完时清空日志，冗余行过多时压缩日志。
+    进程崩溃后重新创建写回队列时，日志中未写入的记录会被重新提交。
+    """
+
+    def __init__(self, write_batch: Callable[[List[Dict[str, Any]]], None], journal_path: str,
+                 batch_size: int = 16, flush_interval: float = 2.0, retry_interval: float = 5.0):
+        """初始化写回队列
+
+        Args:
+            write_batch: 批量写入函数，接收记录列表，失败时应抛出异常
+            journal_path: 本地日志文件路径
+            batch_size: 每批最多写入的记录数
+            flush_interval: 队列中有记录时最长等待多久写入一批（秒）
+            retry_interval: 写入失败后重试的间隔（秒）
+        """
+        self.write_batch = write_batch
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+
+        journal_dir = os.path.dirname(journal_path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        for record in self._load_journal():
+            self._pending[record["_id"]] = record
+            self._queue.put(record)
+        if self._pending:
+            print(f"从历史写回日志恢复 {len(self._pending)} 条未写入的记录")
+        self._journal = None
+        self._journal_lines = 0
+        self._compact_journal()
+
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _load_journal(self) -> List[Dict[str, Any]]:
+        """读取日志中未写入的记录，跳过已标记完成的记录，忽略崩溃时写了一半的行"""
+        if not os.path.exists(self.journal_path):
+            return []
+        records: Dict[str, Dict[str, Any]] = {}
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                if "_done" in record:
+                    for record_id in record["_done"]:
+                        records.pop(record_id, None)
+                elif "_id" in record:
+                    records[record["_id"]] = record
+        return list(records.values())
+
+    def _append_journal(self, entry: Dict[str, Any]):
+        """追加一行日志并交给操作系统（进程崩溃不会丢失），fsync 由后台线程每批进行一次，需在持有锁时调用"""
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self._journal_lines += 1
+
+    def _compact_journal(self):
+        """用仍未写入的记录重写日志并重新打开，需在持有锁时或后台线程启动前调用"""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self._pending.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal_lines = len(self._pending)
+
+    def submit(self, record: Dict[str, Any]):
+        """提交一条记录，追加到本地日志后立即返回"""
+        record = dict(record, _id=uuid.uuid4().hex)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("历史写回队列已关闭")
+            self._append_journal(record)
+            self._pending[record["_id"]] = record
+        self._queue.put(record)
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """阻塞直到凑满一批或等待超过 flush_interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = 0 if self._closed else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """后台写入线程"""
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                with self._lock:
+                    if self._closed and not self._pending:
+                        return
+                continue
+
+            # 本批及之前追加的日志行一起落盘，日志文件只由本线程替换，fsync 不需要持有锁
+            os.fsync(self._journal.fileno())
+            records = [{k: v for k, v in record.items() if k != "_id"} for record in batch]
+            try:
+                self.write_batch(records)
+            except Exception as e:
+                print(f"批量写入历史记录失败，{self.retry_interval}秒后重试: {str(e)}")
+                time.sleep(self.retry_interval)
+                for record in batch:
+                    self._queue.put(record)
+                continue
+
+            with self._lock:
+                for record in batch:
+                    self._pending.pop(record["_id"], None)
+                if not self._pending:
+                    # 全部写入后清空日志
+                    self._journal.truncate(0)
+                    os.fsync(self._journal.fileno())
+                    self._journal_lines = 0
+                    self._idle.notify_all()
+                else:
+                    self._append_journal({"_done": [record["_id"] for record in batch]})
+                    if self._journal_lines > 2 * len(self._pending) + 1000:
+                        self._compact_journal()
+
+    @property
+    def pending_count(self) -> int:
+        """尚未写入向量数据库的记录数"""
+        return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待所有已提交的记录写入完成
+
+        Returns:
+            bool: 是否在超时前全部写入
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = 30.0) -> bool:
+        """停止接收新记录，写完剩余记录后结束后台线程
+
+        Returns:
+            bool: 是否在超时前全部写入，未写入的记录仍保留在日志中
+        """
+        with self._lock:
+            self._closed = True
+        flushed = self.flush(timeout=timeout)
+        if flushed:
+            self._thread.join(timeout=self.flush_interval * 2)
+        if not self._thread.is_alive():
+            self._journal.close()
+        return flushed
@@ -0,0 +1,172 @@
+"""
+词法索引模块 - 基于BM25的倒排索引，用于命令历史的精确词项检索
+"""
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class BM25Index:
+    """进程内BM25倒排索引
+
+    以文档ID为键增量添加/更新文档，并把操作追加到JSONL日志中持久化；
+    加载时重放日志，日志中的冗余记录过多时自动压缩。
+    """
+
+    # 单词、命令行选项、文件名和路径（如 du、-sh、.log、/var/log）；中文按字切分后再组成二元组
+    _TOKEN_RE = re.compile(r"[a-z0-9_\-./~*]+|[\u4e00-\u9fff]+")
+    _CJK_RE = re.compile(r"[\u4e00-\u9fff]+")
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        """初始化索引
+
+        Args:
+            path: 持久化日志文件路径，为None时只保存在内存中
+            k1: BM25词频饱和参数
+            b: BM25文档长度归一化参数
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._log_lines = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """将文本切分为词项，中文连续字符产生单字和二元组"""
+        tokens = []
+        for token in cls._TOKEN_RE.findall(text.lower()):
+            if cls._CJK_RE.fullmatch(token):
+                tokens.extend(token)
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+            else:
+                tokens.append(token)
+                # 同时索引去掉前导符号的形式，使 "-sh" 与 "sh"、".log" 与 "log" 都能匹配
+                stripped = token.strip("-./~*")
+                if stripped and stripped != token:
+                    tokens.append(stripped)
+        return tokens
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _remove_locked(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _add_locked(self, doc_id: str, text: str, payload: Dict[str, Any]):
+        self._remove_locked(doc_id)
+        terms = Counter(self.tokenize(text))
+        length = sum(terms.values())
+        self._docs[doc_id] = {"text": text, "terms": terms, "length": length, "payload": payload}
+        self._total_length += length
+        for term, freq in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = freq
+
+    def _append_log(self, entries: List[Dict[str, Any]]):
+        if not self.path:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._log_lines += len(entries)
+        if self._log_lines > 2 * len(self._docs) + 100:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        """用当前文档重写日志，去掉被覆盖和已删除的记录"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for doc_id, doc in self._docs.items():
+                entry = {"op": "add", "id": doc_id, "text": doc["text"], "payload": doc["payload"]}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._log_lines = len(self._docs)
+
+    def _load(self):
+        """重放持久化日志，忽略写了一半的行"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._log_lines += 1
+                if entry.get("op") == "add":
+                    self._add_locked(entry["id"], entry["text"], entry.get("payload") or {})
+                elif entry.get("op") == "remove":
+                    self._remove_locked(entry["id"])
+
+    def add_many(self, items: List[Tuple[str, str, Dict[str, Any]]]):
+        """批量添加或更新文档
+
+        Args:
+            items: (文档ID, 被索引的文本, 附带的元数据) 列表，ID已存在时覆盖
+        """
+        with self._lock:
+            for doc_id, text, payload in items:
+                self._add_locked(doc_id, text, payload)
+            self._append_log([{"op": "add", "id": doc_id, "text": text, "payload": payload}
+                              for doc_id, text, payload in items])
+
+    def remove_many(self, doc_ids: List[str]):
+        """批量删除文档"""
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove_locked(doc_id)
+            self._append_log([{"op": "remove", "id": doc_id} for doc_id in doc_ids])
+
+    def clear(self):
+        """清空索引及其持久化日志"""
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._total_length = 0
+            if self.path:
+                self._compact_locked()
+
+    def get_payload(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """获取文档附带的元数据"""
+        doc = self._docs.get(doc_id)
+        return doc["payload"] if doc is not None else None
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """BM25检索
+
+        Returns:
+            List[Tuple[str, float, Dict[str, Any]]]: 按得分降序排列的 (文档ID, 得分, 元数据)
+        """
+        with self._lock:
+            n_docs = len(self._docs)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[str, float] = {}
+            for term in set(self.tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in postings.items():
+                    length_norm = 1 - self.b + self.b * self._docs[doc_id]["length"] / avg_length
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + self.k1 * length_norm)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(doc_id, score, self._docs[doc_id]["payload"]) for doc_id, score in ranked]
@@ -0,0 +1,280 @@
+"""
+历史库维护模块 - 命令历史的去重合并、保留策略，以及JSONL/NumPy快照的读写
+"""
+import json
+import math
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .utils import DocumentUtils
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_RECORDS = "records.jsonl"
+SNAPSHOT_EMBEDDINGS = "embeddings.npy"
+
+
+def history_counts(metadata: Dict[str, Any]) -> Tuple[int, int]:
+    """命令历史的 (成功次数, 失败次数)，早期版本写入的记录没有计数，按其成功与否记为执行过一次"""
+    if "success_count" in metadata or "failure_count" in metadata:
+        return int(metadata.get("success_count") or 0), int(metadata.get("failure_count") or 0)
+    return (1, 0) if metadata.get("success") else (0, 1)
+
+
+def last_seen(metadata: Dict[str, Any]) -> Optional[float]:
+    """命令历史最近一次执行的时间戳，没有记录时为None"""
+    for key in ("last_seen", "first_seen", "timestamp"):
+        if metadata.get(key) is not None:
+            return float(metadata[key])
+    return None
+
+
+def directory_size_mb(path: str) -> float:
+    """目录下全部文件的大小（MB）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1024 / 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法计算百分位数，values 为空时返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+class RetentionPolicy:
+    """命令历史的保留策略
+
+    各条件独立判断，满足任一条件的记录被删除；max_entries 在其他条件之后应用，
+    按最近执行时间只保留最新的记录。没有执行时间的早期记录不会因年龄被删除。
+    """
+
+    def __init__(self, max_age_days: Optional[float] = None, drop_failed: bool = False, min_uses: int = 0,
+                 max_entries: Optional[int] = None):
+        """初始化保留策略
+
+        Args:
+            max_age_days: 最近一次执行早于该天数的记录被删除，为None时不按年龄删除
+            drop_failed: 是否删除从未执行成功的记录
+            min_uses: 执行次数（成功与失败之和）少于该值的记录被删除
+            max_entries: 每个集合最多保留的命令历史条数，为None时不限制
+        """
+        self.max_age_days = max_age_days
+        self.drop_failed = drop_failed
+        self.min_uses = min_uses
+        self.max_entries = max_entries
+
+    def apply(self, records: List[Dict[str, Any]], now: Optional[float] = None) -> Tuple[List[Dict[str, Any]],
+                                                                                          Dict[str, int]]:
+        """筛选要保留的命令历史
+
+        Args:
+            records: 命令历史记录，每条包含 metadata
+            now: 当前时间戳，默认为 time.time()
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Dict[str, int]]: (保留的记录, 按原因统计的删除条数)
+        """
+        now = time.time() if now is None else now
+        removed = {"age": 0, "failed": 0, "usage": 0, "capacity": 0}
+        kept = []
+        for record in records:
+            metadata = record["metadata"]
+            success_count, failure_count = history_counts(metadata)
+            seen = last_seen(metadata)
+            if self.max_age_days is not None and seen is not None and now - seen > self.max_age_days * 86400:
+                removed["age"] += 1
+            elif self.drop_failed and success_count == 0:
+                removed["failed"] += 1
+            elif success_count + failure_count < self.min_uses:
+                removed["usage"] += 1
+            else:
+                kept.append(record)
+        if self.max_entries is not None and len(kept) > self.max_entries:
+            kept.sort(key=lambda record: last_seen(record["metadata"]) or 0.0, reverse=True)
+            removed["capacity"] = len(kept) - self.max_entries
+            kept = kept[:self.max_entries]
+        return kept, removed
+
+
+def merge_duplicates(records: List[Dict[str, Any]], by_command: bool = False) -> Tuple[List[Dict[str, Any]], int]:
+    """合并重复的命令历史
+
+    默认合并规范化请求和命令都相同的记录，即早期版本按文本分割写入、以随机ID标识的历史与其副本；
+    by_command 为True时合并命令相同的全部记录（不同说法的请求只保留执行次数最多的一条，
+    其余说法此后只能通过命令本身被检索到）。合并后的记录以稳定ID（DocumentUtils.history_id）标识，
+    成功/失败次数相加，首次执行时间取最早的，最近执行时间和输出预览取最近的一条。
+
+    Args:
+        records: 命令历史记录，每条包含 id、document、metadata 和 row（向量在快照中的行号）
+        by_command: 是否只按命令合并
+
+    Returns:
+        Tuple[List[Dict[str, Any]], int]: (合并后的记录, 被合并掉的记录数)；
+            有变化的记录 changed 为True，其中文档内容也有变化的 row 为None，需要重新嵌入
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        metadata = record["metadata"]
+        user_input, command = metadata.get("user_input"), metadata.get("command")
+        if not user_input or not command:
+            key = record["id"]
+        elif by_command:
+            key = command.strip()
+        else:
+            key = DocumentUtils.history_id(user_input, command)
+        groups.setdefault(key, []).append(record)
+
+    merged = []
+    for group in groups.values():
+        metadata = group[0]["metadata"]
+        if len(group) == 1 and (not metadata.get("user_input") or not metadata.get("command") or
+                                group[0]["id"] == DocumentUtils.history_id(metadata["user_input"],
+                                                                           metadata["command"])):
+            merged.append(group[0])
+            continue
+        primary = max(group, key=lambda record: (sum(history_counts(record["metadata"])),
+                                                 last_seen(record["metadata"]) or 0.0))
+        latest = max(group, key=lambda record: last_seen(record["metadata"]) or 0.0)
+        user_input, command = primary["metadata"]["user_input"], primary["metadata"]["command"].strip()
+        document, metadata = DocumentUtils.create_compact_history_document(
+            user_input, command, latest["metadata"].get("output_preview") or "", bool(latest["metadata"].get("success"))
+        )
+        counts = [history_counts(record["metadata"]) for record in group]
+        seen = [last_seen(record["metadata"]) for record in group if last_seen(record["metadata"]) is not None]
+        first_seen = [float(record["metadata"]["first_seen"]) for record in group
+                      if record["metadata"].get("first_seen") is not None]
+        metadata.update(success_count=sum(count[0] for count in counts),
+                        failure_count=sum(count[1] for count in counts))
+        if seen:
+            metadata["last_seen"] = max(seen)
+            metadata["first_seen"] = min(first_seen + seen)
+        if primary["metadata"].get("tenant"):
+            metadata["tenant"] = primary["metadata"]["tenant"]
+        doc_id = DocumentUtils.history_id(user_input, command)
+        reusable = primary["id"] == doc_id and primary["document"] == document
+        merged.append({"id": doc_id, "document": document, "metadata": metadata,
+                       "row": primary["row"] if reusable else None, "changed": True})
+    return merged, len(records) - len(merged)
+
+
+class SnapshotWriter:
+    """流式写入历史快照
+
+    快照是一个目录：records.jsonl 每行一条记录（集合名、ID、文档内容和元数据），
+    embeddings.npy 按行与之对应的float32向量矩阵，manifest.json 记录嵌入模型、维度和条数。
+    向量写入预先分配的内存映射文件，导出时不需要把全部向量放在内存中。
+    """
+
+    def __init__(self, path: str, capacity: int, manifest: Optional[Dict[str, Any]] = None):
+        """创建快照目录
+
+        Args:
+            path: 快照目录
+            capacity: 预计写入的记录数，用于预先分配向量文件
+            manifest: 写入 manifest.json 的附加信息（如嵌入模型）
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.manifest = dict(manifest or {})
+        self.count = 0
+        self.collections: Dict[str, int] = {}
+        self._records = open(os.path.join(path, SNAPSHOT_RECORDS), "w", encoding="utf-8")
+        self._embeddings: Optional[np.memmap] = None
+
+    def write(self, collection: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+              embeddings: Any):
+        """写入一批记录，embeddings 与 ids 按行对应"""
+        if not ids:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self._embeddings is None:
+            self._embeddings = np.lib.format.open_memmap(
+                os.path.join(self.path, SNAPSHOT_EMBEDDINGS), mode="w+", dtype=np.float32,
+                shape=(max(self.capacity, len(ids)), embeddings.shape[1])
+            )
+        if self.count + len(ids) > self._embeddings.shape[0]:
+            self._resize(max(self.count + len(ids), 2 * self._embeddings.shape[0]))
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self._records.write(json.dumps({"collection": collection, "id": doc_id, "document": document,
+                                            "metadata": metadata or {}}, ensure_ascii=False) + "\n")
+        self._embeddings[self.count:self.count + len(ids)] = embeddings
+        self.count += len(ids)
+        self.collections[collection] = self.collections.get(collection, 0) + len(ids)
+
+    def _resize(self, rows: int):
+        """把向量文件重写为 rows 行（导出期间记录数与预计的不同时）"""
+        path = os.path.join(self.path, SNAPSHOT_EMBEDDINGS)
+        tmp_path = path + ".tmp"
+        resized = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                            shape=(rows, self._embeddings.shape[1]))
+        resized[:min(rows, self.count)] = self._embeddings[:min(rows, self.count)]
+        resized.flush()
+        del resized
+        self._embeddings = None
+        os.replace(tmp_path, path)
+        self._embeddings = np.load(path, mmap_mode="r+")
+
+    def close(self) -> Dict[str, Any]:
+        """写完快照并返回清单"""
+        self._records.close()
+        dimensions = 0
+        if self._embeddings is not None:
+            dimensions = int(self._embeddings.shape[1])
+            if self._embeddings.shape[0] != self.count:
+                self._resize(self.count)
+            self._embeddings.flush()
+            self._embeddings = None
+        else:
+            np.save(os.path.join(self.path, SNAPSHOT_EMBEDDINGS), np.zeros((0, 0), dtype=np.float32))
+        manifest = dict(self.manifest, version=SNAPSHOT_VERSION, created=time.time(), count=self.count,
+                        dimensions=dimensions, collections=self.collections)
+        with open(os.path.join(self.path, SNAPSHOT_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """读取快照清单"""
+    with open(os.path.join(path, SNAPSHOT_MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"不支持的快照版本: {manifest.get('version')}")
+    return manifest
+
+
+def read_snapshot(path: str, batch_size: int = 1000) -> Iterator[Tuple[str, List[str], List[str],
+                                                                     List[Dict[str, Any]], np.ndarray]]:
+    """按批读取快照，向量以内存映射方式读取
+
+    Yields:
+        Tuple: (集合名, ID列表, 文档列表, 元数据列表, 向量矩阵)，每批只包含同一集合的记录
+    """
+    embeddings = np.load(os.path.join(path, SNAPSHOT_EMBEDDINGS), mmap_mode="r")
+    batch: List[Dict[str, Any]] = []
+    start = 0
+
+    def flush():
+        rows = np.asarray(embeddings[start:start + len(batch)], dtype=np.float32)
+        return (batch[0]["collection"], [record["id"] for record in batch],
+                [record["document"] for record in batch], [record["metadata"] for record in batch], rows)
+
+    with open(os.path.join(path, SNAPSHOT_RECORDS), "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if batch and (len(batch) >= batch_size or record["collection"] != batch[0]["collection"]):
+                yield flush()
+                start += len(batch)
+                batch = []
+            batch.append(record)
+    if batch:
+        yield flush()
@@ -11,4 +11,10 @@ class AnalyzeCommandErrorParams(BaseModel):
     """用于 analyze_command_error 工具的参数模型"""
     user_input: str = Field(..., description="用户的原始请求")
     command: str = Field(..., description="执行失败的shell命令")
-    error_message: str = Field(..., description="命令返回的错误信息")
\ No newline at end of file
+    error_message: str = Field(..., description="命令返回的错误信息")
+
+
+class GeneratedCommand(BaseModel):
+    """直接流水线模式下LLM的结构化输出"""
+    command: str = Field(..., description="满足用户需求、可在当前系统上直接执行的shell命令")
+    explanation: str = Field("", description="对命令作用的简短说明")
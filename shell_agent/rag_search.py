@@ -1,45 +1,660 @@
 """
 RAG搜索增强模块 - 提供相关知识支持
 """
-from typing import List, Dict, Any, Optional
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import asyncio
+import contextlib
+import hashlib
+import json
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
 import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .context import get_request_context
+from .embedding_cache import CachedEmbeddings
+from .embeddings import HashingEmbeddings, create_embeddings
+from .history_writer import HistoryWriter
+from .lexical_index import BM25Index
+from .maintenance import (SNAPSHOT_EMBEDDINGS, RetentionPolicy, SnapshotWriter, directory_size_mb, load_manifest,
+                          merge_duplicates, percentile, read_snapshot)
+from .tracing import span
 from .utils import DocumentUtils
 
+if TYPE_CHECKING:
+    from chromadb.api import ClientAPI
+    from langchain_chroma import Chroma
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# 支持的检索模式
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+# 默认租户使用的集合（langchain_chroma 的默认集合名），其余租户的命令历史各自保存在独立的集合中
+DEFAULT_COLLECTION = "langchain"
+# 向量查询中只返回命令历史，过滤在Chroma内部完成，不占用 top-k 名额
+HISTORY_FILTER = {"type": "shell_history"}
+# Chroma为每个集合的向量段在持久化目录下建立以段ID（UUID）命名的目录
+_SEGMENT_DIR_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
 class RAGSearch:
     """RAG搜索增强类，用于提供相关知识支持"""
 
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db", embedding_cache_size: int = 100000,
+                 write_behind: bool = True, history_batch_size: int = 16, history_flush_interval: float = 2.0,
+                 embedding_backend: str = "openai", retrieval_mode: str = "hybrid", lazy: bool = False,
+                 max_open_tenants: int = 64, embeddings: Optional[Embeddings] = None):
         """初始化RAG搜索
 
+        切换嵌入后端后，已有向量与新后端不兼容，需要调用 rebuild_index 重建索引。
+        lazy 为True时构造时不创建嵌入客户端、不打开向量数据库，二者在首次检索或写入时才初始化
+        （也可调用 warm_up 在后台线程中提前初始化）；BM25词法索引仍在构造时加载。
+
+        命令历史按租户（用户、主机等，由调用方决定粒度）分区：未指定租户时使用默认集合，
+        其余租户各有独立的向量集合和BM25索引，检索开销只与该租户的历史规模有关。
+        各方法的 tenant 参数为None时使用当前请求上下文中的租户。
+
         Args:
             persist_directory: 向量数据库持久化目录
+            embedding_cache_size: 远程嵌入后端的本地缓存最大条目数，为0时禁用缓存
+            write_behind: 是否异步批量写入命令历史（先写本地日志，后台成批嵌入并插入）
+            history_batch_size: 异步写入时每批的最大记录数
+            history_flush_interval: 异步写入时最长等待多久写入一批（秒）
+            embedding_backend: 嵌入后端，"openai" 或本地的 "hashing"
+            retrieval_mode: 默认检索模式，"hybrid"（BM25与向量融合）、"vector" 或 "lexical"
+            lazy: 是否延迟初始化嵌入客户端和向量数据库
+            max_open_tenants: 最多缓存多少个租户的集合句柄和BM25索引，超出时释放最久未使用的
+            embeddings: 自定义的嵌入模型（如基准测试中的假嵌入模型），设置后不按 embedding_backend 创建，
+                embedding_backend 只作为写入索引标记的后端名称
         """
-        self.embeddings = OpenAIEmbeddings()
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"不支持的检索模式: {retrieval_mode}，可选值: {', '.join(RETRIEVAL_MODES)}")
         self.persist_directory = persist_directory
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
+        self.retrieval_mode = retrieval_mode
+        self.embedding_backend = embedding_backend
+        self.embedding_cache_size = embedding_cache_size
+        self._custom_embeddings = embeddings
+        self._embeddings: Optional[Embeddings] = None
+        self._embedding_model: Optional[str] = None
+        self._chroma_client: Optional["ClientAPI"] = None
+        self._vectordb: Optional["Chroma"] = None
+        self._text_splitter: Optional["RecursiveCharacterTextSplitter"] = None
+        self._store_lock = threading.RLock()
+        self._warm_up_lock = threading.Lock()
+        self._warm_up_thread: Optional[threading.Thread] = None
+        self.max_open_tenants = max_open_tenants
+        self._collections: "OrderedDict[str, Chroma]" = OrderedDict()
+        self._lexical_indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
 
         # 创建持久化目录（如果不存在）
         os.makedirs(self.persist_directory, exist_ok=True)
 
+        # 命令历史的BM25词法索引，与向量数据库一同持久化；旧数据库首次打开时从向量库构建
+        self.lexical_index = BM25Index(os.path.join(self.persist_directory, "lexical_index.jsonl"))
+
         # 初始化向量数据库
-        try:
-            self.vectordb = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings
+        if not lazy:
+            self._open_store()
+
+        # 命令历史写回队列，日志中残留的记录会在此时重新提交
+        self.history_writer = HistoryWriter(
+            self._write_history_batch,
+            journal_path=os.path.join(self.persist_directory, "history_journal.jsonl"),
+            batch_size=history_batch_size,
+            flush_interval=history_flush_interval
+        ) if write_behind else None
+
+    def _create_embeddings(self):
+        """创建嵌入客户端，远程后端外包一层本地缓存"""
+        embeddings = self._custom_embeddings or create_embeddings(self.embedding_backend)
+        self._embedding_model = CachedEmbeddings._infer_model_name(embeddings)
+        # 本地哈希后端计算比查缓存更快，只为其他后端启用嵌入缓存
+        if self.embedding_cache_size > 0 and not isinstance(embeddings, HashingEmbeddings):
+            embeddings = CachedEmbeddings(
+                embeddings,
+                cache_path=os.path.join(self.persist_directory, "embedding_cache.sqlite3"),
+                max_entries=self.embedding_cache_size
+            )
+        self._embeddings = embeddings
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """嵌入客户端，首次访问时创建"""
+        if self._embeddings is None:
+            with self._store_lock:
+                if self._embeddings is None:
+                    self._create_embeddings()
+        return self._embeddings
+
+    @property
+    def embedding_model(self) -> str:
+        """当前嵌入模型名称"""
+        if self._embedding_model is None:
+            self.embeddings
+        return self._embedding_model
+
+    @property
+    def vectordb(self) -> "Chroma":
+        """向量数据库，首次访问时打开"""
+        if self._vectordb is None:
+            with self._store_lock:
+                if self._vectordb is None:
+                    self._open_store()
+        return self._vectordb
+
+    @property
+    def text_splitter(self) -> "RecursiveCharacterTextSplitter":
+        """文档分割器，只有 add_documents 使用，首次访问时创建"""
+        if self._text_splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+            self._text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=1000,
+                chunk_overlap=200
             )
-            print(f"已加载现有向量数据库，包含 {self.vectordb._collection.count()} 条记录")
+        return self._text_splitter
+
+    def _open_store(self):
+        """打开向量数据库，检查嵌入模型，并在词法索引为空时从向量库构建"""
+        with span("chroma", "init"):
+            try:
+                self._vectordb = self._open_vectordb()
+                count = self._vectordb._collection.count()
+                print(f"已加载现有向量数据库，包含 {count} 条记录")
+            except Exception as e:
+                print(f"创建新的向量数据库: {str(e)}")
+                self._vectordb = self._open_vectordb()
+                count = self._vectordb._collection.count()
+            self._check_embedding_backend(count)
+            if len(self.lexical_index) == 0 and count > 0:
+                self._rebuild_lexical_index()
+
+    @property
+    def chroma_client(self) -> "ClientAPI":
+        """Chroma客户端，全部集合共用一个，首次访问时创建"""
+        if self._chroma_client is None:
+            with self._store_lock:
+                if self._chroma_client is None:
+                    import chromadb
+                    self._chroma_client = chromadb.PersistentClient(path=self.persist_directory)
+        return self._chroma_client
+
+    def _open_vectordb(self, collection_name: str = DEFAULT_COLLECTION) -> "Chroma":
+        """打开（或创建）向量数据库集合"""
+        from langchain_chroma import Chroma
+        return Chroma(
+            collection_name=collection_name,
+            client=self.chroma_client,
+            embedding_function=self.embeddings
+        )
+
+    def _close_store(self):
+        """关闭Chroma客户端并丢弃全部集合句柄，之后访问时重新打开"""
+        with self._store_lock:
+            if self._chroma_client is not None:
+                self._chroma_client.close()
+            self._chroma_client = None
+            self._vectordb = None
+            self._collections.clear()
+
+    @staticmethod
+    def resolve_tenant(tenant: Optional[str] = None) -> Optional[str]:
+        """确定租户：显式传入的优先，否则使用当前请求上下文中的租户，空字符串视为默认租户"""
+        if tenant is None:
+            context = get_request_context()
+            tenant = context.tenant if context is not None else None
+        return tenant or None
+
+    @staticmethod
+    def collection_name(tenant: Optional[str]) -> str:
+        """租户对应的集合名
+
+        默认租户使用原有集合；其余租户为 history_<可读前缀>_<哈希>，满足Chroma对集合名的限制，
+        且不同租户名即使规范化后前缀相同也不会冲突。
+        """
+        if not tenant:
+            return DEFAULT_COLLECTION
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "-", tenant).strip("-_")[:32] or "tenant"
+        digest = hashlib.sha1(tenant.encode("utf-8")).hexdigest()[:10]
+        return f"history_{slug}_{digest}"
+
+    def _lexical_index_path(self, collection_name: str) -> str:
+        if collection_name == DEFAULT_COLLECTION:
+            return os.path.join(self.persist_directory, "lexical_index.jsonl")
+        return os.path.join(self.persist_directory, "tenants", f"{collection_name}.lexical_index.jsonl")
+
+    def _cached(self, handles: "OrderedDict[str, Any]", collection_name: str, open_handle) -> Any:
+        """从LRU缓存中取出租户集合的句柄，不存在时打开"""
+        with self._store_lock:
+            handle = handles.get(collection_name)
+            if handle is None:
+                handle = handles[collection_name] = open_handle()
+                while len(handles) > self.max_open_tenants:
+                    handles.popitem(last=False)
+            handles.move_to_end(collection_name)
+            return handle
+
+    def _collection(self, collection_name: str) -> "Chroma":
+        """返回集合的向量库句柄"""
+        if collection_name == DEFAULT_COLLECTION:
+            return self.vectordb
+
+        def open_collection():
+            with span("chroma", "init", collection=collection_name):
+                return self._open_vectordb(collection_name)
+
+        return self._cached(self._collections, collection_name, open_collection)
+
+    def _lexical(self, collection_name: str) -> BM25Index:
+        """返回集合对应的BM25索引，租户的索引不依赖向量数据库，词法检索时无需打开集合"""
+        if collection_name == DEFAULT_COLLECTION:
+            return self.lexical_index
+
+        def open_index():
+            os.makedirs(os.path.join(self.persist_directory, "tenants"), exist_ok=True)
+            return BM25Index(self._lexical_index_path(collection_name))
+
+        return self._cached(self._lexical_indexes, collection_name, open_index)
+
+    def tenant_collections(self) -> List[str]:
+        """列出数据库中已有的租户集合名（不含默认集合）"""
+        collections = self.chroma_client.list_collections()
+        # 较早版本的chromadb返回集合对象，新版本返回集合名
+        names = [getattr(collection, "name", collection) for collection in collections]
+        return sorted(name for name in names if name.startswith("history_"))
+
+    @property
+    def is_warm(self) -> bool:
+        """向量数据库是否已打开"""
+        return self._vectordb is not None
+
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """提前创建嵌入客户端并打开向量数据库
+
+        延迟初始化时在请求开始时调用，使数据库的导入和打开与LLM调用重叠；
+        首次检索或写入仍会等待初始化完成。已初始化时不做任何事。
+
+        Args:
+            background: 是否在后台线程中初始化
+
+        Returns:
+            Optional[threading.Thread]: 后台初始化线程，已初始化或同步初始化时为None
+        """
+        if self.is_warm:
+            return None
+        if not background:
+            self.vectordb
+            return None
+        with self._warm_up_lock:
+            if self._warm_up_thread is None:
+                self._warm_up_thread = threading.Thread(target=self._background_warm_up, daemon=True)
+                self._warm_up_thread.start()
+            return self._warm_up_thread
+
+    def _background_warm_up(self):
+        try:
+            self.vectordb
         except Exception as e:
-            print(f"创建新的向量数据库: {str(e)}")
-            self.vectordb = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings
+            # 首次检索或写入时会再次尝试并抛出错误
+            print(f"预先打开向量数据库失败: {str(e)}")
+
+    @property
+    def _backend_marker_path(self) -> str:
+        return os.path.join(self.persist_directory, "embedding_backend.json")
+
+    def _write_backend_marker(self):
+        """记录当前索引所使用的嵌入模型"""
+        with open(self._backend_marker_path, "w", encoding="utf-8") as f:
+            json.dump({"backend": self.embedding_backend, "model": self.embedding_model}, f)
+
+    def _indexed_model(self) -> Optional[str]:
+        """索引标记中记录的嵌入模型，没有标记时为None"""
+        if not os.path.exists(self._backend_marker_path):
+            return None
+        with open(self._backend_marker_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("model")
+
+    def _check_embedding_backend(self, count: int):
+        """检查索引是否由当前嵌入模型构建，不一致时提示重建索引
+
+        没有记录的旧索引视为由OpenAI嵌入构建。
+
+        Args:
+            count: 向量数据库中的记录数
+        """
+        if os.path.exists(self._backend_marker_path):
+            indexed_model = self._indexed_model()
+        elif count > 0:
+            indexed_model = self.embedding_model if self.embedding_backend == "openai" else "openai"
+        else:
+            indexed_model = None
+
+        if indexed_model is None:
+            self._write_backend_marker()
+        elif indexed_model != self.embedding_model:
+            print(f"警告: 向量索引由嵌入模型 {indexed_model} 构建，与当前的 {self.embedding_model} 不一致，"
+                  f"检索结果将不可用，请使用 --rebuild-index（或调用 RAGSearch.rebuild_index）重建索引")
+
+    def rebuild_index(self, batch_size: int = 256) -> int:
+        """用当前嵌入模型重新嵌入全部文档，重建向量索引
+
+        切换嵌入后端后调用；文档内容、元数据和ID保持不变。
+
+        Args:
+            batch_size: 每批重新嵌入的文档数
+
+        Returns:
+            int: 重建的文档数
+        """
+        total = 0
+        for collection_name in [DEFAULT_COLLECTION] + self.tenant_collections():
+            total += self._rebuild_collection(collection_name, batch_size)
+        self._write_backend_marker()
+        print(f"已使用嵌入模型 {self.embedding_model} 重建索引，共 {total} 条记录")
+        return total
+
+    def _rebuild_collection(self, collection_name: str, batch_size: int) -> int:
+        """重新嵌入一个集合的全部文档，返回文档数"""
+        vectordb = self._collection(collection_name)
+        data = vectordb.get(include=["documents", "metadatas"])
+        ids, documents, metadatas = data["ids"], data["documents"], data["metadatas"]
+
+        vectordb.delete_collection()
+        with self._store_lock:
+            vectordb = self._open_vectordb(collection_name)
+            if collection_name == DEFAULT_COLLECTION:
+                self._vectordb = vectordb
+            else:
+                self._collections[collection_name] = vectordb
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            vectordb.add_texts(
+                texts=documents[start:end],
+                metadatas=[metadata or {} for metadata in metadatas[start:end]],
+                ids=ids[start:end]
+            )
+        self._rebuild_lexical_index(collection_name)
+        return len(ids)
+
+    @staticmethod
+    def _lexical_entry(doc_id: str, metadata: Dict[str, Any]):
+        """生成词法索引条目：索引用户请求和命令，附带检索结果所需的元数据"""
+        text = f"{metadata.get('user_input', '')}\n{metadata.get('command', '')}"
+        payload = {key: metadata.get(key) for key in
+                   ("user_input", "command", "success", "success_count", "last_seen")}
+        return doc_id, text, payload
+
+    def _rebuild_lexical_index(self, collection_name: str = DEFAULT_COLLECTION):
+        """从向量数据库中的命令历史重建集合对应的词法索引"""
+        vectordb, lexical_index = self._collection(collection_name), self._lexical(collection_name)
+        data = vectordb.get(where=HISTORY_FILTER, include=["metadatas"])
+        lexical_index.clear()
+        lexical_index.add_many([
+            self._lexical_entry(doc_id, metadata or {})
+            for doc_id, metadata in zip(data["ids"], data["metadatas"])
+        ])
+
+    def index_stats(self) -> Dict[str, Any]:
+        """历史库的规模：集合数、向量库记录数、词法索引条目数和持久化目录的磁盘占用"""
+        names = [DEFAULT_COLLECTION] + self.tenant_collections()
+        return {
+            "collections": len(names),
+            "records": sum(self._collection(name)._collection.count() for name in names),
+            "lexical_entries": sum(len(self._lexical(name)) for name in names),
+            "disk_mb": round(directory_size_mb(self.persist_directory), 2)
+        }
+
+    def _sample_queries(self, count: int) -> List[Tuple[str, str, List[float]]]:
+        """从各集合中取出命令历史作为测量延迟的查询，直接使用其已有的向量，不调用嵌入模型
+
+        Returns:
+            List[Tuple[str, str, List[float]]]: (集合名, 用户请求, 查询向量) 列表
+        """
+        names = [DEFAULT_COLLECTION] + self.tenant_collections()
+        per_collection = max(1, count // len(names))
+        queries = []
+        for name in names:
+            data = self._collection(name)._collection.get(where=HISTORY_FILTER, limit=per_collection,
+                                                          include=["metadatas", "embeddings"])
+            for metadata, embedding in zip(data["metadatas"], data["embeddings"]):
+                queries.append((name, (metadata or {}).get("user_input", ""), [float(x) for x in embedding]))
+        return queries[:count]
+
+    def measure_query_latency(self, queries: List[Tuple[str, str, List[float]]], k: int = 3) -> Dict[str, float]:
+        """测量向量索引查询和BM25查询本身的延迟（毫秒），查询向量预先给出，不含嵌入调用的耗时"""
+        vector_ms, lexical_ms = [], []
+        for name, text, embedding in queries:
+            vectordb = self._collection(name)
+            start = time.perf_counter()
+            vectordb.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=HISTORY_FILTER)
+            vector_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            self._lexical(name).search(text, k=k)
+            lexical_ms.append((time.perf_counter() - start) * 1000)
+        return {"queries": len(queries),
+                "vector_p50_ms": round(percentile(vector_ms, 50), 3), "vector_p95_ms": round(percentile(vector_ms, 95), 3),
+                "lexical_p50_ms": round(percentile(lexical_ms, 50), 3),
+                "lexical_p95_ms": round(percentile(lexical_ms, 95), 3)}
+
+    def _export_collection(self, collection_name: str, writer: SnapshotWriter,
+                           batch_size: int) -> List[Dict[str, Any]]:
+        """把集合的全部记录（含向量）按批写入快照
+
+        Returns:
+            List[Dict[str, Any]]: 记录列表，不含向量，row 为向量在快照中的行号
+        """
+        collection = self._collection(collection_name)._collection
+        records = []
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+            ids = page["ids"]
+            if not ids:
+                break
+            documents = [document or "" for document in page["documents"]]
+            metadatas = [metadata or {} for metadata in page["metadatas"]]
+            row = writer.count
+            writer.write(collection_name, ids, documents, metadatas, page["embeddings"])
+            records.extend({"id": doc_id, "document": document, "metadata": metadata, "row": row + i}
+                           for i, (doc_id, document, metadata) in enumerate(zip(ids, documents, metadatas)))
+            offset += len(ids)
+        return records
+
+    def export_snapshot(self, path: str, batch_size: int = 1000) -> Dict[str, Any]:
+        """把全部集合导出为快照（records.jsonl + embeddings.npy），向量原样保存，恢复时无需重新嵌入
+
+        Args:
+            path: 快照目录
+            batch_size: 每批从向量数据库读取的记录数
+
+        Returns:
+            Dict[str, Any]: 快照清单
+        """
+        self.flush_history()
+        names = [DEFAULT_COLLECTION] + self.tenant_collections()
+        writer = SnapshotWriter(path, sum(self._collection(name)._collection.count() for name in names), {
+            "backend": self.embedding_backend, "embedding_model": self._indexed_model() or self.embedding_model
+        })
+        for name in names:
+            self._export_collection(name, writer, batch_size)
+        manifest = writer.close()
+        print(f"已导出 {manifest['count']} 条记录到快照 {path}")
+        return manifest
+
+    def import_snapshot(self, path: str, batch_size: int = 1000) -> int:
+        """从快照恢复记录，相同ID的记录被覆盖，随后重建涉及的集合的词法索引
+
+        快照由当前嵌入模型构建时直接写入其中的向量；否则重新嵌入全部文档。
+
+        Args:
+            path: 快照目录
+            batch_size: 每批写入的记录数
+
+        Returns:
+            int: 恢复的记录数
+        """
+        manifest = load_manifest(path)
+        reembed = manifest.get("embedding_model") != self.embedding_model
+        if reembed:
+            print(f"快照由嵌入模型 {manifest.get('embedding_model')} 构建，与当前的 {self.embedding_model} 不一致，"
+                  f"将重新嵌入全部文档")
+        restored = 0
+        touched = []
+        for name, ids, documents, metadatas, embeddings in read_snapshot(path, batch_size):
+            if reembed:
+                embeddings = self.embeddings.embed_documents(documents)
+            self._collection(name)._collection.upsert(ids=ids, embeddings=embeddings, documents=documents,
+                                                      metadatas=[metadata or None for metadata in metadatas])
+            restored += len(ids)
+            if name not in touched:
+                touched.append(name)
+        for name in touched:
+            self._rebuild_lexical_index(name)
+        print(f"已从快照 {path} 恢复 {restored} 条记录")
+        return restored
+
+    def maintain(self, policy: Optional[RetentionPolicy] = None, merge_by_command: bool = False,
+                 compact: bool = True, latency_queries: int = 50, batch_size: int = 1000) -> Dict[str, Any]:
+        """维护历史库：合并重复的命令历史、按保留策略删除记录并压缩索引
+
+        对每个集合：先把全部记录导出到临时快照，合并重复的命令历史并应用保留策略；
+        compact 为True时删除集合后用保留的记录重建（沿用快照中的向量，只有内容变化的合并记录重新嵌入），
+        再清理Chroma删除集合后遗留的段目录、回收SQLite数据库的空闲页，使磁盘占用和查询延迟
+        只取决于保留的记录数；否则只删除和更新有变化的记录。词法索引随之重建。
+        维护期间不应有其他线程或进程写入命令历史；重建失败时临时快照保留在 maintenance 目录中，
+        可用 import_snapshot 恢复。
+
+        Args:
+            policy: 保留策略，为None时不删除记录（只合并和压缩）
+            merge_by_command: 是否把命令相同、请求说法不同的记录也合并为一条
+            compact: 是否重建集合并回收磁盘空间
+            latency_queries: 测量维护前后检索延迟所用的查询数
+            batch_size: 每批读取和写入的记录数
+
+        Returns:
+            Dict[str, Any]: 维护前后的索引规模和检索延迟（before/after），合并、删除和重新嵌入的记录数
+        """
+        indexed_model = self._indexed_model()
+        if indexed_model is not None and indexed_model != self.embedding_model:
+            raise RuntimeError(f"向量索引由嵌入模型 {indexed_model} 构建，与当前的 {self.embedding_model} 不一致，"
+                               f"请先使用 --rebuild-index（或调用 RAGSearch.rebuild_index）重建索引")
+        self.flush_history()
+        queries = self._sample_queries(latency_queries)
+        report = {"before": dict(self.index_stats(), latency=self.measure_query_latency(queries)),
+                  "merged": 0, "removed": {}, "reembedded": 0}
+        for name in [DEFAULT_COLLECTION] + self.tenant_collections():
+            stats = self._maintain_collection(name, policy, merge_by_command, compact, batch_size)
+            report["merged"] += stats["merged"]
+            report["reembedded"] += stats["reembedded"]
+            for reason, count in stats["removed"].items():
+                report["removed"][reason] = report["removed"].get(reason, 0) + count
+        with contextlib.suppress(OSError):
+            os.rmdir(os.path.join(self.persist_directory, "maintenance"))
+        if compact:
+            self._reclaim_disk_space()
+        report["after"] = dict(self.index_stats(), latency=self.measure_query_latency(queries))
+        print(f"历史库维护完成: 合并 {report['merged']} 条，删除 {sum(report['removed'].values())} 条，"
+              f"重新嵌入 {report['reembedded']} 条")
+        return report
+
+    def _maintain_collection(self, collection_name: str, policy: Optional[RetentionPolicy], merge_by_command: bool,
+                             compact: bool, batch_size: int) -> Dict[str, Any]:
+        """维护一个集合，返回合并、删除和重新嵌入的记录数"""
+        snapshot_path = os.path.join(self.persist_directory, "maintenance", collection_name)
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        vectordb = self._collection(collection_name)
+        writer = SnapshotWriter(snapshot_path, vectordb._collection.count(), {
+            "backend": self.embedding_backend, "embedding_model": self.embedding_model
+        })
+        records = self._export_collection(collection_name, writer, batch_size)
+        writer.close()
+
+        history = [record for record in records if record["metadata"].get("type") == HISTORY_FILTER["type"]]
+        others = [record for record in records if record["metadata"].get("type") != HISTORY_FILTER["type"]]
+        kept, merged = merge_duplicates(history, by_command=merge_by_command)
+        removed: Dict[str, int] = {}
+        if policy is not None:
+            kept, removed = policy.apply(kept)
+        stats = {"merged": merged, "removed": removed, "reembedded": 0}
+        kept_ids = {record["id"] for record in kept}
+        stale = [record["id"] for record in history if record["id"] not in kept_ids]
+        if not compact and not stale and not merged:
+            shutil.rmtree(snapshot_path, ignore_errors=True)
+            return stats
+
+        # 重新嵌入在删除任何记录之前完成，嵌入失败时集合保持不变
+        reembed = [record for record in kept if record["row"] is None]
+        vectors: Dict[str, List[float]] = {}
+        for start in range(0, len(reembed), batch_size):
+            batch = reembed[start:start + batch_size]
+            vectors.update(zip([record["id"] for record in batch],
+                               self.embeddings.embed_documents([record["document"] for record in batch])))
+        stats["reembedded"] = len(reembed)
+
+        embeddings = np.load(os.path.join(snapshot_path, SNAPSHOT_EMBEDDINGS), mmap_mode="r")
+        if compact:
+            vectordb.delete_collection()
+            with self._store_lock:
+                vectordb = self._open_vectordb(collection_name)
+                if collection_name == DEFAULT_COLLECTION:
+                    self._vectordb = vectordb
+                else:
+                    self._collections[collection_name] = vectordb
+            to_write = others + kept
+        else:
+            if stale:
+                for start in range(0, len(stale), batch_size):
+                    vectordb._collection.delete(ids=stale[start:start + batch_size])
+            to_write = [record for record in kept if record.get("changed")]
+        for start in range(0, len(to_write), batch_size):
+            batch = to_write[start:start + batch_size]
+            vectordb._collection.upsert(
+                ids=[record["id"] for record in batch],
+                embeddings=np.asarray([vectors[record["id"]] if record["row"] is None else embeddings[record["row"]]
+                                       for record in batch], dtype=np.float32),
+                documents=[record["document"] for record in batch],
+                metadatas=[record["metadata"] or None for record in batch]
             )
+        del embeddings
+
+        lexical_index = self._lexical(collection_name)
+        lexical_index.clear()
+        lexical_index.add_many([self._lexical_entry(record["id"], record["metadata"]) for record in kept])
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        return stats
+
+    def _reclaim_disk_space(self):
+        """删除Chroma删除集合后遗留的段目录，并回收SQLite数据库中的空闲页
+
+        Chroma的 delete_collection 只删除系统库中的记录，不删除集合的段目录。先关闭Chroma客户端，
+        在排他锁下读取系统库中的段列表，只有每个集合都有段记录时才删除不在列表中的段目录，再执行VACUUM；
+        数据库仍被占用或段列表不完整时不做任何删除。之后的访问会重新打开客户端。
+        """
+        self._close_store()
+        db_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        if not os.path.exists(db_path):
+            return
+        try:
+            connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+            try:
+                connection.execute("BEGIN EXCLUSIVE")
+                segments = {row[0] for row in connection.execute("SELECT id FROM segments")}
+                orphaned_collections = connection.execute(
+                    "SELECT COUNT(*) FROM collections WHERE id NOT IN (SELECT collection FROM segments)"
+                ).fetchone()[0]
+                if orphaned_collections == 0:
+                    for name in os.listdir(self.persist_directory):
+                        path = os.path.join(self.persist_directory, name)
+                        if _SEGMENT_DIR_RE.fullmatch(name) and os.path.isdir(path) and name not in segments:
+                            shutil.rmtree(path, ignore_errors=True)
+                connection.execute("ROLLBACK")
+                connection.execute("VACUUM")
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            print(f"回收向量数据库磁盘空间失败: {str(e)}")
 
     def add_documents(self, documents: List[str], metadatas: Optional[List[Dict[str, Any]]] = None):
         """添加文档到向量数据库
@@ -58,40 +673,250 @@ class RAGSearch:
         self.vectordb.add_documents(chunks)
         print(f"已添加 {len(chunks)} 个文档块到向量数据库")
 
-    def add_shell_command_history(self, user_input: str, command: str, result: str, success: bool):
+    def add_shell_command_history(self, user_input: str, command: str, result: str, success: bool,
+                                  tenant: Optional[str] = None):
         """添加Shell命令历史到向量数据库
 
+        启用写回队列时只写入本地日志并立即返回，实际的嵌入和插入由后台线程成批完成。
+
         Args:
             user_input: 用户输入
             command: 执行的命令
             result: 命令执行结果
             success: 命令是否成功执行
+            tenant: 租户，为None时使用当前请求上下文中的租户
         """
-        # 使用工具类创建文档
-        document, metadata = DocumentUtils.create_shell_history_document(user_input, command, result, success)
-        self.add_documents([document], [metadata])
+        record = {"user_input": user_input, "command": command, "result": result, "success": success,
+                  "timestamp": time.time(), "tenant": self.resolve_tenant(tenant)}
+        if self.history_writer is not None:
+            self.history_writer.submit(record)
+        else:
+            self._write_history_batch([record])
+
+    def _write_history_batch(self, records: List[Dict[str, Any]]):
+        """将一批命令历史记录写入向量数据库
+
+        历史记录不经过文本分割，每个(规范化请求, 命令)对应一条以稳定ID标识的记录；
+        重复的记录只更新元数据中的成功/失败次数和最近执行时间，不会插入新的副本。
+        按租户分组后，每个租户只做一次嵌入调用和一次upsert。
+        """
+        by_tenant: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for record in records:
+            by_tenant.setdefault(record.get("tenant"), []).append(record)
+        for tenant, tenant_records in by_tenant.items():
+            self._write_tenant_history(tenant, tenant_records)
+
+    def _write_tenant_history(self, tenant: Optional[str], records: List[Dict[str, Any]]):
+        """将同一租户的一批命令历史记录写入其集合"""
+        collection_name = self.collection_name(tenant)
+        vectordb, lexical_index = self._collection(collection_name), self._lexical(collection_name)
+        merged: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            doc_id = DocumentUtils.history_id(record["user_input"], record["command"])
+            # 使用工具类创建文档
+            document, metadata = DocumentUtils.create_compact_history_document(
+                record["user_input"], record["command"], record["result"], record["success"]
+            )
+            timestamp = record.get("timestamp", time.time())
+            entry = merged.setdefault(doc_id, {
+                "document": document,
+                "metadata": dict(metadata, success_count=0, failure_count=0, first_seen=timestamp)
+            })
+            entry["metadata"].update(metadata, last_seen=timestamp)
+            if tenant:
+                entry["metadata"]["tenant"] = tenant
+            entry["metadata"]["success_count" if record["success"] else "failure_count"] += 1
+
+        ids = list(merged)
+        existing = vectordb.get(ids=ids, include=["metadatas"])
+        for doc_id, old_metadata in zip(existing.get("ids", []), existing.get("metadatas", [])):
+            metadata = merged[doc_id]["metadata"]
+            old_metadata = old_metadata or {}
+            metadata["success_count"] += int(old_metadata.get("success_count", 0))
+            metadata["failure_count"] += int(old_metadata.get("failure_count", 0))
+            metadata["first_seen"] = old_metadata.get("first_seen", metadata["first_seen"])
+
+        vectordb.add_texts(
+            texts=[merged[doc_id]["document"] for doc_id in ids],
+            metadatas=[merged[doc_id]["metadata"] for doc_id in ids],
+            ids=ids
+        )
+        lexical_index.add_many([self._lexical_entry(doc_id, merged[doc_id]["metadata"]) for doc_id in ids])
+        print(f"已写入 {len(ids)} 条命令历史到向量数据库（新增 {len(ids) - len(existing.get('ids', []))} 条）")
+
+    def flush_history(self, timeout: Optional[float] = None) -> bool:
+        """等待写回队列中的命令历史全部写入向量数据库"""
+        if self.history_writer is None:
+            return True
+        return self.history_writer.flush(timeout=timeout)
+
+    def close(self):
+        """写完待写入的命令历史并释放资源"""
+        if self.history_writer is not None:
+            self.history_writer.close()
+        self._close_store()
+        if isinstance(self._embeddings, CachedEmbeddings):
+            self._embeddings.close()
+
+    async def aadd_shell_command_history(self, user_input: str, command: str, result: str, success: bool,
+                                         tenant: Optional[str] = None):
+        """add_shell_command_history 的异步版本，在线程池中执行以免阻塞事件循环"""
+        await asyncio.to_thread(self.add_shell_command_history, user_input, command, result, success, tenant)
+
+    def _embed_query(self, query: str) -> List[float]:
+        """嵌入查询文本，同一请求内对相同查询只调用一次嵌入模型"""
+        context = get_request_context()
+        if context is not None and query in context.query_embeddings:
+            return context.query_embeddings[query]
+
+        with span(self.embedding_model, "embedding"):
+            embedding = self.embeddings.embed_query(query)
+        if context is not None:
+            context.embedding_calls += 1
+            context.query_embeddings[query] = embedding
+        return embedding
+
+    @staticmethod
+    def _format_result(metadata: Dict[str, Any], content: str, score: Optional[float], **extra: Any) -> Dict[str, Any]:
+        """将元数据组装为相似命令结果"""
+        result = {
+            "user_input": metadata.get("user_input", ""),
+            "command": metadata.get("command", ""),
+            "success": metadata.get("success", False),
+            "content": content,
+            "success_count": metadata.get("success_count") or 1,
+            "last_seen": metadata.get("last_seen"),
+            "similarity_score": score
+        }
+        result.update(extra)
+        return result
 
-    def get_similar_commands(self, user_input: str, k: int = 3) -> List[Dict[str, Any]]:
+    def _vector_search(self, user_input: str, k: int, tenant: Optional[str]) -> List[Dict[str, Any]]:
+        """在租户的集合中做向量检索，similarity_score 为向量距离（越小越相似）"""
+        context = get_request_context()
+        vectordb = self._collection(self.collection_name(tenant))
+        embedding = self._embed_query(user_input)
+        with span("chroma", "vector_query", k=k):
+            results = vectordb.similarity_search_by_vector_with_relevance_scores(embedding, k=k,
+                                                                                 filter=HISTORY_FILTER)
+        if context is not None:
+            context.vector_queries += 1
+
+        return [self._format_result(doc.metadata, doc.page_content, score, id=doc.id) for doc, score in results]
+
+    def _lexical_search(self, user_input: str, k: int, tenant: Optional[str]) -> List[Dict[str, Any]]:
+        """在租户的BM25索引中做词法检索，不需要嵌入调用
+
+        规范化后与用户请求完全相同的记录视为距离0，其余结果没有向量距离。
+        """
+        normalized = DocumentUtils.normalize_user_input(user_input)
+        results = []
+        with span("bm25", "lexical_query", k=k):
+            hits = self._lexical(self.collection_name(tenant)).search(user_input, k=k)
+        for doc_id, score, payload in hits:
+            exact = DocumentUtils.normalize_user_input(payload.get("user_input") or "") == normalized
+            content = f"用户请求: {payload.get('user_input', '')}\n执行命令: {payload.get('command', '')}"
+            results.append(self._format_result(payload, content, 0.0 if exact else None,
+                                               id=doc_id, lexical_score=score))
+        return results
+
+    @staticmethod
+    def _fuse(vector_results: List[Dict[str, Any]], lexical_results: List[Dict[str, Any]],
+              k: int, rrf_k: int = 60) -> List[Dict[str, Any]]:
+        """用倒数排名融合（RRF）合并向量和词法检索结果
+
+        同一记录取两路中较小的距离，与请求完全相同的记录（距离0）总是排在最前面。
+        """
+        fused: Dict[str, Dict[str, Any]] = {}
+        for results in (vector_results, lexical_results):
+            for rank, item in enumerate(results):
+                entry = fused.setdefault(item["id"], dict(item, fusion_score=0.0))
+                entry["fusion_score"] += 1.0 / (rrf_k + rank + 1)
+                if item.get("lexical_score") is not None:
+                    entry["lexical_score"] = item["lexical_score"]
+                if item.get("similarity_score") is not None and (
+                        entry.get("similarity_score") is None or item["similarity_score"] < entry["similarity_score"]):
+                    entry["similarity_score"] = item["similarity_score"]
+        ranked = sorted(fused.values(), key=lambda item: (item["similarity_score"] == 0.0, item["fusion_score"]),
+                        reverse=True)
+        return ranked[:k]
+
+    def _score_requests(self, user_input: str, results: List[Dict[str, Any]], embed: bool):
+        """为检索结果补充 request_similarity：用户请求与记录中的请求（而不是整条历史文档）的余弦相似度
+
+        规范化后相同的请求相似度为1，不需要嵌入；embed 为False时其余结果的相似度为None，
+        否则把记录中的请求与查询一起嵌入（查询嵌入在请求内复用，远程后端的请求嵌入有本地缓存）。
+        """
+        normalized = DocumentUtils.normalize_user_input(user_input)
+        pending = []
+        for item in results:
+            exact = DocumentUtils.normalize_user_input(item.get("user_input") or "") == normalized
+            item["request_similarity"] = 1.0 if exact else None
+            if not exact and embed and item.get("user_input"):
+                pending.append(item)
+        if not pending:
+            return
+
+        query = np.asarray(self._embed_query(user_input), dtype=np.float32)
+        with span(self.embedding_model, "embedding"):
+            vectors = np.asarray(self.embeddings.embed_documents([item["user_input"] for item in pending]),
+                                 dtype=np.float32)
+        context = get_request_context()
+        if context is not None:
+            context.embedding_calls += 1
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        for item, dot, norm in zip(pending, vectors @ query, norms):
+            item["request_similarity"] = float(dot / norm) if norm > 0 else 0.0
+
+    def get_similar_commands(self, user_input: str, k: int = 3, mode: Optional[str] = None,
+                             tenant: Optional[str] = None) -> List[Dict[str, Any]]:
         """获取与用户输入相似的历史命令
 
+        hybrid 模式下同时进行BM25词法检索和向量检索并融合排名；若词法检索已找到
+        与请求完全相同的历史记录且结果足够k条，则直接返回，不再进行嵌入调用。
+        在请求上下文内，相同查询的检索结果会被复用，不会重复嵌入和查询向量数据库。
+        只检索该租户的命令历史，租户的历史不少于k条时总是返回k条结果。
+        每条结果的 request_similarity 为用户请求与记录中请求的相似度（见 _score_requests），
+        lexical 模式下只对规范化后相同的请求给出。
+
         Args:
             user_input: 用户输入
             k: 返回的结果数量
+            mode: 检索模式，默认使用构造时指定的模式
+            tenant: 租户，为None时使用当前请求上下文中的租户
 
         Returns:
-            List[Dict[str, Any]]: 相似命令列表
+            List[Dict[str, Any]]: 相似命令列表，similarity_score 为向量距离（无向量距离时为None），
+            request_similarity 为请求之间的相似度（未计算时为None）
         """
-        results = self.vectordb.similarity_search_with_score(user_input, k=k)
+        mode = mode or self.retrieval_mode
+        tenant = self.resolve_tenant(tenant)
+        context = get_request_context()
+        memo_key = (user_input, k, mode, tenant)
+        if context is not None and memo_key in context.search_results:
+            return list(context.search_results[memo_key])
 
-        similar_commands = []
-        for doc, score in results:
-            if doc.metadata.get("type") == "shell_history":
-                similar_commands.append({
-                    "user_input": doc.metadata.get("user_input", ""),
-                    "command": doc.metadata.get("command", ""),
-                    "success": doc.metadata.get("success", False),
-                    "content": doc.page_content,
-                    "similarity_score": score
-                })
+        if mode == "vector":
+            similar_commands = self._vector_search(user_input, k, tenant)
+        elif mode == "lexical":
+            similar_commands = self._lexical_search(user_input, k, tenant)
+        else:
+            lexical_results = self._lexical_search(user_input, 2 * k, tenant)
+            if len(lexical_results) >= k and lexical_results[0]["similarity_score"] == 0.0:
+                similar_commands = lexical_results[:k]
+            else:
+                similar_commands = self._fuse(self._vector_search(user_input, 2 * k, tenant), lexical_results, k)
+        self._score_requests(user_input, similar_commands, embed=mode != "lexical")
 
+        if context is not None:
+            context.search_results[memo_key] = list(similar_commands)
         return similar_commands
+
+    async def aget_similar_commands(self, user_input: str, k: int = 3, mode: Optional[str] = None,
+                                    tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """get_similar_commands 的异步版本
+
+        Chroma没有异步接口，因此在线程池中执行；asyncio.to_thread 会复制当前上下文，
+        请求上下文中的检索结果仍然在同一请求内共享。
+        """
+        return await asyncio.to_thread(self.get_similar_commands, user_input, k, mode, tenant)
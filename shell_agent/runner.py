@@ -0,0 +1,74 @@
+"""
+并发执行模块 - 在一个进程内以有界并发处理多个用户请求
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .agent import ShellAgent
+
+
+class ConcurrentRunner:
+    """有界并发执行器
+
+    所有请求共享同一个 ShellAgent（及其LLM、嵌入客户端和缓存），
+    每个请求在独立的asyncio任务和请求上下文中执行，互不干扰。
+    """
+
+    def __init__(self, agent: ShellAgent, concurrency: int = 8):
+        """初始化并发执行器
+
+        Args:
+            agent: 共享的Shell智能体实例
+            concurrency: 同时处理的最大请求数
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency 必须大于0")
+        self.agent = agent
+        self.concurrency = concurrency
+
+    async def iter_completed(self, user_inputs: Iterable[str],
+                             request_kwargs: Optional[Sequence[Dict[str, Any]]] = None,
+                             **kwargs: Any) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """并发处理请求，按完成顺序产出结果
+
+        Args:
+            user_inputs: 用户输入序列
+            request_kwargs: 与 user_inputs 一一对应的单个请求参数（如租户），覆盖 kwargs 中的同名参数
+            **kwargs: 透传给 ShellAgent.aprocess_input 的参数
+
+        Yields:
+            Tuple[int, Dict[str, Any]]: (请求在输入序列中的下标, 处理结果)，
+            结果的 timings.total_ms 为请求获得并发名额后的处理耗时
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(index: int, user_input: str) -> Tuple[int, Dict[str, Any]]:
+            async with semaphore:
+                started = time.perf_counter()
+                call_kwargs = dict(kwargs, **request_kwargs[index]) if request_kwargs is not None else kwargs
+                result = await self.agent.aprocess_input(user_input, **call_kwargs)
+                result.setdefault("timings", {}).setdefault(
+                    "total_ms", round((time.perf_counter() - started) * 1000, 3)
+                )
+                return index, result
+
+        tasks = [asyncio.create_task(run_one(i, text)) for i, text in enumerate(user_inputs)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, user_inputs: Iterable[str], **kwargs: Any) -> List[Dict[str, Any]]:
+        """并发处理请求，按输入顺序返回结果"""
+        user_inputs = list(user_inputs)
+        results: List[Dict[str, Any]] = [{}] * len(user_inputs)
+        async for index, result in self.iter_completed(user_inputs, **kwargs):
+            results[index] = result
+        return results
+
+    def run_sync(self, user_inputs: Iterable[str], **kwargs: Any) -> List[Dict[str, Any]]:
+        """在新的事件循环中运行 run，供同步代码调用"""
+        return asyncio.run(self.run(user_inputs, **kwargs))
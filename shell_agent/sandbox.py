@@ -0,0 +1,118 @@
+"""
+沙箱模块 - 为命令子进程设置资源上限，并在独立进程组中运行以便整体终止
+"""
+import os
+import signal
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ResourceLimits:
+    """子进程资源上限
+
+    CPU时间、地址空间、文件大小和打开文件数由bash的 ulimit 在执行命令之前设置（而不是用 Popen 的
+    preexec_fn：父进程有多个线程时 fork 之后执行Python代码可能死锁），对命令派生的每个进程分别生效；
+    输出字节数由执行器在读取输出时统计，超出后终止整个进程组。
+    """
+
+    def __init__(self, cpu_seconds: Optional[int] = 30, memory_bytes: Optional[int] = 1024 * 1024 * 1024,
+                 file_size_bytes: Optional[int] = 100 * 1024 * 1024, open_files: Optional[int] = 256,
+                 output_bytes: Optional[int] = 16 * 1024 * 1024):
+        """初始化资源上限，各项为None时不限制
+
+        Args:
+            cpu_seconds: 每个进程的CPU时间上限（秒），超出时进程收到 SIGXCPU/SIGKILL
+            memory_bytes: 每个进程的地址空间上限（字节）
+            file_size_bytes: 可写入的单个文件大小上限（字节）
+            open_files: 每个进程可同时打开的文件数上限
+            output_bytes: stdout和stderr合计的输出字节数上限
+        """
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.file_size_bytes = file_size_bytes
+        self.open_files = open_files
+        self.output_bytes = output_bytes
+
+    @staticmethod
+    def supported() -> bool:
+        """当前平台是否支持资源上限和进程组"""
+        return resource is not None and hasattr(os, "killpg")
+
+    def ulimit_commands(self) -> List[str]:
+        """设置资源上限的 ulimit 语句；bash的 ulimit 同时设置软硬上限，-v 和 -f 以KB为单位"""
+        commands = []
+        for option, limit, value, unit in (("-t", resource.RLIMIT_CPU, self.cpu_seconds, 1),
+                                           ("-v", resource.RLIMIT_AS, self.memory_bytes, 1024),
+                                           ("-f", resource.RLIMIT_FSIZE, self.file_size_bytes, 1024),
+                                           ("-n", resource.RLIMIT_NOFILE, self.open_files, 1)):
+            if value is None:
+                continue
+            _, hard = resource.getrlimit(limit)
+            # 不能超过已有的硬上限，子进程继承父进程的上限
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            commands.append(f"ulimit {option} {max(value // unit, 1)}")
+        return commands
+
+    def wrap_command(self, command: str) -> str:
+        """在命令之前设置资源上限，任一上限设置失败时不执行命令（退出码126）"""
+        commands = self.ulimit_commands()
+        if not commands:
+            return command
+        return f"{' && '.join(commands)} || exit 126\n{command}"
+
+    def popen_kwargs(self) -> Dict[str, Any]:
+        """创建子进程时附加的参数：在新会话（独立进程组）中运行"""
+        return {"start_new_session": True}
+
+
+def kill_process_group(process: subprocess.Popen):
+    """终止子进程所在的整个进程组，子进程已退出时忽略"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def wait_with_rusage(process: subprocess.Popen, timeout: float) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """用 wait4 等待子进程退出并取得它（含已回收的子孙进程）的资源使用情况
+
+    直接回收子进程后把退出码写回 Popen 对象，使其不会再次调用 waitpid。
+
+    Returns:
+        Optional[Tuple[int, Dict[str, Any]]]: (退出码, 资源使用情况)，超时返回None
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            break
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+    returncode = os.waitstatus_to_exitcode(status)
+    process.returncode = returncode
+    return returncode, {
+        "user_cpu_s": round(usage.ru_utime, 6),
+        "system_cpu_s": round(usage.ru_stime, 6),
+        # Linux上 ru_maxrss 的单位是KB，macOS上是字节
+        "max_rss_kb": usage.ru_maxrss // 1024 if os.uname().sysname == "Darwin" else usage.ru_maxrss,
+        "exit_code": returncode,
+        "signal": _signal_name(-returncode) if returncode < 0 else None
+    }
+
+
+def _signal_name(signum: int) -> str:
+    try:
+        return signal.Signals(signum).name
+    except ValueError:
+        return str(signum)
@@ -1,41 +1,242 @@
 """
 Shell命令执行模块 - 负责执行生成的shell命令并处理结果
 """
+import asyncio
+import codecs
+import locale
+import os
+import queue
 import subprocess
-from typing import Tuple
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, Optional, Tuple, Union
+from .command_guard import CommandGuard
+from .context import emit_event, get_request_context
+from .events import EVENT_COMMAND, EVENT_OUTPUT
+from .sandbox import ResourceLimits, kill_process_group, wait_with_rusage
+from .tracing import Span, child_cpu_seconds, span, start_span
 from .utils import PlatformUtils
 
+if TYPE_CHECKING:
+    from .shell_pool import ShellPool
+
+# 流式输出回调: (流名称 "stdout"/"stderr", 文本块)
+OutputCallback = Callable[[str, str], None]
+
+
+class BoundedOutput:
+    """有界输出缓冲区，只保留输出的开头和结尾，并统计被丢弃的字节数"""
+
+    def __init__(self, max_bytes: int):
+        """初始化缓冲区
+
+        Args:
+            max_bytes: 保留的最大字节数，开头和结尾各占一半
+        """
+        self.head_budget = max_bytes // 2
+        self.tail_budget = max_bytes - self.head_budget
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.dropped_bytes = 0
+
+    def write(self, data: bytes):
+        """追加数据，超出预算的中间部分被丢弃"""
+        self.total_bytes += len(data)
+        if len(self.head) < self.head_budget:
+            take = self.head_budget - len(self.head)
+            self.head += data[:take]
+            data = data[take:]
+        if not data:
+            return
+        self.tail += data
+        overflow = len(self.tail) - self.tail_budget
+        if overflow > 0:
+            del self.tail[:overflow]
+            self.dropped_bytes += overflow
+
+    def getvalue(self, encoding: str) -> str:
+        """返回保留的内容，若有数据被丢弃则在中间插入截断提示
+
+        没有丢弃数据时开头和结尾是连续的，合在一起解码；否则截断点可能落在多字节字符中间，
+        开头末尾不完整的字符和结尾开头不完整的字符都不输出，计入省略的字节数。
+        """
+        if not self.dropped_bytes:
+            return bytes(self.head + self.tail).decode(encoding, errors="replace")
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        head = decoder.decode(bytes(self.head))
+        head_partial = len(decoder.getstate()[0])
+        tail_skip, tail = self._decode_tail(encoding)
+        dropped = self.dropped_bytes + head_partial + tail_skip
+        return f"{head}\n... (输出已截断，省略 {dropped} 字节) ...\n{tail}"
+
+    def _decode_tail(self, encoding: str) -> Tuple[int, str]:
+        """解码结尾部分，跳过开头最多3个属于被截断字符的字节
+
+        Returns:
+            Tuple[int, str]: (跳过的字节数, 解码后的文本)
+        """
+        for skip in range(min(4, len(self.tail))):
+            try:
+                return skip, self.tail[skip:].decode(encoding)
+            except UnicodeDecodeError:
+                continue
+        return 0, self.tail.decode(encoding, errors="replace")
+
+
 class ShellExecutor:
     """执行shell命令并处理结果的类"""
 
-    def __init__(self, timeout: int = 30):
+    def __init__(self, timeout: int = 30, stream_output: bool = False, max_output_bytes: int = 64 * 1024,
+                 output_callback: Optional[OutputCallback] = None, guard: Optional[CommandGuard] = None,
+                 resource_limits: Optional[ResourceLimits] = None, shell_pool: Optional["ShellPool"] = None):
         """初始化Shell执行器
-        
+
         Args:
             timeout: 命令执行超时时间（秒）
+            stream_output: 是否以流式方式读取输出，内存占用不随输出大小增长
+            max_output_bytes: 流式模式下每个输出流保留的最大字节数
+            output_callback: 流式模式下每收到一个输出块时调用的回调
+            guard: 执行前的命令安全检查器，为None时不做检查
+            resource_limits: 沙箱资源上限；设置后命令在独立进程组中运行，超时或输出超限时终止整个进程组，
+                并用 wait4 记录每条命令的资源使用情况。为None或平台不支持时不启用沙箱
+            shell_pool: 常驻Shell进程池，设置后命令由池中的bash进程执行而不是每次创建子进程，
+                请求上下文中的 session_id 决定使用哪个会话的shell。不能与 resource_limits 同时使用
         """
         self.shell_cmd = PlatformUtils.get_shell_command()
         self.timeout = timeout
+        self.stream_output = stream_output
+        self.max_output_bytes = max_output_bytes
+        self.output_callback = output_callback
+        self.encoding = locale.getpreferredencoding(False)
+        self.guard = guard
+        if resource_limits is not None and not ResourceLimits.supported():
+            print("当前平台不支持资源上限和进程组，沙箱模式未启用")
+            resource_limits = None
+        self.resource_limits = resource_limits
+        # 命令总是在独立进程组中运行，超时时连同bash派生的子孙进程一起终止
+        self.process_group = hasattr(os, "killpg") and not PlatformUtils.is_windows()
+        if shell_pool is not None and resource_limits is not None:
+            raise ValueError("Shell进程池不能与沙箱资源上限同时使用")
+        if shell_pool is not None and PlatformUtils.is_windows():
+            print("Windows平台不支持Shell进程池，已禁用")
+            shell_pool = None
+        self.shell_pool = shell_pool
 
-    def _create_subprocess(self, command: str) -> subprocess.Popen:
-        """创建子进程执行命令"""
+    def close(self):
+        """关闭Shell进程池"""
+        if self.shell_pool is not None:
+            self.shell_pool.close()
+
+    def _create_subprocess(self, command: str, text: bool = True) -> subprocess.Popen:
+        """创建子进程执行命令
+
+        shell_cmd 已经包含了shell本身（bash -c / powershell -Command），
+        因此不再通过 shell=True 额外包一层系统shell。与Shell进程池一样，命令的stdin为 /dev/null，
+        读取标准输入的命令立即读到EOF，而不是等待到超时。
+        """
+        if self.resource_limits is not None:
+            command = self.resource_limits.wrap_command(command)
         return subprocess.Popen(
             self.shell_cmd + [command],
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-            shell=True
+            text=text,
+            **self._popen_kwargs()
         )
 
+    def _popen_kwargs(self) -> Dict[str, Any]:
+        """创建子进程的附加参数：支持进程组时（沙箱模式下总是）在新会话中运行"""
+        if self.resource_limits is not None:
+            return self.resource_limits.popen_kwargs()
+        return {"start_new_session": True} if self.process_group else {}
+
+    def _kill(self, process: Union[subprocess.Popen, asyncio.subprocess.Process]):
+        """终止子进程；支持进程组时终止整个进程组，包括命令派生的子孙进程"""
+        if self.process_group:
+            kill_process_group(process)
+        else:
+            process.kill()
+
+    @staticmethod
+    def _finish_subprocess_span(node: Optional[Span], cpu_before: float, result: Optional[Tuple[bool, str]],
+                                usage: Optional[Dict[str, Any]] = None):
+        """结束子进程span，记录成功与否和子进程CPU时间
+
+        沙箱模式下CPU时间取自该命令 wait4 的结果；否则取自 RUSAGE_CHILDREN 的差值，
+        多个命令并发执行时只是近似值。
+        """
+        if node is None:
+            return
+        if usage and "user_cpu_s" in usage:
+            cpu_ms = round((usage["user_cpu_s"] + usage["system_cpu_s"]) * 1000, 3)
+        else:
+            cpu_ms = round((child_cpu_seconds() - cpu_before) * 1000, 3)
+        extra = {key: usage[key] for key in ("max_rss_kb", "killed") if usage and usage.get(key)}
+        node.finish(success=result[0] if result is not None else False, cpu_ms=cpu_ms, **extra)
+
+    def _request_output_callback(self) -> Optional[OutputCallback]:
+        """组合构造时的输出回调和当前请求的流式事件，两者都没有时返回None"""
+        context = get_request_context()
+        if context is None or context.event_callback is None:
+            return self.output_callback
+
+        def callback(stream_name: str, text: str):
+            if self.output_callback is not None:
+                self.output_callback(stream_name, text)
+            context.emit(EVENT_OUTPUT, stream=stream_name, text=text)
+        return callback
+
+    def _check_command(self, command: str) -> Tuple[str, Optional[Tuple[bool, str]]]:
+        """启动子进程前做安全检查
+
+        Returns:
+            Tuple[str, Optional[Tuple[bool, str]]]: (实际要执行的命令, 不执行时直接返回的结果)
+        """
+        if self.guard is None:
+            return command, None
+        with span("command_guard", "guard") as node:
+            assessment = self.guard.assess(command)
+            if node is not None:
+                node.attributes.update(action=assessment.action, risks=",".join(assessment.risks))
+        if assessment.command_to_run is None:
+            return command, (False, assessment.describe())
+        return assessment.command_to_run, None
+
     def execute_command(self, command: str) -> Tuple[bool, str]:
         """执行shell命令并返回结果
 
+        配置了安全检查器时，被拒绝或转为演练的命令不会启动子进程，直接返回说明；
+        输出无界的命令会被改写后执行。
+        当前请求有流式事件接收方时，即使未启用 stream_output 也以流式方式读取输出，
+        并依次产出 command 和 output 事件。
+
         Args:
             command: 要执行的shell命令
 
         Returns:
             Tuple[bool, str]: (是否成功, 输出结果或错误信息)
         """
+        command, blocked = self._check_command(command)
+        if blocked is not None:
+            return blocked
+        emit_event(EVENT_COMMAND, command=command)
+        callback = self._request_output_callback()
+        if self.shell_pool is not None:
+            return self._execute_pooled(command, callback)
+        if self.stream_output or self.resource_limits is not None or callback is not self.output_callback:
+            return self.execute_command_streaming(command, on_chunk=callback)
+
+        node, cpu_before, result = start_span("subprocess", "subprocess", command=command), child_cpu_seconds(), None
+        try:
+            result = self._execute_command(command)
+            return result
+        finally:
+            self._finish_subprocess_span(node, cpu_before, result)
+
+    def _execute_command(self, command: str) -> Tuple[bool, str]:
+        """以 communicate 方式执行命令"""
         try:
             # 创建并执行子进程
             process = self._create_subprocess(command)
@@ -45,7 +246,266 @@ class ShellExecutor:
             return process.returncode == 0, stdout if process.returncode == 0 else stderr
 
         except subprocess.TimeoutExpired:
-            process.kill()
+            self._kill(process)
+            process.wait()
+            process.stdout.close()
+            process.stderr.close()
+            return False, f"命令执行超时 ({self.timeout}秒)"
+        except Exception as e:
+            return False, f"执行命令时出错: {str(e)}"
+
+    def _execute_pooled(self, command: str, callback: Optional[OutputCallback]) -> Tuple[bool, str]:
+        """在Shell进程池中执行命令"""
+        context = get_request_context()
+        session_id = context.session_id if context is not None else None
+        node = start_span("subprocess", "subprocess", command=command, pooled=True, session=session_id)
+        result = None
+        try:
+            result = self._drain(self.shell_pool.stream(command, self.timeout, session_id, self.max_output_bytes),
+                                 callback)
+            return result
+        finally:
+            if node is not None:
+                node.finish(success=result[0] if result is not None else False)
+
+    @staticmethod
+    def _drain(stream: Generator[Tuple[str, str], None, Tuple[bool, str]],
+               callback: Optional[OutputCallback]) -> Tuple[bool, str]:
+        """消费输出生成器，逐块调用回调，返回生成器的最终结果"""
+        while True:
+            try:
+                stream_name, text = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            if callback is not None:
+                callback(stream_name, text)
+
+    def execute_command_streaming(self, command: str,
+                                  on_chunk: Optional[OutputCallback] = None) -> Tuple[bool, str]:
+        """以流式方式执行shell命令，每收到一个输出块就调用回调
+
+        Args:
+            command: 要执行的shell命令
+            on_chunk: 输出块回调，默认使用构造时传入的 output_callback
+
+        Returns:
+            Tuple[bool, str]: (是否成功, 截断后的输出结果或错误信息)
+        """
+        return self._drain(self.stream_command(command), on_chunk or self.output_callback)
+
+    @staticmethod
+    def _pump(pipe, stream_name: str, chunks: "queue.Queue[Tuple[str, Optional[bytes]]]"):
+        """在后台线程中逐块读取管道，读到EOF时关闭管道并放入None"""
+        try:
+            while True:
+                data = pipe.read1(8192)
+                if not data:
+                    break
+                chunks.put((stream_name, data))
+        except (OSError, ValueError):
+            pass
+        finally:
+            # 读到EOF后由读取线程关闭管道，避免在读取过程中从其他线程关闭
+            pipe.close()
+            chunks.put((stream_name, None))
+
+    def stream_command(self, command: str) -> Generator[Tuple[str, str], None, Tuple[bool, str]]:
+        """执行命令并逐块产出输出
+
+        同时增量读取stdout和stderr，每个流只在内存中保留开头和结尾各一半的
+        max_output_bytes，超出部分只计数不保存。
+
+        Yields:
+            Tuple[str, str]: (流名称 "stdout"/"stderr", 文本块)
+
+        Returns:
+            Tuple[bool, str]: (是否成功, 输出结果或错误信息)，通过 StopIteration.value 返回
+        """
+        node, cpu_before, result = start_span("subprocess", "subprocess", command=command), child_cpu_seconds(), None
+        usage: Dict[str, Any] = {}
+        try:
+            result = yield from self._stream_command(command, usage)
+            return result
+        finally:
+            self._finish_subprocess_span(node, cpu_before, result, usage)
+            if self.resource_limits is not None:
+                context = get_request_context()
+                if context is not None:
+                    context.resource_usage.append({"command": command, **usage})
+
+    def _wait(self, process: subprocess.Popen, timeout: float, usage: Dict[str, Any]) -> int:
+        """等待子进程退出；沙箱模式下用 wait4 回收并记录资源使用情况
+
+        Raises:
+            subprocess.TimeoutExpired: 超时
+        """
+        if self.resource_limits is None:
+            return process.wait(timeout=timeout)
+        waited = wait_with_rusage(process, timeout)
+        if waited is None:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        returncode, rusage = waited
+        usage.update(rusage)
+        return returncode
+
+    def _terminate(self, process: subprocess.Popen, usage: Dict[str, Any], reason: str):
+        """终止子进程（沙箱模式下为整个进程组）并记录原因，沙箱模式下回收子进程以取得资源使用情况"""
+        self._kill(process)
+        usage["killed"] = reason
+        if self.resource_limits is not None and process.returncode is None:
+            try:
+                self._wait(process, 1.0, usage)
+            except subprocess.TimeoutExpired:
+                pass
+
+    def _stream_command(self, command: str,
+                        usage: Dict[str, Any]) -> Generator[Tuple[str, str], None, Tuple[bool, str]]:
+        """stream_command 的实际实现，资源使用情况写入 usage"""
+        try:
+            process = self._create_subprocess(command, text=False)
+        except Exception as e:
+            return False, f"执行命令时出错: {str(e)}"
+
+        buffers: Dict[str, BoundedOutput] = {
+            "stdout": BoundedOutput(self.max_output_bytes),
+            "stderr": BoundedOutput(self.max_output_bytes)
+        }
+        decoders = {name: codecs.getincrementaldecoder(self.encoding)(errors="replace") for name in buffers}
+        chunks: "queue.Queue[Tuple[str, Optional[bytes]]]" = queue.Queue()
+        for stream_name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+            threading.Thread(target=self._pump, args=(pipe, stream_name, chunks), daemon=True).start()
+
+        deadline = time.monotonic() + self.timeout
+        start = time.monotonic()
+        open_streams = len(buffers)
+        output_limit = self.resource_limits.output_bytes if self.resource_limits is not None else None
+        try:
+            while open_streams:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(command, self.timeout)
+                try:
+                    stream_name, data = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    raise subprocess.TimeoutExpired(command, self.timeout)
+                if data is None:
+                    open_streams -= 1
+                    tail = decoders[stream_name].decode(b"", final=True)
+                    if tail:
+                        yield stream_name, tail
+                    continue
+                buffers[stream_name].write(data)
+                text = decoders[stream_name].decode(data)
+                if text:
+                    yield stream_name, text
+                total_bytes = buffers["stdout"].total_bytes + buffers["stderr"].total_bytes
+                if output_limit is not None and total_bytes > output_limit:
+                    self._terminate(process, usage, "output_limit")
+                    output = buffers["stdout"].getvalue(self.encoding)
+                    return False, f"{output}\n... (输出超过上限 {output_limit} 字节，命令已被终止)"
+
+            returncode = self._wait(process, max(deadline - time.monotonic(), 0), usage)
+        except subprocess.TimeoutExpired:
+            self._terminate(process, usage, "timeout")
+            return False, f"命令执行超时 ({self.timeout}秒)"
+        finally:
+            if process.poll() is None:
+                self._kill(process)
+            elif self.resource_limits is not None:
+                # 命令已退出，清理仍在后台运行的子孙进程
+                kill_process_group(process)
+            usage["output_bytes"] = buffers["stdout"].total_bytes + buffers["stderr"].total_bytes
+            usage["wall_ms"] = round((time.monotonic() - start) * 1000, 3)
+
+        output = (buffers["stdout"] if returncode == 0 else buffers["stderr"]).getvalue(self.encoding)
+        if returncode < 0 and not output:
+            # 被信号终止（如超出CPU时间上限）时没有错误输出
+            output = f"命令被信号 {usage.get('signal') or -returncode} 终止"
+        return returncode == 0, output
+
+    async def _acreate_subprocess(self, command: str) -> asyncio.subprocess.Process:
+        """创建asyncio子进程执行命令，沙箱模式不经过这里"""
+        return await asyncio.create_subprocess_exec(
+            *self.shell_cmd, command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **self._popen_kwargs()
+        )
+
+    async def _aread_stream(self, reader: asyncio.StreamReader, stream_name: str, buffer: BoundedOutput,
+                            callback: Optional[OutputCallback]):
+        """逐块读取asyncio管道到有界缓冲区，并调用输出回调"""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        while True:
+            data = await reader.read(8192)
+            if not data:
+                break
+            buffer.write(data)
+            text = decoder.decode(data)
+            if text and callback is not None:
+                callback(stream_name, text)
+        text = decoder.decode(b"", final=True)
+        if text and callback is not None:
+            callback(stream_name, text)
+
+    async def aexecute_command(self, command: str) -> Tuple[bool, str]:
+        """execute_command 的异步版本，使用asyncio子进程，等待期间不阻塞事件循环
+
+        Args:
+            command: 要执行的shell命令
+
+        Returns:
+            Tuple[bool, str]: (是否成功, 输出结果或错误信息)
+        """
+        command, blocked = self._check_command(command)
+        if blocked is not None:
+            return blocked
+        emit_event(EVENT_COMMAND, command=command)
+        if self.shell_pool is not None:
+            return await asyncio.to_thread(self._execute_pooled, command, self._request_output_callback())
+        if self.resource_limits is not None:
+            # wait4 需要由执行器自己回收子进程，不能交给asyncio的子进程监视器，因此在线程池中执行
+            return await asyncio.to_thread(self.execute_command_streaming, command,
+                                           self._request_output_callback())
+        node, cpu_before, result = start_span("subprocess", "subprocess", command=command), child_cpu_seconds(), None
+        try:
+            result = await self._aexecute_command(command)
+            return result
+        finally:
+            self._finish_subprocess_span(node, cpu_before, result)
+
+    async def _aexecute_command(self, command: str) -> Tuple[bool, str]:
+        """aexecute_command 的实际实现"""
+        callback = self._request_output_callback()
+        try:
+            process = await self._acreate_subprocess(command)
+        except Exception as e:
+            return False, f"执行命令时出错: {str(e)}"
+
+        try:
+            if self.stream_output or callback is not self.output_callback:
+                buffers = {
+                    "stdout": BoundedOutput(self.max_output_bytes),
+                    "stderr": BoundedOutput(self.max_output_bytes)
+                }
+                await asyncio.wait_for(asyncio.gather(
+                    self._aread_stream(process.stdout, "stdout", buffers["stdout"], callback),
+                    self._aread_stream(process.stderr, "stderr", buffers["stderr"], callback),
+                    process.wait()
+                ), timeout=self.timeout)
+                output = buffers["stdout"] if process.returncode == 0 else buffers["stderr"]
+                return process.returncode == 0, output.getvalue(self.encoding)
+
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+            output = stdout if process.returncode == 0 else stderr
+            return process.returncode == 0, output.decode(self.encoding, errors="replace")
+
+        except asyncio.TimeoutError:
             return False, f"命令执行超时 ({self.timeout}秒)"
         except Exception as e:
-            return False, f"执行命令时出错: {str(e)}"
\ No newline at end of file
+            return False, f"执行命令时出错: {str(e)}"
+        finally:
+            if process.returncode is None:
+                self._kill(process)
+                await process.wait()
@@ -0,0 +1,380 @@
+"""
+Shell进程池模块 - 复用常驻的bash进程执行命令，避免每条命令重新创建子进程
+"""
+import codecs
+import locale
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Generator, List, Optional, Tuple
+
+from .shell_executor import BoundedOutput, ShellExecutor
+
+
+class ShellWorker:
+    """常驻的bash进程
+
+    命令以 ``eval '<命令>'`` 的形式写入stdin，执行完后在stdout和stderr上各输出一行
+    带随机标记的分隔符（stdout的分隔符后附退出码），读取方据此切分每条命令的输出。
+    命令的stdin重定向为 /dev/null，不会读走后续的命令。
+    """
+
+    def __init__(self, shell: str = "bash"):
+        """启动worker进程
+
+        Args:
+            shell: shell程序，需兼容bash语法
+        """
+        self.sentinel = f"__SHELL_AGENT_{uuid.uuid4().hex}__"
+        self.process = subprocess.Popen(
+            [shell, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
+        )
+        self.encoding = locale.getpreferredencoding(False)
+        self.commands_run = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self._dead = False
+        self._chunks: "queue.Queue[Tuple[str, Optional[bytes]]]" = queue.Queue()
+        for stream_name, pipe in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            threading.Thread(target=ShellExecutor._pump, args=(pipe, stream_name, self._chunks),
+                             daemon=True).start()
+
+    @property
+    def alive(self) -> bool:
+        """worker进程是否仍可用"""
+        return not self._dead and self.process.poll() is None
+
+    def kill(self):
+        """终止worker所在的整个进程组，包括命令派生的后台进程"""
+        self._dead = True
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def close(self):
+        """正常退出worker，超时未退出时强制终止"""
+        if self.alive:
+            try:
+                self.process.stdin.write(b"exit\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self.kill()
+
+    def _script(self, command: str, isolate: bool) -> bytes:
+        """生成写入worker的脚本；isolate为True时在子shell中执行，不保留cd、变量等状态"""
+        body = f"eval {shlex.quote(command)} < /dev/null"
+        if isolate:
+            body = f"( {body} )"
+        return (f"{body}\n"
+                f"printf '\\n%s:%d\\n' {self.sentinel} $?\n"
+                f"printf '\\n%s\\n' {self.sentinel} >&2\n").encode(self.encoding, errors="replace")
+
+    def stream(self, command: str, timeout: float, isolate: bool = False,
+               max_output_bytes: int = 64 * 1024) -> Generator[Tuple[str, str], None, Tuple[bool, str]]:
+        """执行命令并逐块产出输出，语义与 ShellExecutor.stream_command 相同
+
+        超时时终止整个worker进程组，worker随后被进程池替换；输出未读完就被放弃（生成器被提前关闭
+        或读取方出错）时同样终止worker，否则剩余的输出和分隔符会被当作下一条命令的输出。
+
+        Yields:
+            Tuple[str, str]: (流名称 "stdout"/"stderr", 文本块)
+
+        Returns:
+            Tuple[bool, str]: (是否成功, 输出结果或错误信息)，通过 StopIteration.value 返回
+        """
+        self.commands_run += 1
+        try:
+            self.process.stdin.write(self._script(command, isolate))
+            self.process.stdin.flush()
+        except OSError as e:
+            self._dead = True
+            return False, f"执行命令时出错: {str(e)}"
+
+        marker = ("\n" + self.sentinel).encode("ascii")
+        buffers = {"stdout": BoundedOutput(max_output_bytes), "stderr": BoundedOutput(max_output_bytes)}
+        decoders = {name: codecs.getincrementaldecoder(self.encoding)(errors="replace") for name in buffers}
+        pending = {name: b"" for name in buffers}
+        done = {name: False for name in buffers}
+        returncode: Optional[int] = None
+        deadline = time.monotonic() + timeout
+        finished = False
+
+        def emit(stream_name: str, data: bytes):
+            buffers[stream_name].write(data)
+            return decoders[stream_name].decode(data)
+
+        try:
+            while not all(done.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                try:
+                    stream_name, data = self._chunks.get(timeout=remaining)
+                except queue.Empty:
+                    raise subprocess.TimeoutExpired(command, timeout)
+
+                if data is None:
+                    # worker已退出（如命令中执行了exit），剩余数据都属于这条命令
+                    self._dead = True
+                    for name in buffers:
+                        text = emit(name, pending[name]) + decoders[name].decode(b"", final=True)
+                        if text:
+                            yield name, text
+                    returncode = self.process.wait(timeout=max(deadline - time.monotonic(), 0))
+                    break
+
+                data = pending[stream_name] + data
+                index = data.find(marker)
+                if index == -1:
+                    # 保留末尾可能是分隔符开头的部分，等待后续数据
+                    cut = len(data) - _partial_suffix(data, marker)
+                    pending[stream_name] = data[cut:]
+                    text = emit(stream_name, data[:cut])
+                    if text:
+                        yield stream_name, text
+                    continue
+                if stream_name == "stdout":
+                    line_end = data.find(b"\n", index + len(marker))
+                    if line_end == -1:
+                        pending[stream_name] = data
+                        continue
+                    returncode = int(data[index + len(marker) + 1:line_end])
+                pending[stream_name] = b""
+                done[stream_name] = True
+                text = emit(stream_name, data[:index]) + decoders[stream_name].decode(b"", final=True)
+                if text:
+                    yield stream_name, text
+            finished = True
+        except subprocess.TimeoutExpired:
+            self.kill()
+            return False, f"命令执行超时 ({timeout}秒)"
+        finally:
+            self.last_used = time.monotonic()
+            if not finished and not self._dead:
+                self.kill()
+
+        output = buffers["stdout"] if returncode == 0 else buffers["stderr"]
+        return returncode == 0, output.getvalue(self.encoding)
+
+    def run(self, command: str, timeout: float, isolate: bool = False) -> Tuple[bool, str]:
+        """执行命令并返回 (是否成功, 输出结果或错误信息)"""
+        stream = self.stream(command, timeout, isolate)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as stop:
+                return stop.value
+
+    def ping(self, timeout: float = 1.0) -> bool:
+        """健康检查：执行空命令并确认能在超时内收到分隔符"""
+        if not self.alive:
+            return False
+        success, _ = self.run(":", timeout)
+        return success and self.alive
+
+
+def _partial_suffix(data: bytes, marker: bytes) -> int:
+    """返回 data 末尾与 marker 开头重合的最大长度"""
+    for length in range(min(len(data), len(marker) - 1), 0, -1):
+        if data.endswith(marker[:length]):
+            return length
+    return 0
+
+
+class ShellPool:
+    """常驻Shell进程池
+
+    - 未指定会话的命令由共享worker在子shell中执行，互不影响；
+    - 指定会话的命令固定由该会话专属的worker直接执行，cd、export等状态在同一会话的命令间保留；
+    - 取出空闲超过 health_check_interval 的worker前先做健康检查，共享worker执行 max_commands
+      条命令后回收，崩溃或超时被终止的worker在下次使用时重建（会话状态随之丢失）。
+    """
+
+    def __init__(self, size: int = 4, max_commands: int = 200, max_sessions: int = 32,
+                 health_check_interval: float = 30.0, shell: str = "bash"):
+        """初始化进程池，worker在首次使用时启动
+
+        Args:
+            size: 共享worker的最大数量
+            max_commands: 共享worker回收前最多执行的命令数
+            max_sessions: 最多保留的会话worker数，超出时关闭最久未使用的空闲会话
+            health_check_interval: 空闲超过该秒数的worker在使用前先做健康检查
+            shell: shell程序，需兼容bash语法
+        """
+        self.size = size
+        self.max_commands = max_commands
+        self.max_sessions = max_sessions
+        self.health_check_interval = health_check_interval
+        self.shell = shell
+        self._idle: List[ShellWorker] = []
+        self._shared_count = 0
+        self._sessions: "OrderedDict[str, ShellWorker]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.workers_started = 0
+        self.workers_recycled = 0
+
+    def _start_worker(self) -> ShellWorker:
+        self.workers_started += 1
+        return ShellWorker(self.shell)
+
+    def _healthy(self, worker: ShellWorker) -> bool:
+        """检查worker是否可用，空闲过久时执行一次健康检查"""
+        if not worker.alive:
+            return False
+        if time.monotonic() - worker.last_used > self.health_check_interval:
+            return worker.ping()
+        return True
+
+    def _acquire_shared(self) -> ShellWorker:
+        """取出一个共享worker，都在使用中且已达上限时等待"""
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Shell进程池已关闭")
+                if self._idle:
+                    worker = self._idle.pop()
+                    break
+                if self._shared_count < self.size:
+                    self._shared_count += 1
+                    worker = None
+                    break
+                self._condition.wait()
+        if worker is not None and self._healthy(worker):
+            return worker
+        if worker is not None:
+            worker.kill()
+            self.workers_recycled += 1
+        try:
+            return self._start_worker()
+        except Exception:
+            with self._condition:
+                self._shared_count -= 1
+                self._condition.notify()
+            raise
+
+    def _release_shared(self, worker: ShellWorker):
+        """归还共享worker，已失效或达到命令数上限时回收"""
+        with self._condition:
+            recycle = not worker.alive or worker.commands_run >= self.max_commands
+            keep = not recycle and not self._closed
+            if keep:
+                self._idle.append(worker)
+            else:
+                self._shared_count -= 1
+            self._condition.notify()
+        if not keep:
+            if recycle:
+                self.workers_recycled += 1
+            worker.close()
+
+    def _session_worker(self, session_id: str) -> ShellWorker:
+        """获取会话专属worker，失效时重建，会话数超限时关闭最久未使用的空闲会话"""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Shell进程池已关闭")
+            worker = self._sessions.get(session_id)
+            if worker is None:
+                worker = self._start_worker()
+                self._sessions[session_id] = worker
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if oldest is worker or oldest.lock.locked():
+                    break
+                del self._sessions[oldest_id]
+                oldest.close()
+        return worker
+
+    def _lock_session_worker(self, session_id: str) -> ShellWorker:
+        """取得会话专属worker并持有其锁返回，worker失效时替换
+
+        替换的worker在放入会话表之前就已加锁，同一会话的并发请求总是串行地使用同一个worker。
+        """
+        while True:
+            worker = self._session_worker(session_id)
+            worker.lock.acquire()
+            with self._condition:
+                current = self._sessions.get(session_id)
+            if current is not worker:
+                # 等待锁期间worker已被其他请求替换或随会话被关闭，改用会话当前的worker
+                worker.lock.release()
+                continue
+            if self._healthy(worker):
+                return worker
+            try:
+                worker.kill()
+                self.workers_recycled += 1
+                replacement = self._start_worker()
+                replacement.lock.acquire()
+                with self._condition:
+                    self._sessions[session_id] = replacement
+                return replacement
+            finally:
+                worker.lock.release()
+
+    def stream(self, command: str, timeout: float, session_id: Optional[str] = None,
+               max_output_bytes: int = 64 * 1024) -> Generator[Tuple[str, str], None, Tuple[bool, str]]:
+        """在池中的worker上执行命令并逐块产出输出
+
+        Args:
+            command: 要执行的shell命令
+            timeout: 超时时间（秒）
+            session_id: 会话ID，指定时由会话专属worker执行并保留shell状态
+            max_output_bytes: 每个输出流保留的最大字节数
+
+        Returns:
+            Tuple[bool, str]: (是否成功, 输出结果或错误信息)，通过 StopIteration.value 返回
+        """
+        if session_id is None:
+            worker = self._acquire_shared()
+            try:
+                return (yield from worker.stream(command, timeout, isolate=True, max_output_bytes=max_output_bytes))
+            finally:
+                self._release_shared(worker)
+
+        worker = self._lock_session_worker(session_id)
+        try:
+            return (yield from worker.stream(command, timeout, isolate=False, max_output_bytes=max_output_bytes))
+        finally:
+            worker.lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回进程池统计信息"""
+        with self._condition:
+            return {
+                "shared_workers": self._shared_count,
+                "idle_workers": len(self._idle),
+                "sessions": len(self._sessions),
+                "workers_started": self.workers_started,
+                "workers_recycled": self.workers_recycled
+            }
+
+    def close(self):
+        """关闭所有worker"""
+        with self._condition:
+            self._closed = True
+            workers = self._idle + list(self._sessions.values())
+            self._shared_count -= len(self._idle)
+            self._idle = []
+            self._sessions.clear()
+            self._condition.notify_all()
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,306 @@
+"""
+追踪模块 - 为每次请求记录耗时树（Agent迭代、LLM调用、工具调用、嵌入、检索和子进程）
+"""
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 追踪完成回调，参数为包含用户输入、命令、是否成功以及 Trace.summary() 各字段的字典
+TraceCallback = Callable[[Dict[str, Any]], None]
+
+
+class Span:
+    """耗时树中的一个节点
+
+    tracemalloc 正在跟踪内存分配时，结束时在 alloc_kb 属性中记录该span期间Python堆的净增长（KB），
+    并发请求的分配会互相混杂，只在串行执行时准确。
+    """
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"] = None, **attributes: Any):
+        """创建并开始一个span
+
+        Args:
+            name: 名称，如工具名或模型名
+            kind: 类别，如 request、iteration、llm、tool、embedding、vector_query、subprocess
+            parent: 父节点
+            **attributes: 附加属性
+        """
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.children: List["Span"] = []
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self._memory_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        if parent is not None:
+            parent.children.append(self)
+
+    def finish(self, **attributes: Any):
+        """结束span，可同时补充属性"""
+        self.attributes.update(attributes)
+        if self.end is None:
+            self.end = time.perf_counter()
+            if self._memory_start is not None and tracemalloc.is_tracing():
+                memory = tracemalloc.get_traced_memory()[0]
+                self.attributes["alloc_kb"] = round((memory - self._memory_start) / 1024, 1)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def iter_spans(self) -> Iterator["Span"]:
+        """深度优先遍历自身及所有子节点"""
+        yield self
+        for child in self.children:
+            yield from child.iter_spans()
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict[str, Any]:
+        """转换为可JSON序列化的字典，offset_ms 为相对根节点的开始时间"""
+        origin = self.start if origin is None else origin
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "children": [child.to_dict(origin) for child in self.children]
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "shell_agent_current_span", default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    """获取当前span，不在追踪中时返回None"""
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, kind: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """在当前span下记录一个子span；不在追踪中时不做任何记录"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, kind, parent, **attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def start_span(name: str, kind: str, **attributes: Any) -> Optional[Span]:
+    """在当前span下开始一个子span但不把它设为当前span，由调用方负责 finish
+
+    适用于生成器等无法用with块包住整个过程的场景；不在追踪中时返回None。
+    """
+    parent = _current_span.get()
+    return Span(name, kind, parent, **attributes) if parent is not None else None
+
+
+def child_cpu_seconds() -> float:
+    """已结束子进程累计消耗的CPU时间（用户态+内核态），不支持的平台返回0"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Trace:
+    """单次请求的追踪记录"""
+
+    def __init__(self, name: str, **attributes: Any):
+        """初始化追踪
+
+        Args:
+            name: 根节点名称
+            **attributes: 根节点属性，如用户输入
+        """
+        self.root = Span(name, "request", **attributes)
+        self.callback_handler = TracingCallbackHandler(self)
+
+    @contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        """在with块内把根节点设为当前span，结束时关闭所有未结束的节点"""
+        token = _current_span.set(self.root)
+        try:
+            yield self
+        finally:
+            _current_span.reset(token)
+            self.callback_handler.close_iteration()
+            self.root.finish()
+
+    def summary(self) -> Dict[str, Any]:
+        """汇总耗时：总耗时、各类别耗时与内存增长、LLM调用与token统计以及完整的耗时树"""
+        by_kind: Dict[str, float] = {}
+        alloc_by_kind: Dict[str, float] = {}
+        tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        counts: Dict[str, int] = {}
+        for node in self.root.iter_spans():
+            if node is self.root:
+                continue
+            counts[node.kind] = counts.get(node.kind, 0) + 1
+            if node.kind != "iteration":
+                by_kind[node.kind] = round(by_kind.get(node.kind, 0.0) + node.duration_ms, 3)
+                if "alloc_kb" in node.attributes:
+                    alloc_by_kind[node.kind] = round(alloc_by_kind.get(node.kind, 0.0) + node.attributes["alloc_kb"], 1)
+            if node.kind == "llm":
+                for key in tokens:
+                    tokens[key] += int(node.attributes.get(key) or 0)
+        return {
+            "total_ms": round(self.root.duration_ms, 3),
+            "by_kind_ms": by_kind,
+            "by_kind_alloc_kb": alloc_by_kind,
+            "iterations": counts.get("iteration", 0),
+            "llm_calls": counts.get("llm", 0),
+            "tool_calls": counts.get("tool", 0),
+            "tokens": tokens,
+            "spans": self.root.to_dict()
+        }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """LangChain回调处理器，把LLM和工具调用记录为span
+
+    Agent直接发起的每次LLM调用开始一个新的迭代，随后的工具调用归入该迭代；
+    工具内部发起的LLM调用（如错误分析）记录为该工具span的子节点。
+    """
+
+    run_inline = True
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self._spans: Dict[UUID, Span] = {}
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._tokens: Dict[UUID, contextvars.Token] = {}
+        self._iteration: Optional[Span] = None
+        self._iteration_count = 0
+        self._lock = threading.Lock()
+
+    def close_iteration(self):
+        """结束当前迭代"""
+        if self._iteration is not None:
+            self._iteration.finish()
+            self._iteration = None
+
+    def _find_span(self, run_id: Optional[UUID]) -> Optional[Span]:
+        """沿链调用的父子关系向上查找最近的已记录span"""
+        while run_id is not None:
+            if run_id in self._spans:
+                return self._spans[run_id]
+            run_id = self._parents.get(run_id)
+        return None
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._parents[run_id] = parent_run_id
+
+    def _start_llm(self, run_id: UUID, parent_run_id: Optional[UUID], serialized: Dict[str, Any], **kwargs: Any):
+        with self._lock:
+            parent = self._find_span(parent_run_id)
+            if parent is None:
+                self.close_iteration()
+                self._iteration_count += 1
+                self._iteration = Span(f"iteration {self._iteration_count}", "iteration", self.trace.root)
+                parent = self._iteration
+            model = (kwargs.get("invocation_params") or {}).get("model_name") or \
+                (kwargs.get("invocation_params") or {}).get("model") or (serialized or {}).get("name", "llm")
+            self._spans[run_id] = Span(str(model), "llm", parent)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start_llm(run_id, parent_run_id, serialized, **kwargs)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start_llm(run_id, parent_run_id, serialized, **kwargs)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        node = self._spans.pop(run_id, None)
+        if node is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    usage = {
+                        "prompt_tokens": metadata.get("input_tokens", 0),
+                        "completion_tokens": metadata.get("output_tokens", 0),
+                        "total_tokens": metadata.get("total_tokens", 0)
+                    }
+        node.finish(**{key: usage.get(key, 0) for key in ("prompt_tokens", "completion_tokens", "total_tokens")})
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        node = self._spans.pop(run_id, None)
+        if node is not None:
+            node.finish(error=str(error))
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        with self._lock:
+            parent = self._find_span(parent_run_id) or self._iteration or self.trace.root
+            node = Span((serialized or {}).get("name", "tool"), "tool", parent)
+            self._spans[run_id] = node
+        # 工具内部的嵌入、检索和子进程span挂到该工具下
+        self._tokens[run_id] = _current_span.set(node)
+
+    def _end_tool(self, run_id: UUID, **attributes: Any):
+        node = self._spans.pop(run_id, None)
+        token = self._tokens.pop(run_id, None)
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                _current_span.set(node.parent if node is not None else self.trace.root)
+        if node is not None:
+            node.finish(**attributes)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_tool(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_tool(run_id, error=str(error))
+
+
+class TraceFileWriter:
+    """把每次请求的追踪记录追加写入JSONL文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, trace: Dict[str, Any]):
+        line = json.dumps(trace, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def format_span_tree(node: Dict[str, Any], indent: int = 0) -> str:
+    """把 Span.to_dict() 的结果格式化为缩进的文本树，供 --profile 打印"""
+    details = " ".join(f"{k}={v}" for k, v in node.get("attributes", {}).items() if k != "input")
+    line = f"{'  ' * indent}{node['name']} [{node['kind']}] {node['duration_ms']:.1f}ms {details}".rstrip()
+    lines = [line]
+    for child in node.get("children", []):
+        lines.append(format_span_tree(child, indent + 1))
+    return "\n".join(lines)
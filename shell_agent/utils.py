@@ -1,8 +1,10 @@
 """
 工具类模块 - 提供通用功能支持
 """
+import hashlib
 import os
 import platform
+import re
 from typing import Dict, Any, Optional
 from langchain_core.documents import Document
 
@@ -25,6 +27,21 @@ class PlatformUtils:
 class DocumentUtils:
     """文档处理工具类"""
 
+    _TRAILING_PUNCTUATION_RE = re.compile(r"[\s。.!！?？,，;；]+$")
+    _WHITESPACE_RE = re.compile(r"\s+")
+
+    @classmethod
+    def normalize_user_input(cls, user_input: str) -> str:
+        """规范化用户输入：去除首尾空白和结尾标点、合并空白、转为小写"""
+        text = cls._WHITESPACE_RE.sub(" ", user_input.strip())
+        return cls._TRAILING_PUNCTUATION_RE.sub("", text).lower()
+
+    @classmethod
+    def history_id(cls, user_input: str, command: str) -> str:
+        """根据规范化的用户输入和命令生成稳定的历史记录ID，用于去重和更新"""
+        key = f"{cls.normalize_user_input(user_input)}\0{command.strip()}"
+        return "history-" + hashlib.sha1(key.encode("utf-8")).hexdigest()
+
     @staticmethod
     def create_documents(documents: list, metadatas: Optional[list] = None) -> list[Document]:
         """创建带metadata的Document对象列表
@@ -44,29 +61,33 @@ class DocumentUtils:
         return doc_objects
 
     @staticmethod
-    def create_shell_history_document(user_input: str, command: str, result: str, success: bool) -> tuple[str, Dict[str, Any]]:
-        """创建shell历史文档内容和元数据
+    def create_compact_history_document(user_input: str, command: str, result: str, success: bool,
+                                        max_output_length: int = 200) -> tuple[str, Dict[str, Any]]:
+        """创建紧凑的shell历史文档，只嵌入用户请求和命令
+
+        输出内容截断后只保存在元数据中，文档内容长度有界，无需再分割；
+        相同的请求和命令总是得到相同的文档内容，重复执行不会产生新的嵌入。
 
         Args:
             user_input: 用户输入
             command: 执行的命令
             result: 命令执行结果
             success: 命令是否成功执行
+            max_output_length: 元数据中保留的输出预览最大长度
 
         Returns:
             tuple[str, Dict[str, Any]]: (文档内容, 元数据)
         """
-        document = f"""
-用户请求: {user_input}
-执行命令: {command}
-执行结果: {'成功' if success else '失败'}
-输出内容: {result}
-"""
+        document = f"用户请求: {user_input.strip()}\n执行命令: {command.strip()}"
+        preview = result.strip()
+        if len(preview) > max_output_length:
+            preview = preview[:max_output_length] + "..."
         metadata = {
             "type": "shell_history",
             "user_input": user_input,
             "command": command,
-            "success": success
+            "success": success,
+            "output_preview": preview
         }
         return document, metadata
 
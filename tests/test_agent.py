@@ -0,0 +1,69 @@
+import pytest
+
+from benchmarks.offline import FakeChatModel
+from shell_agent.agent import ShellAgent
+from shell_agent.embeddings import HashingEmbeddings
+
+
+@pytest.fixture
+def make_agent(tmp_path):
+    agents = []
+
+    def make(commands=None, **kwargs):
+        agent = ShellAgent(rag_persist_directory=str(tmp_path),
+                           llm=FakeChatModel(commands=commands or {"打印hello": "echo hello"}),
+                           embeddings=HashingEmbeddings(), embedding_backend="hashing", write_behind_history=False,
+                           **kwargs)
+        agents.append(agent)
+        return agent
+
+    yield make
+    for agent in agents:
+        agent.close()
+
+
+def test_verbose_is_passed_to_the_executor(make_agent):
+    assert make_agent(verbose=False).agent_executor.verbose is False
+    assert make_agent().agent_executor.verbose is True
+
+
+def test_direct_pipeline_does_not_build_the_executor(make_agent):
+    agent = make_agent(pipeline="direct", lazy_init=True, verbose=False, enable_cache=False)
+    result = agent.process_input("打印hello")
+    assert result["success"] and result["command"] == "echo hello"
+    assert "agent_executor" not in agent._components
+
+
+def test_system_prompt_is_compacted_only_with_context_budget(make_agent):
+    def system_prompt(agent):
+        return agent.direct_chain.first.messages[0].prompt.template
+
+    assert "\n        " not in system_prompt(make_agent())
+    assert "\n        " in system_prompt(make_agent(context_budget=False))
+
+
+def test_speculation_gates_on_request_similarity(make_agent):
+    agent = make_agent(pipeline="speculative", lazy_init=True, verbose=False)
+    # 文档向量距离 0.36 换算的相似度只有 0.82，而请求之间的相似度为 0.988
+    paraphrase = {"user_input": "列出当前目录的文件", "command": "ls -la", "success": True,
+                  "similarity_score": 0.36, "request_similarity": 0.988}
+    assert agent._speculation_candidate([paraphrase]) == "ls -la"
+    assert agent._speculation_candidate([dict(paraphrase, request_similarity=0.5)]) is None
+    assert agent._speculation_candidate([dict(paraphrase, request_similarity=None, similarity_score=0.0)]) is None
+    assert agent._speculation_candidate([dict(paraphrase, command="rm -rf build")]) is None
+
+
+def test_failed_fast_path_falls_back_to_the_pipeline(make_agent):
+    agent = make_agent(commands={"ls /no/such/dir": "echo fallback"}, pipeline="direct", lazy_init=True,
+                       verbose=False, enable_cache=False)
+    saved = []
+    agent.rag_search.add_shell_command_history = lambda user_input, command, output, success: saved.append(command)
+    result = agent.process_input("ls /no/such/dir")
+    assert not result["fast_path"]
+    assert result["success"] and result["command"] == "echo fallback"
+    # 失败的字面命令不保存为这个请求的历史
+    assert saved == ["echo fallback"]
+
+    result = agent.process_input("ls -d /")
+    assert result["fast_path"] and result["output"] == "/\n"
+    assert saved == ["echo fallback", "ls -d /"]
@@ -0,0 +1,56 @@
+import pytest
+
+from shell_agent.cache import CommandCache, LRUTTLCache
+from shell_agent.rag_search import RAGSearch
+
+
+def test_lru_ttl_cache_evicts_and_expires():
+    cache = LRUTTLCache(max_size=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.set("old", 4, stored_at=0)
+    assert cache.get("old") is None
+
+
+def test_match_similar_uses_request_similarity():
+    cache = CommandCache("model", similarity_threshold=0.95)
+    similar = [
+        {"user_input": "a", "command": "du -sh /tmp", "success": True, "similarity_score": 0.8,
+         "request_similarity": 0.97},
+        {"user_input": "b", "command": "rm -rf /tmp/x", "success": False, "similarity_score": 0.0,
+         "request_similarity": 1.0},
+    ]
+    entry = cache.match_similar(similar)
+    assert entry == {"user_input": "a", "command": "du -sh /tmp", "similarity": 0.97}
+    assert cache.match_similar([dict(similar[0], request_similarity=0.9)]) is None
+    assert cache.match_similar([dict(similar[0], request_similarity=None)]) is None
+
+
+@pytest.fixture
+def rag(tmp_path):
+    rag = RAGSearch(persist_directory=str(tmp_path), write_behind=False, embedding_backend="hashing")
+    rag.add_shell_command_history("show disk usage of the /tmp directory", "du -sh /tmp", "4.0K\t/tmp", True)
+    rag.add_shell_command_history("count lines in main.py", "wc -l main.py", "120 main.py", True)
+    yield rag
+    rag.close()
+
+
+@pytest.mark.parametrize("mode", ["hybrid", "vector"])
+def test_identical_request_is_a_near_hit(rag, mode):
+    cache = CommandCache("model")
+    similar = rag.get_similar_commands("Show disk usage of the /tmp directory.", k=2, mode=mode)
+    entry = cache.match_similar(similar)
+    assert entry is not None and entry["command"] == "du -sh /tmp"
+    assert entry["similarity"] == 1.0
+
+
+def test_paraphrase_hits_and_unrelated_request_misses(rag):
+    cache = CommandCache("model")
+    entry = cache.match_similar(rag.get_similar_commands("show the disk usage of the /tmp directory", k=2))
+    assert entry is not None and entry["command"] == "du -sh /tmp"
+    assert 0.95 <= entry["similarity"] < 1.0
+    assert cache.match_similar(rag.get_similar_commands("count words in main.py", k=2)) is None
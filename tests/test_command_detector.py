@@ -0,0 +1,47 @@
+import pytest
+
+from shell_agent.command_detector import CommandDetector
+
+
+@pytest.fixture
+def detector():
+    return CommandDetector()
+
+
+@pytest.mark.parametrize("text", [
+    "free memory",
+    "help me",
+    "file size of main.py",
+    "type of file main.py",
+    "find large files",
+    "show disk usage",
+    "列出当前目录",
+    # 不带参数时读取标准输入、交互式或永不结束的程序
+    "python",
+    "cat",
+    "less",
+    "less README.md",
+    "yes",
+    "top",
+])
+def test_natural_language_and_blocking_programs_are_not_commands(detector, text):
+    assert detector.detect(text) is None
+
+
+@pytest.mark.parametrize("text", [
+    "ls -la",
+    "ls tests",
+    "pwd",
+    "date",
+    "free -h",
+    "git status",
+    "git log --oneline -3",
+    "du -sh .",
+    "kill -0 1",
+    "echo $HOME",
+    "cat README.md",
+    "ps aux | grep python",
+    "python -c 'print(1)'",
+])
+def test_literal_commands_are_detected(detector, text):
+    assert detector.detect(text) == text
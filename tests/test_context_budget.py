@@ -0,0 +1,55 @@
+from langchain_core.agents import AgentActionMessageLog
+from langchain_core.messages import AIMessage
+
+from shell_agent.context import request_context
+from shell_agent.context_budget import ContextBudget, TokenCounter
+
+
+def step(index, observation, tool="execute_shell_command"):
+    call_id = f"call-{index}"
+    message = AIMessage(content="", tool_calls=[{"name": tool, "args": {"command": "ls"}, "id": call_id}])
+
+    class Action(AgentActionMessageLog):
+        tool_call_id: str
+
+    return Action(tool=tool, tool_input={"command": "ls"}, log="", message_log=[message], tool_call_id=call_id), \
+        observation
+
+
+def test_truncate_keeps_head_and_tail():
+    counter = TokenCounter()
+    text = "开头" + "x" * 4000 + "结尾错误"
+    truncated = counter.truncate(text, 100)
+    assert truncated.startswith("开头") and truncated.endswith("结尾错误")
+    assert counter.count(truncated) < 150
+    assert counter.truncate("short", 100) == "short"
+
+
+def test_fixed_prompt_savings_are_counted_once_per_request():
+    budget = ContextBudget(max_prompt_tokens=None, max_observation_tokens=None)
+    budget.set_fixed_prompt("prompt", [], original_prompt="prompt" + " " * 400)
+    assert budget.fixed_tokens_saved > 0
+    steps = [step(0, (True, "ok"))]
+    with request_context() as context:
+        budget.format_scratchpad([], "input")
+        budget.format_scratchpad(steps, "input")
+        budget.format_scratchpad(steps, "input")
+        assert context.tokens_saved == budget.fixed_tokens_saved
+    with request_context() as context:
+        budget.format_scratchpad(steps, "input")
+        assert context.tokens_saved == budget.fixed_tokens_saved
+
+
+def test_observations_are_truncated_and_oldest_dropped_over_budget():
+    budget = ContextBudget(max_prompt_tokens=400, max_observation_tokens=200)
+    steps = [step(index, (True, "line\n" * 2000)) for index in range(3)]
+    with request_context() as context:
+        messages = budget.format_scratchpad(steps, "input")
+        assert context.tokens_saved > 0
+        assert context.max_prompt_tokens <= 400
+    tool_messages = [message for message in messages if message.type == "tool"]
+    assert len(tool_messages) == 3
+    assert tool_messages[0].content.startswith("（为控制上下文长度")
+    assert "line" in tool_messages[-1].content
+    # 中间步骤本身不被修改
+    assert steps[0][1][1] == "line\n" * 2000
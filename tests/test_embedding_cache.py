@@ -0,0 +1,95 @@
+import itertools
+
+import pytest
+
+from benchmarks.offline import FakeEmbeddings
+from shell_agent import embedding_cache
+from shell_agent.embedding_cache import CachedEmbeddings
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    """记录每次发送给底层模型的文本"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # 递增的假时钟，保证访问时间严格有序
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(ticks)))
+
+
+def test_only_misses_are_forwarded(tmp_path):
+    inner = RecordingEmbeddings()
+    cache = CachedEmbeddings(inner, str(tmp_path / "cache.db"))
+    try:
+        first = cache.embed_documents(["list files", "show disk usage"])
+        vectors = cache.embed_documents(["show disk usage", "print date", "list files", "print date"])
+        assert inner.calls == [["list files", "show disk usage"], ["print date"]]
+        assert vectors[0] == first[1] and vectors[2] == first[0] and vectors[1] == vectors[3]
+        assert cache.embed_query("list files") == first[0]
+        assert len(inner.calls) == 2
+        assert cache.stats() == {"hits": 4, "misses": 3, "size": 3}
+    finally:
+        cache.close()
+
+
+def test_hits_survive_reopening(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = CachedEmbeddings(RecordingEmbeddings(), path)
+    vector = cache.embed_query("list files")
+    cache.close()
+
+    inner = RecordingEmbeddings()
+    reopened = CachedEmbeddings(inner, path)
+    try:
+        assert reopened.embed_documents(["list files"]) == [vector]
+        assert inner.calls == []
+        assert reopened.stats()["size"] == 1
+    finally:
+        reopened.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    inner = RecordingEmbeddings()
+    cache = CachedEmbeddings(inner, str(tmp_path / "cache.db"), max_entries=2)
+    try:
+        cache.embed_documents(["a"])
+        cache.embed_documents(["b"])
+        cache.embed_query("a")  # 刷新 a 的访问时间，b 成为最久未访问的条目
+        cache.embed_documents(["c"])
+        assert cache.stats()["size"] == 2
+        inner.calls.clear()
+        cache.embed_documents(["a", "c"])
+        assert inner.calls == []
+        cache.embed_documents(["b"])
+        assert inner.calls == [["b"]]
+    finally:
+        cache.close()
+
+
+def test_keys_are_separated_by_model_name(tmp_path):
+    path = str(tmp_path / "cache.db")
+    small = CachedEmbeddings(RecordingEmbeddings(dimensions=8), path)
+    inner = RecordingEmbeddings(dimensions=16)
+    large = CachedEmbeddings(inner, path)
+    try:
+        assert small.model_name != large.model_name
+        assert len(small.embed_query("list files")) == 8
+        assert len(large.embed_query("list files")) == 16
+        assert inner.calls == [["list files"]]
+        assert large.stats()["size"] == 1
+    finally:
+        small.close()
+        large.close()
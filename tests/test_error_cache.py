@@ -0,0 +1,61 @@
+import json
+
+from shell_agent.error_cache import ErrorAnalysisCache, ErrorRules, ErrorSignature
+
+ANALYSIS = ("1. 错误原因分析: `cat /tmp/a.txt` 读取的文件不存在。\n"
+            "2. 解决方案: 确认路径拼写。\n"
+            "3. 修正后的命令:\n```bash\ncat /tmp/a.txt.bak\n```")
+
+
+def test_signature_ignores_volatile_parts():
+    first = ErrorSignature.make("cat /tmp/a.txt", "cat: /tmp/a.txt: No such file or directory")
+    second = ErrorSignature.make("cat ./b.log", "cat: ./b.log: No such file or directory")
+    assert first == second
+    assert ErrorSignature.normalize("error at 2024-01-02T03:04:05Z in pid 4242, addr 0xdeadbeef") == \
+        "error at <time> in pid <n>, addr <hex>"
+    assert ErrorSignature.normalize(r"C:\Users\me\x.txt not found") == "<path> not found"
+
+
+def test_signature_uses_executable_after_wrappers():
+    assert ErrorSignature.executable("sudo -n FOO=1 /usr/bin/apt install x") == "apt"
+    assert ErrorSignature.executable("LANG=C ls -la") == "ls"
+    assert ErrorSignature.executable("echo 'unterminated") == "echo"
+    assert ErrorSignature.make("ls /a", "denied")[0] != ErrorSignature.make("cat /a", "denied")[0]
+
+
+def test_rules_answer_common_errors():
+    rules = ErrorRules()
+    analysis = rules.match("foo --bar", "bash: foo: command not found")
+    assert "`foo`" in analysis and "`foo --bar`" in analysis
+    assert rules.match("ls", "something unusual") is None
+    assert rules.hits == 1
+
+
+def test_cached_diagnosis_is_not_tied_to_the_original_command():
+    cache = ErrorAnalysisCache()
+    cache.put("cat /tmp/a.txt", "cat: /tmp/a.txt: No such file or directory", ANALYSIS)
+    analysis = cache.get("cat ./b.log", "cat: ./b.log: No such file or directory")
+    assert analysis is not None
+    assert "a.txt.bak" not in analysis and "/tmp/a.txt" not in analysis
+    assert "`cat ./b.log` 读取的文件不存在" in analysis
+    assert analysis.endswith("请根据上述解决方案调整命令 `cat ./b.log` 后重试。")
+    assert cache.get("ls /tmp/a.txt", "ls: /tmp/a.txt: No such file or directory") is None
+
+
+def test_entries_are_persisted_in_batches(tmp_path):
+    path = str(tmp_path / "errors.jsonl")
+    cache = ErrorAnalysisCache(path, save_batch_size=3)
+    for index in range(2):
+        cache.put(f"tool{index} x", "fatal: boom", ANALYSIS)
+    assert not (tmp_path / "errors.jsonl").exists()
+    cache.put("tool2 x", "fatal: boom", ANALYSIS)
+    assert len((tmp_path / "errors.jsonl").read_text(encoding="utf-8").splitlines()) == 3
+    cache.put("tool3 x", "fatal: boom", ANALYSIS)
+    cache.close()
+    lines = (tmp_path / "errors.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 4
+    assert "a.txt.bak" not in json.loads(lines[0])["diagnosis"]
+
+    reloaded = ErrorAnalysisCache(path)
+    assert reloaded.get("tool3 y", "fatal: boom").endswith("`tool3 y` 后重试。")
+    assert reloaded.stats()["size"] == 4
@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+
+from shell_agent.history_writer import HistoryWriter
+
+
+def journal_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_written_in_batches_and_journal_is_cleared(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    batches = []
+    writer = HistoryWriter(batches.append, path, batch_size=4, flush_interval=0.2)
+    for index in range(10):
+        writer.submit({"index": index})
+    assert writer.flush(timeout=5)
+    assert sorted(record["index"] for batch in batches for record in batch) == list(range(10))
+    assert all(len(batch) <= 4 and "_id" not in batch[0] for batch in batches)
+    assert os.path.getsize(path) == 0
+    writer.close()
+
+
+def test_submit_does_not_fsync_each_record(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+    release = threading.Event()
+    writer = HistoryWriter(lambda records: release.wait(5), str(tmp_path / "journal.jsonl"), batch_size=50,
+                           flush_interval=0.2)
+    synced.clear()
+    for index in range(50):
+        writer.submit({"index": index})
+    # 50 条记录凑成一批，只在写入前 fsync 一次
+    release.set()
+    assert writer.flush(timeout=5)
+    assert len(synced) <= 4
+    writer.close()
+
+
+def test_unwritten_records_are_replayed_once(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    written = []
+    fail = threading.Event()
+    fail.set()
+
+    def write_batch(records):
+        if fail.is_set() and any(record["index"] >= 2 for record in records):
+            raise RuntimeError("数据库不可用")
+        written.extend(record["index"] for record in records)
+
+    writer = HistoryWriter(write_batch, path, batch_size=2, flush_interval=0.05, retry_interval=0.05)
+    for index in range(4):
+        writer.submit({"index": index})
+    assert not writer.flush(timeout=0.5)
+    assert written == [0, 1]
+    # 已写入的记录标记为完成，未写入的仍在日志中
+    assert any("_done" in entry for entry in journal_lines(path))
+
+    restarted = []
+    replay = HistoryWriter(lambda records: restarted.extend(record["index"] for record in records), path,
+                           batch_size=10, flush_interval=0.05)
+    assert replay.flush(timeout=5)
+    assert sorted(restarted) == [2, 3]
+    fail.clear()
+    replay.close()
+    writer.close(timeout=5)
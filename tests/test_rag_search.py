@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+from shell_agent.lexical_index import BM25Index
+from shell_agent.maintenance import RetentionPolicy
+from shell_agent.rag_search import _SEGMENT_DIR_RE, RAGSearch
+
+
+def result(doc_id, distance=None, **extra):
+    return dict({"id": doc_id, "user_input": doc_id, "command": doc_id, "success": True,
+                 "similarity_score": distance}, **extra)
+
+
+def test_bm25_ranks_rare_terms_and_persists(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    index = BM25Index(path)
+    index.add_many([("du", "查看 /tmp 目录的磁盘占用 du -sh /tmp", {"command": "du -sh /tmp"}),
+                    ("ls", "列出 /tmp 目录的文件 ls -la /tmp", {"command": "ls -la /tmp"}),
+                    ("wc", "统计 main.py 的行数 wc -l main.py", {"command": "wc -l main.py"})])
+    assert [doc_id for doc_id, _, _ in index.search("磁盘占用", k=3)] == ["du"]
+    assert [doc_id for doc_id, _, _ in index.search("/tmp 文件", k=3)][0] == "ls"
+    # -sh 同时以 sh 索引
+    assert index.search("sh", k=1)[0][0] == "du"
+
+    index.remove_many(["ls"])
+    reloaded = BM25Index(path)
+    assert len(reloaded) == 2
+    assert reloaded.get_payload("wc") == {"command": "wc -l main.py"}
+    assert reloaded.search("/tmp 文件", k=3)[0][0] == "du"
+
+
+def test_fuse_ranks_by_reciprocal_rank():
+    vector = [result("a", 0.4), result("b", 0.5), result("c", 0.6)]
+    lexical = [result("b", lexical_score=3.0), result("c", lexical_score=2.0)]
+    fused = RAGSearch._fuse(vector, lexical, k=3)
+    # b 和 c 都出现在两路结果中，排在只有向量结果的 a 之前
+    assert [item["id"] for item in fused] == ["b", "c", "a"]
+    assert fused[0]["lexical_score"] == 3.0 and fused[0]["similarity_score"] == 0.5
+    assert RAGSearch._fuse(vector, lexical, k=1)[0]["id"] == "b"
+
+
+def test_fuse_keeps_exact_lexical_match_first():
+    vector = [result("a", 0.3), result("exact", 0.8)]
+    lexical = [result("exact", 0.0, lexical_score=5.0), result("a", lexical_score=1.0)]
+    fused = RAGSearch._fuse(vector, lexical, k=2)
+    assert fused[0]["id"] == "exact"
+    assert fused[0]["similarity_score"] == 0.0
+    assert fused[1]["similarity_score"] == 0.3
+
+
+def segment_dirs(path):
+    return sorted(name for name in os.listdir(path) if _SEGMENT_DIR_RE.fullmatch(name))
+
+
+def test_compaction_removes_only_orphaned_segments(tmp_path):
+    rag = RAGSearch(persist_directory=str(tmp_path), write_behind=False, embedding_backend="hashing")
+    try:
+        for index in range(20):
+            rag.add_shell_command_history(f"show file number {index}", f"cat file{index}.txt", "", True)
+        rag.add_shell_command_history("show file number 1", "cat file1.txt", "", True, tenant="alice")
+        before = segment_dirs(str(tmp_path))
+
+        report = rag.maintain(policy=RetentionPolicy(max_entries=5), compact=True, latency_queries=0)
+        assert report["removed"]["capacity"] == 15
+
+        with sqlite3.connect(os.path.join(str(tmp_path), "chroma.sqlite3")) as connection:
+            segments = {row[0] for row in connection.execute("SELECT id FROM segments")}
+        after = segment_dirs(str(tmp_path))
+        assert set(after) <= segments
+        assert not set(before) & set(after)
+        # 客户端关闭后重新打开，检索和写入照常进行
+        assert rag.get_similar_commands("show file number 19", k=1, mode="vector")[0]["command"] == "cat file19.txt"
+        assert rag.get_similar_commands("show file number 1", k=1, tenant="alice")[0]["command"] == "cat file1.txt"
+        rag.add_shell_command_history("list files", "ls", "", True)
+        assert rag.index_stats()
+    finally:
+        rag.close()
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from shell_agent.sandbox import ResourceLimits
+from shell_agent.shell_executor import BoundedOutput, ShellExecutor
+
+
+def test_bounded_output_keeps_contiguous_output():
+    # 开头4字节、结尾5字节，分界落在第二个字中间
+    buffer = BoundedOutput(9)
+    buffer.write("中文".encode("utf-8"))
+    buffer.write("字".encode("utf-8"))
+    assert buffer.getvalue("utf-8") == "中文字"
+
+
+def test_bounded_output_does_not_split_multibyte_characters():
+    # 每个汉字3字节：开头5字节截在第二个字中间，结尾5字节从倒数第二个字中间开始
+    data = "一二三四五六七八".encode("utf-8")
+    buffer = BoundedOutput(10)
+    for i in range(0, len(data), 4):
+        buffer.write(data[i:i + 4])
+    value = buffer.getvalue("utf-8")
+    assert "�" not in value
+    head, _, tail = value.partition("\n... ")
+    assert head == "一"
+    assert tail.endswith("\n八")
+    assert f"省略 {len(data) - 6} 字节" in value
+
+
+def test_streaming_closes_pipes():
+    executor = ShellExecutor(timeout=5, stream_output=True)
+    pipes = []
+    create = executor._create_subprocess
+
+    def create_subprocess(command, text=True):
+        process = create(command, text)
+        pipes.extend([process.stdout, process.stderr])
+        return process
+
+    executor._create_subprocess = create_subprocess
+    assert executor.execute_command("echo hi; echo err >&2") == (True, "hi\n")
+    for pipe in pipes:
+        # 读取线程在EOF后关闭管道
+        for _ in range(100):
+            if pipe.closed:
+                break
+            time.sleep(0.01)
+        assert pipe.closed
+
+
+def _alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # 第三个字段为进程状态，Z 表示已退出但尚未被回收
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _assert_timeout_kills_children(tmp_path, run):
+    pid_file = tmp_path / "pid"
+    success, output = run(f"sleep 30 & echo $! > {pid_file}; wait")
+    assert not success and "超时" in output
+    pid = int(pid_file.read_text())
+    for _ in range(100):
+        if not _alive(pid):
+            break
+        time.sleep(0.01)
+    assert not _alive(pid)
+
+
+def test_timeout_kills_process_group(tmp_path):
+    _assert_timeout_kills_children(tmp_path, ShellExecutor(timeout=0.5).execute_command)
+
+
+def test_streaming_timeout_kills_process_group(tmp_path):
+    _assert_timeout_kills_children(tmp_path, ShellExecutor(timeout=0.5, stream_output=True).execute_command)
+
+
+def test_async_timeout_kills_process_group(tmp_path):
+    executor = ShellExecutor(timeout=0.5)
+    _assert_timeout_kills_children(tmp_path, lambda command: asyncio.run(executor.aexecute_command(command)))
+
+
+def test_commands_read_empty_stdin():
+    assert ShellExecutor(timeout=2).execute_command("cat") == (True, "")
+    assert ShellExecutor(timeout=2, stream_output=True).execute_command("wc -c") == (True, "0\n")
+
+
+def test_sandbox_limits_are_applied_without_preexec_fn():
+    limits = ResourceLimits(cpu_seconds=5, memory_bytes=512 * 1024 * 1024, file_size_bytes=1024 * 1024,
+                            open_files=64)
+    assert "preexec_fn" not in limits.popen_kwargs()
+    executor = ShellExecutor(timeout=5, resource_limits=limits)
+    success, output = executor.execute_command("ulimit -t; ulimit -v; ulimit -f; ulimit -n; ulimit -Hn")
+    assert success and output.split() == ["5", str(512 * 1024), "1024", "64", "64"]
+    # 子进程继承上限，且不能再提高
+    success, output = executor.execute_command("ulimit -n 1024")
+    assert not success
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from shell_agent.shell_pool import ShellPool, ShellWorker
+
+
+@pytest.fixture
+def pool():
+    pool = ShellPool(size=1)
+    yield pool
+    pool.close()
+
+
+def run(pool, command, session_id=None, timeout=5):
+    stream = pool.stream(command, timeout, session_id=session_id)
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+
+def test_worker_framing_separates_commands():
+    worker = ShellWorker()
+    try:
+        assert worker.run("printf 'a\\nb'", 5) == (True, "a\nb")
+        # 输出中出现与分隔符相似的文本时不影响切分
+        assert worker.run(f"echo '{worker.sentinel[:10]}'; echo done", 5) == (True, f"{worker.sentinel[:10]}\ndone\n")
+        success, output = worker.run("echo oops >&2; exit_code() { return 3; }; exit_code", 5)
+        assert not success and output == "oops\n"
+        assert worker.run("echo next", 5) == (True, "next\n")
+    finally:
+        worker.close()
+
+
+def test_worker_timeout_kills_worker():
+    worker = ShellWorker()
+    try:
+        success, output = worker.run("sleep 5", 0.2)
+        assert not success and "超时" in output
+        assert not worker.alive
+    finally:
+        worker.close()
+
+
+def test_abandoned_stream_does_not_leak_into_next_command(pool):
+    stream = pool.stream("echo first; sleep 0.5; echo second", 5)
+    assert next(stream) == ("stdout", "first")
+    stream.close()
+    assert run(pool, "echo third") == (True, "third\n")
+    assert run(pool, "echo fourth") == (True, "fourth\n")
+    assert pool.stats()["workers_recycled"] == 1
+
+
+def test_abandoned_session_stream_replaces_worker(pool):
+    assert run(pool, "cd /tmp", session_id="s") == (True, "")
+    stream = pool.stream("echo first; sleep 0.5; echo second", 5, session_id="s")
+    next(stream)
+    stream.close()
+    assert run(pool, "echo third", session_id="s") == (True, "third\n")
+
+
+def test_session_keeps_shell_state(pool):
+    run(pool, "cd /tmp && export SHELL_POOL_TEST=1", session_id="s")
+    assert run(pool, "pwd; echo $SHELL_POOL_TEST", session_id="s") == (True, "/tmp\n1\n")
+    # 共享worker在子shell中执行，不保留状态
+    run(pool, "export SHELL_POOL_TEST=2")
+    assert run(pool, "echo ${SHELL_POOL_TEST:-unset}") == (True, "unset\n")
+
+
+def test_concurrent_requests_on_replaced_session_worker_are_serialized(pool):
+    run(pool, "true", session_id="s")
+    pool._sessions["s"].kill()
+    results = {}
+
+    def request(i):
+        results[i] = run(pool, f"echo start-{i}; sleep 0.2; echo end-{i}", session_id="s")
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: (True, f"start-{i}\nend-{i}\n") for i in range(4)}
+    assert pool.stats()["workers_recycled"] == 1
+    assert pool.stats()["sessions"] == 1